@@ -1,11 +1,19 @@
 # ai.py
 from fighter import *
+from dice import attack_table
+from logging import DEBUG
+from math import log, sqrt
+from time import perf_counter
+from weakref import WeakKeyDictionary
+import combat
 import random
 
 class BaseAI:
+    def __init__(self, search_radius=None):
+        self.search_radius = search_radius  # only consider enemies this close, if any are
+
     def take_turn(self, fighter):
-        neighbors = fighter.battle.map.get_neighbors(fighter.position)
-        enemies_in_range = [neighbor.fighter for neighbor in neighbors if neighbor.fighter and neighbor.fighter.faction != fighter.faction]
+        enemies_in_range = self.find_enemies_in_range(fighter)
 
         if enemies_in_range:
             target = self.select_target(fighter, enemies_in_range)
@@ -23,23 +31,44 @@ class BaseAI:
             if not fighter.battle.map.is_position_occupied(next_position):
                 fighter.move_to(next_position)
             else:
-                print(f"{fighter.name} cannot move to {next_position}, position is occupied.")
+                fighter.battle.log('%s cannot move to %s, position is occupied.', fighter.name, next_position, level=DEBUG)
+        else:
+            fighter.battle.log('%s cannot find a path to %s.', fighter.name, target_position, level=DEBUG)
+
+    def advance(self, fighter, target):
+        profiler = fighter.battle.profiler
+        started = profiler and perf_counter()
+        # everyone chasing the same target shares its cached distance field; with
+        # no free step downhill the fighter holds its ground, as in the numpy engine
+        step = fighter.battle.map.step_towards(fighter.position, target.position)
+        if step:
+            fighter.move_to(step)
         else:
-            print(f"{fighter.name} cannot find a path to {target_position}.")
+            fighter.battle.log('%s is blocked and holds its ground.', fighter.name, level=DEBUG)
+        if profiler:
+            profiler.stop('movement', started)
 
     def attack(self, fighter, target):
         distance = fighter.battle.map.calculate_distance(fighter.position, target.position)
         if fighter.weapon.range >= distance:
             fighter.attack(target)
         else:
-            self.move_towards(fighter, target.position)
+            self.advance(fighter, target)
 
     def find_nearest_enemy(self, fighter):
-        opponents = [f for f in fighter.battle.fighters if f.faction != fighter.faction]
-        if not opponents:
-            return None
-        closest_enemy = min(opponents, key=lambda f: fighter.battle.map.calculate_distance(fighter.position, f.position))
-        return closest_enemy
+        return fighter.battle.map.nearest_enemy(fighter.position, fighter.faction)
+
+    def find_enemies_in_range(self, fighter):
+        reach = fighter.weapon.range if fighter.weapon else 1
+        nearby = fighter.battle.map.fighters_within(fighter.position, reach)
+        return [f for f in nearby if f.faction != fighter.faction]
+
+    def find_enemies(self, fighter):
+        if self.search_radius is not None:
+            nearby = fighter.battle.map.enemies_within(fighter.position, fighter.faction, self.search_radius)
+            if nearby:
+                return nearby
+        return fighter.battle.opponents(fighter.faction)
 
     def select_target(self, fighter, opponents=None):
         raise NotImplementedError("Subclasses must implement this method")
@@ -47,7 +76,7 @@ class BaseAI:
 class RandomAttackAI(BaseAI):
     def select_target(self, fighter, opponents=None):
         if not opponents:
-            opponents = [f for f in fighter.battle.fighters if f.faction != fighter.faction]
+            opponents = self.find_enemies(fighter)
         if opponents:
             return random.choice(opponents)
         return None
@@ -55,7 +84,7 @@ class RandomAttackAI(BaseAI):
 class LowestHealthAI(BaseAI):
     def select_target(self, fighter, opponents=None):
         if not opponents:
-            opponents = [f for f in fighter.battle.fighters if f.faction != fighter.faction]
+            opponents = self.find_enemies(fighter)
         if opponents:
             return min(opponents, key=lambda x: x.health)
         return None
@@ -63,25 +92,59 @@ class LowestHealthAI(BaseAI):
 class GreatestThreatAI(BaseAI):
     def select_target(self, fighter, opponents=None):
         if not opponents:
-            opponents = [f for f in fighter.battle.fighters if f.faction != fighter.faction]
+            opponents = self.find_enemies(fighter)
         if opponents:
             return max(opponents, key=lambda x: self.calculate_threat(x))
         return None
 
     def calculate_threat(self, opponent):
         if opponent.weapon and opponent.weapon.name in weapon_list:
-            dice, sides, addend, range = weapon_list[opponent.weapon.name]
-            average_roll = dice * (1 + sides) / 2
-            return average_roll + addend + opponent.damage_bonus
+            return combat.average_damage(opponent.weapon.name, opponent.damage_bonus)
         return 0
 
+class ExpectedSurvivalAI(BaseAI):
+    # strategy.txt: size up each opponent by how many turns this fighter is
+    # expected to survive against it, and go for the one that would bring
+    # it down soonest. An opponent out of reach first has to close in, one
+    # square a turn, along its cheapest path to this fighter.
+    def select_target(self, fighter, opponents=None):
+        if not opponents:
+            opponents = self.find_enemies(fighter)
+        return min(opponents, key=self.survival_estimator(fighter), default=None)
+
+    def expected_survival(self, fighter, opponent):
+        return self.survival_estimator(fighter)(opponent)
+
+    def survival_estimator(self, fighter):
+        # what is fixed for this fighter's decision is looked up once
+        armor_class, health, position = fighter.armor_class, fighter.health, fighter.position
+        map = fighter.battle.map
+        calculate_distance, height = map.calculate_distance, map.height
+        damage_per_turn = combat.expected_damage_per_turn
+        field = None  # the cached distance field to this fighter, once someone is out of reach
+
+        def expected_survival(opponent):
+            nonlocal field
+            weapon = opponent.weapon
+            if weapon is None or weapon.name not in weapon_list:
+                return float('inf')
+            damage = damage_per_turn(weapon.name, opponent.damage_bonus, opponent.attack_bonus, armor_class, opponent.level)
+            if damage == 0:
+                return float('inf')
+            distance = calculate_distance(position, opponent.position)
+            if distance > weapon.range:
+                if field is None:
+                    field = map.field_to(position)
+                distance = field[opponent.position.x * height + opponent.position.y]
+            return max(0, distance - weapon.range) + health / damage
+        return expected_survival
+
 class DefensiveAI(BaseAI):
     deadlock_threshold = 5  # Number of turns to wait before breaking deadlock
     deadlock_counter = 0
 
     def take_turn(self, fighter):
-        neighbors = fighter.battle.map.get_neighbors(fighter.position)
-        enemies_in_range = [neighbor.fighter for neighbor in neighbors if neighbor.fighter and neighbor.fighter.faction != fighter.faction]
+        enemies_in_range = self.find_enemies_in_range(fighter)
 
         if enemies_in_range:
             target = self.select_target(fighter, enemies_in_range)
@@ -92,16 +155,317 @@ class DefensiveAI(BaseAI):
             DefensiveAI.deadlock_counter += 1
             if DefensiveAI.deadlock_counter >= DefensiveAI.deadlock_threshold:
                 DefensiveAI.deadlock_counter = 0  # Reset counter and force attack
-                GreatestThreatAI().take_turn(fighter)
+                GreatestThreatAI(self.search_radius).take_turn(fighter)
             else:
                 fighter.take_defensive_action()
         else:
             DefensiveAI.deadlock_counter = 0  # Reset counter if not in defensive action
-            GreatestThreatAI().take_turn(fighter)
+            GreatestThreatAI(self.search_radius).take_turn(fighter)
 
     def select_target(self, fighter, opponents=None):
         if not opponents:
-            opponents = [f for f in fighter.battle.fighters if f.faction != fighter.faction]
+            opponents = self.find_enemies(fighter)
         if opponents:
             return random.choice(opponents)
         return None
+
+class SearchState:
+    # A throwaway copy of a battle for MCTSAI to play forward: the living
+    # fighters' health, positions, stats and buffs in lists indexed by
+    # fighter. The map's terrain and the fighters' gear are shared between
+    # copies.
+    def __init__(self, battle, dice):
+        fighters = battle.fighters
+        self.map = battle.map
+        self.dice = dice
+        self.ids = [fighter.id for fighter in fighters]
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.factions = [fighter.faction for fighter in fighters]
+        self.levels = [fighter.level for fighter in fighters]
+        self.weapons = [fighter.weapon for fighter in fighters]
+        self.shields = [bool(fighter.shield) for fighter in fighters]
+        self.threats = [combat.average_damage(fighter.weapon.name) if fighter.weapon else 0 for fighter in fighters]
+        self.health = [fighter.health for fighter in fighters]
+        self.xs = [fighter.position.x for fighter in fighters]
+        self.ys = [fighter.position.y for fighter in fighters]
+        self.stats = {stat: [getattr(fighter, stat) for fighter in fighters]
+                      for stat in ('armor_class', 'attack_bonus', 'damage_bonus')}
+        # (spec, turns since applied) until the cooldown is over
+        self.buffs = [tuple((buff.spec, buff.elapsed()) for buff in fighter.buffs) for fighter in fighters]
+        self.occupancy = {(x, y): i for i, (x, y) in enumerate(zip(self.xs, self.ys))}
+        self.alive = {faction: len(roster) for faction, roster in battle.rosters.items()}
+        self.steps = {}  # (x, y) -> (dx, dy) onto the map and passable terrain, shared by copies
+
+    def copy(self):
+        other = SearchState.__new__(SearchState)
+        other.__dict__.update(self.__dict__)
+        other.health = self.health[:]
+        other.xs = self.xs[:]
+        other.ys = self.ys[:]
+        other.stats = {stat: values[:] for stat, values in self.stats.items()}
+        other.buffs = self.buffs[:]
+        other.occupancy = self.occupancy.copy()
+        other.alive = self.alive.copy()
+        return other
+
+    def distances(self, i, fighters):
+        """(distance, j) from fighter i to each of fighters."""
+        x, y, xs, ys, map_type = self.xs[i], self.ys[i], self.xs, self.ys, self.map.map_type
+        return [(offset_distance(map_type, xs[j] - x, ys[j] - y), j) for j in fighters]
+
+    def is_over(self):
+        return len(self.alive) < 2
+
+    def score(self, faction):
+        """This faction's share of the fighting strength left, health times threat."""
+        mine = theirs = 0
+        for i, health in enumerate(self.health):
+            if health > 0:
+                if self.factions[i] == faction:
+                    mine += health * self.threats[i]
+                else:
+                    theirs += health * self.threats[i]
+        return mine / (mine + theirs) if mine + theirs else 0.5
+
+    def enemies(self, i):
+        faction = self.factions[i]
+        return [j for j, health in enumerate(self.health) if health > 0 and self.factions[j] != faction]
+
+    def enemies_in_reach(self, i):
+        if self.weapons[i] is None:
+            return []
+        reach = self.weapons[i].range
+        return [j for distance, j in self.distances(i, self.enemies(i)) if distance <= reach]
+
+    def free_steps(self, i):
+        # (dx, dy) to each empty, passable neighbouring cell
+        x, y = self.xs[i], self.ys[i]
+        steps = self.steps.get((x, y))
+        if steps is None:
+            map = self.map
+            steps = self.steps[x, y] = [
+                (dx, dy) for dx, dy in NEIGHBOR_DELTAS[map.map_type]
+                if 0 <= x + dx < map.width and 0 <= y + dy < map.height and
+                TERRAIN_COSTS_BY_CODE[map.terrain[(x + dx) * map.height + y + dy]] != float('inf')]
+        return [(dx, dy) for dx, dy in steps if (x + dx, y + dy) not in self.occupancy]
+
+    def actions(self, i):
+        # attack anyone in reach, step towards or away from the nearest enemy, or defend
+        actions = [('attack', self.ids[j]) for j in self.enemies_in_reach(i)]
+        distances = self.distances(i, self.enemies(i))
+        steps = self.free_steps(i)
+        if distances and steps:
+            closest, nearest = min(distances)
+            x, y, map_type = self.xs[nearest] - self.xs[i], self.ys[nearest] - self.ys[i], self.map.map_type
+            ranked = sorted(steps, key=lambda step: offset_distance(map_type, x - step[0], y - step[1]))
+            actions.append(('move',) + ranked[0])
+            if ranked[-1] != ranked[0]:
+                actions.append(('move',) + ranked[-1])
+        actions.append(('defend',))  # no more than a wait when the buff is already up
+        return actions
+
+    def act(self, i, action):
+        if action[0] == 'attack':
+            self.attack(i, self.index[action[1]])
+        elif action[0] == 'move':
+            self.move(i, action[1], action[2])
+        else:
+            self.apply_buff(i, SHIELD_WALL if self.shields[i] else DEFENSIVE_STANCE)
+
+    def move(self, i, dx, dy):
+        del self.occupancy[self.xs[i], self.ys[i]]
+        self.xs[i] += dx
+        self.ys[i] += dy
+        self.occupancy[self.xs[i], self.ys[i]] = i
+
+    def attack(self, i, j):
+        weapon, stats = self.weapons[i], self.stats
+        needed = 22 - stats['armor_class'][j] - self.levels[i] - stats['attack_bonus'][i]
+        damage = self.dice.sample(attack_table(weapon.dice, weapon.sides, weapon.addend + stats['damage_bonus'][i], needed))
+        if damage is not None:
+            self.health[j] -= damage
+            if self.health[j] <= 0:
+                self.die(j)
+
+    def die(self, i):
+        del self.occupancy[self.xs[i], self.ys[i]]
+        faction = self.factions[i]
+        self.alive[faction] -= 1
+        if not self.alive[faction]:
+            del self.alive[faction]
+        elif self.alive[faction] == 1:
+            last = next(j for j, health in enumerate(self.health) if health > 0 and self.factions[j] == faction)
+            self.apply_buff(last, BERSERK_RAGE)
+
+    def apply_buff(self, i, spec):
+        if any(active is spec for active, elapsed in self.buffs[i]):
+            return
+        for stat, amount in spec.modifiers:
+            self.stats[stat][i] += amount
+        self.health[i] += spec.heal
+        self.buffs[i] += ((spec, 0),)
+
+    def start_turn(self, i):
+        # Buff.update, a turn at a time
+        if not self.buffs[i]:
+            return
+        kept = []
+        for spec, elapsed in self.buffs[i]:
+            elapsed += 1
+            if elapsed <= spec.duration:
+                for stat, amount in spec.decay:
+                    self.stats[stat][i] += amount
+                self.health[i] += spec.heal
+            if elapsed == spec.duration:
+                for stat, amount in spec.modifiers:
+                    self.stats[stat][i] -= amount
+                for stat, amount in spec.decay:
+                    self.stats[stat][i] -= amount * spec.duration
+            if elapsed < spec.duration + spec.cooldown:
+                kept.append((spec, elapsed))
+        self.buffs[i] = tuple(kept)
+
+    def policy_action(self, i):
+        # the rollout policy, GreatestThreatAI's: hit the most dangerous enemy
+        # in reach, else close in on the nearest
+        distances = self.distances(i, self.enemies(i))
+        if not distances:
+            return None
+        reach = self.weapons[i].range if self.weapons[i] else 0
+        targets = [j for distance, j in distances if distance <= reach]
+        if targets:
+            return ('attack', self.ids[max(targets, key=self.threats.__getitem__)])
+        closest, nearest = min(distances)
+        x, y, map_type = self.xs[nearest] - self.xs[i], self.ys[nearest] - self.ys[i], self.map.map_type
+        best = None
+        for dx, dy in self.free_steps(i):
+            distance = offset_distance(map_type, x - dx, y - dy)
+            if distance < closest:
+                best, closest = ('move', dx, dy), distance
+        return best
+
+    def play_turn(self, i):
+        self.start_turn(i)
+        action = self.policy_action(i)
+        if action:
+            self.act(i, action)
+
+    def turn_order(self):
+        """The living, in the order Battle.play_round gives them their turns."""
+        return sorted((i for i, health in enumerate(self.health) if health > 0), key=self.health.__getitem__, reverse=True)
+
+class SearchNode:
+    def __init__(self, action=None):
+        self.action = action
+        self.children = {}  # action -> SearchNode
+        self.visits = 0
+        self.value = 0.0
+
+    def select(self, actions, preferred, exploration):
+        # UCB1 over the children for actions legal this time. Progressive
+        # widening: a new child is only added once the node has been visited
+        # often enough, starting with the rollout policy's preferred action.
+        children = [self.children[action] for action in actions if action in self.children]
+        if len(children) < len(actions) and len(children) < 1 + sqrt(self.visits):
+            if preferred not in self.children:
+                action = preferred
+            else:
+                action = random.choice([action for action in actions if action not in self.children])
+            child = self.children[action] = SearchNode(action)
+            return child
+        log_visits = log(sum(child.visits for child in children))
+        return max(children, key=lambda child: child.value / child.visits + exploration * sqrt(log_visits / child.visits))
+
+class MCTSAI(BaseAI):
+    # Monte Carlo tree search over the fighter's own moves, attacks and
+    # defensive actions, played out on SearchStates. The tree is open loop:
+    # a node stands for a sequence of this fighter's actions, and everyone
+    # else plays the rollout policy in between, so the subtree under the
+    # action taken carries over to the fighter's next turn.
+    def __init__(self, rollouts=200, time_budget=None, rollout_rounds=4, exploration=1.4, search_radius=None):
+        super().__init__(search_radius)
+        if rollouts is None and time_budget is None:
+            raise ValueError('MCTSAI needs rollouts or a time_budget to stop searching')
+        self.rollouts = rollouts  # per decision, if not None
+        self.time_budget = time_budget  # seconds per decision, if not None
+        self.rollout_rounds = rollout_rounds
+        self.exploration = exploration
+        self.trees = WeakKeyDictionary()  # fighter -> (turns_taken, node for its next decision)
+
+    def __getstate__(self):
+        # search trees stay behind when the AI is sent to another process
+        return dict(self.__dict__, trees=None)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.trees = WeakKeyDictionary()
+
+    def take_turn(self, fighter):
+        if not fighter.battle.opponents(fighter.faction):
+            return
+        self.perform(fighter, self.search(fighter))
+
+    def perform(self, fighter, action):
+        if action[0] == 'attack':
+            target = next(f for f in fighter.battle.opponents(fighter.faction) if f.id == action[1])
+            fighter.attack(target)
+        elif action[0] == 'move':
+            fighter.move_to(fighter.battle.map.get_position(fighter.position.x + action[1], fighter.position.y + action[2]))
+        else:
+            fighter.take_defensive_action()
+
+    def search(self, fighter):
+        battle = fighter.battle
+        previous = self.trees.get(fighter)
+        root = previous[1] if previous and previous[0] == fighter.turns_taken - 1 else SearchNode()
+        state = SearchState(battle, battle.dice)  # the battle's stream, so results only depend on the seed
+        me = state.index[fighter.id]
+        # the rest of this round is for those who have not had their turn yet
+        waiting = [state.index[f.id] for f in battle.fighters if f.turns_taken < fighter.turns_taken]
+        first_round = [me] + sorted(waiting, key=state.health.__getitem__, reverse=True)
+        rounds = max(1, min(self.rollout_rounds, battle.turn_limit - battle.turn + 1))
+        deadline = None if self.time_budget is None else perf_counter() + self.time_budget
+        played = 0
+        while played == 0 or ((self.rollouts is None or played < self.rollouts) and
+                              (deadline is None or perf_counter() < deadline)):
+            self.playout(root, state.copy(), me, first_round, rounds)
+            played += 1
+        actions = state.actions(me)
+        best = max((root.children[action] for action in actions if action in root.children), key=lambda child: child.visits)
+        self.trees[fighter] = (fighter.turns_taken, best)
+        return best.action
+
+    def playout(self, root, state, me, first_round, rounds):
+        faction = state.factions[me]
+        node, path = root, [root]
+        for turn in range(rounds):
+            for i in state.turn_order() if turn else first_round:
+                if state.health[i] <= 0:
+                    continue
+                if i != me:
+                    state.play_turn(i)
+                elif node is not None:
+                    if turn:
+                        state.start_turn(me)  # the real turn has already started for round 0
+                    actions = state.actions(me)
+                    node = node.select(actions, state.policy_action(me) or actions[-1], self.exploration)
+                    path.append(node)
+                    state.act(me, node.action)
+                    if node.visits == 0:
+                        node = None  # new to the tree, the rest is rollout
+                else:
+                    state.play_turn(me)
+                if state.is_over():
+                    break
+            if state.is_over():
+                break
+        reward = state.score(faction)
+        for node in path:
+            node.visits += 1
+            node.value += reward
+
+    def select_target(self, fighter, opponents=None):
+        # the search picks targets in take_turn; this is for callers that only want a target
+        if not opponents:
+            opponents = self.find_enemies(fighter)
+        return min(opponents, key=lambda x: fighter.battle.map.calculate_distance(fighter.position, x.position), default=None)
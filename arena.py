@@ -1,29 +1,179 @@
 # arena.py
-from battle import Battle
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from battle import Battle, compile_roles
+from events import EventRecorder
+from profiling import Profiler
 from fighter import Fighter
 from ai import *
+import solver
+import stats
 
 VERSION = '0.6'
 
+# Iterations are split into fixed-size blocks, each with its own RNG seed, so
+# the results only depend on the seed and never on how many workers ran them.
+# The numpy engine runs a whole block in lockstep, so it wants bigger blocks.
+BLOCK_SIZES = {'python': 100, 'numpy': 2000}
+
+def simulate_block(engine, roles, verbose, seed, block, count, record=None, snapshot=None, profile=False):
+    # returns the wins, paired with the block's Profiler when profiling
+    if engine == 'numpy':
+        from batch import simulate_batch  # numpy is optional
+        return simulate_batch(roles, count, f'{seed}/{block}')
+
+    random.seed(f'{seed}/{block}')
+    recorder = EventRecorder(os.path.join(record, f'block-{block:05d}.arena')) if record else None
+    profiler = Profiler(allocations=profile == 'allocations') if profile else None
+    wins = {}
+    battle = None
+    for i in range(count):
+        # one Battle per block, reset in place between fights
+        started = profiler and perf_counter()
+        title = f'Battle {block * BLOCK_SIZES[engine] + i + 1}'
+        if snapshot is not None:
+            # a continuation: the same fighters, back where the snapshot left them
+            if battle is None:
+                battle = Battle.from_snapshot(snapshot, title, verbose, recorder=recorder, profiler=profiler)
+            else:
+                battle.restore(snapshot, title)
+        elif battle is None:
+            battle = Battle(title, roles, verbose, recorder=recorder, profiler=profiler)
+        else:
+            battle.reset(title)
+        if profiler:
+            profiler.stop('setup', started)
+        winner = battle.fight_battle()
+        if winner:
+            wins[winner] = wins.get(winner, 0) + 1
+    if recorder:
+        recorder.close()
+    if profiler:
+        profiler.close()
+        return wins, profiler
+    return wins
+
 class Arena:
-    def __init__(self, roles, iterations=1000, verbose=False):
+    def __init__(self, roles, iterations=1000, verbose=False, workers=1, seed=None,
+                 precision=None, confidence=0.95, interval='wilson', engine='python', record=None, profile=False):
+        if engine not in BLOCK_SIZES:
+            raise ValueError(f'Unknown engine: {engine}')
+        if record and engine != 'python':
+            raise ValueError('Only the python engine can record battles')
+        if profile and engine != 'python':
+            raise ValueError('Only the python engine can be profiled')
         self.roles = roles
-        self.iterations = iterations
+        self.prototypes = compile_roles(roles)  # what the python engine builds fighters from
+        self.iterations = iterations  # fixed count, or the cap when precision is set
         self.verbose = verbose
-        self.factions = {role['faction'] for role in roles}
+        self.workers = workers
+        self.seed = seed
+        self.precision = precision  # stop once every interval is within +/- precision
+        self.confidence = confidence
+        self.interval = interval  # 'wilson' or 'clopper-pearson'
+        self.engine = engine  # 'python' plays Battles, 'numpy' runs a block in lockstep
+        self.record = record  # directory for one events archive per block
+        self.factions = {prototype.faction for prototype in self.prototypes}
         self.wins = {faction: 0 for faction in self.factions}
+        self.iterations_run = 0
         self.winner = None
+        self.snapshot = None  # battles continue from this BattleSnapshot, if set
+        self.profile = profile  # False, True for timers and counters, or 'allocations' to trace memory as well
+        self.profiler = Profiler() if profile else None  # every block's tallies, merged
+
+    @classmethod
+    def from_snapshot(cls, snapshot, iterations=1000, **options):
+        """An Arena that runs continuations of one battle, all from snapshot."""
+        if options.get('engine', 'python') != 'python':
+            raise ValueError('Only the python engine can continue from a snapshot')
+        arena = cls(snapshot.prototypes, iterations, **options)
+        arena.snapshot = snapshot
+        return arena
 
     def simulate_battle(self):
-        for i in range(self.iterations):
-            winner = Battle(f'Battle {i + 1}', self.roles, self.verbose).fight_battle()
-            if winner:
-                self.wins[winner] += 1
+        seed = self.seed if self.seed is not None else random.getrandbits(64)
+        if self.record:
+            os.makedirs(self.record, exist_ok=True)
+        block_size = BLOCK_SIZES[self.engine]
+        blocks = range((self.iterations + block_size - 1) // block_size)
+        counts = [min(block_size, self.iterations - block * block_size) for block in blocks]
+
+        # merge in block order so the tallies never depend on scheduling, and
+        # check the stopping rule after every block for the same reason
+        results = self.run_blocks(seed, blocks, counts)
+        for count, block_wins in zip(counts, results):
+            if self.profiler:
+                block_wins, block_profiler = block_wins
+                self.profiler.merge(block_profiler)
+            for faction, block_count in block_wins.items():
+                self.wins[faction] += block_count
+            self.iterations_run += count
+            if self.precision is not None and self.is_precise():
+                break
+        results.close()
+
+    def run_blocks(self, seed, blocks, counts):
+        roles = self.prototypes if self.engine == 'python' else self.roles
+        if self.workers <= 1:
+            state = random.getstate()  # don't leave the caller's RNG reseeded
+            try:
+                for block, count in zip(blocks, counts):
+                    yield simulate_block(self.engine, roles, self.verbose, seed, block, count, self.record, self.snapshot,
+                                         self.profile)
+            finally:
+                random.setstate(state)
+            return
+
+        # keep a bounded window of blocks in flight so early stopping wastes little
+        with ProcessPoolExecutor(self.workers) as pool:
+            pending = deque()
+            jobs = iter(zip(blocks, counts))
+            try:
+                while True:
+                    while len(pending) < 2 * self.workers:
+                        job = next(jobs, None)
+                        if job is None:
+                            break
+                        pending.append(pool.submit(simulate_block, self.engine, roles, self.verbose, seed, *job, self.record,
+                                                   self.snapshot, self.profile))
+                    if not pending:
+                        break
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def exact_probabilities(self):
+        # solved exactly for melee duels that rarely reach the turn limit, otherwise estimated by simulation
+        probabilities = solver.solve(self.roles) if self.snapshot is None else None
+        if probabilities is None:
+            self.simulate_battle()
+            probabilities = {faction: self.wins[faction] / max(self.iterations_run, 1) for faction in self.factions}
+        return probabilities
+
+    def confidence_intervals(self):
+        return {faction: stats.interval(self.wins[faction], self.iterations_run, self.confidence, self.interval)
+                for faction in self.factions}
+
+    def is_precise(self):
+        return all((high - low) / 2 <= self.precision for low, high in self.confidence_intervals().values())
 
     def print_probabilities(self):
         print('Estimated Probabilities of Victory:')
+        intervals = self.confidence_intervals()
         for faction in sorted(self.factions):
-            print(f'{faction}: {self.wins[faction] / self.iterations:.2%}')
+            low, high = intervals[faction]
+            print(f'{faction}: {self.wins[faction] / max(self.iterations_run, 1):.2%} '
+                  f'({self.confidence:.0%} {self.interval} interval {low:.2%} - {high:.2%})')
+        print(f'Iterations: {self.iterations_run} of {self.iterations}')
+
+    def print_profile(self):
+        if self.profiler is None:
+            raise ValueError('Profiling is off, pass profile=True')
+        self.profiler.print_breakdown()
 
 
 #############################################################################
@@ -45,4 +195,5 @@ class Game:
         battle.simulate_battle()
         battle.print_probabilities()
 
-Game().run()
+if __name__ == '__main__':
+    Game().run()
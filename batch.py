@@ -0,0 +1,243 @@
+# batch.py
+import hashlib
+import numpy as np
+from ai import RandomAttackAI, LowestHealthAI, GreatestThreatAI, DefensiveAI
+from battle import expand_roles
+from fighter import Fighter, armor_list, shield_list
+from weapon import weapon_list
+
+# Lockstep engine: N copies of one scenario held as (N, fighters) arrays and
+# advanced a round at a time. It follows Battle.play_round, Fighter.attack
+# and the built-in AIs on the default open grid8 map.
+
+RANDOM, LOWEST_HEALTH, GREATEST_THREAT, DEFENSIVE = range(4)
+
+AI_KINDS = {
+    RandomAttackAI: RANDOM,
+    LowestHealthAI: LOWEST_HEALTH,
+    GreatestThreatAI: GREATEST_THREAT,
+    DefensiveAI: DEFENSIVE,
+}
+
+# grid8 neighbors, in Map.get_neighbors order
+NEIGHBOR_OFFSETS = np.array([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+
+# buff numbers from BuffCreator
+BERSERK_BONUS, BERSERK_DURATION = 5, 5
+STANCE_BONUS, STANCE_DURATION = 4, 1
+WALL_BONUS, WALL_DURATION, WALL_COOLDOWN = 6, 2, 5
+
+def make_rng(seed):
+    if isinstance(seed, str):
+        seed = int.from_bytes(hashlib.sha256(seed.encode()).digest()[:8], 'little')
+    return np.random.default_rng(seed)
+
+def simulate_batch(roles, count, seed=None, map_width=10, map_height=10, turn_limit=100):
+    battle = BatchBattle(roles, count, make_rng(seed), map_width, map_height, turn_limit)
+    winners = battle.fight()
+    wins = {}
+    for index, faction in enumerate(battle.factions):
+        total = int((winners == index).sum())
+        if total:
+            wins[faction] = total
+    return wins
+
+class BatchBattle:
+    def __init__(self, roles, count, rng, map_width=10, map_height=10, turn_limit=100):
+        roles = expand_roles(roles)
+        for role in roles:
+            if role['class'] is not Fighter or type(role['ai']) not in AI_KINDS:
+                raise ValueError(f"numpy engine only supports Fighter with the built-in AIs, not {role['name']}")
+            if role['ai'].search_radius is not None:
+                raise ValueError(f"numpy engine does not support search_radius ({role['name']})")
+            if role['weapon'] not in weapon_list:
+                raise ValueError(f"numpy engine does not know weapon {role['weapon']!r}")
+        if len(roles) > map_width * map_height:
+            raise ValueError(f'{len(roles)} fighters do not fit on a {map_width}x{map_height} map')
+
+        self.rng = rng
+        self.count = count
+        self.width = map_width
+        self.height = map_height
+        self.turn_limit = turn_limit
+        self.turn = 0
+        n, f = count, len(roles)
+        self.rows = np.arange(n)
+
+        # per-fighter constants
+        self.factions = sorted({role['faction'] for role in roles})
+        self.faction = np.array([self.factions.index(role['faction']) for role in roles])
+        self.level = np.array([role['level'] for role in roles])
+        self.dice, self.sides, self.addend, self.range = np.array([weapon_list[role['weapon']] for role in roles]).T
+        self.threat = self.dice * (1 + self.sides) / 2 + self.addend
+        self.ai = np.array([AI_KINDS[type(role['ai'])] for role in roles])
+        self.has_shield = np.array([bool(role['shield']) for role in roles])
+        base_armor_class = np.array([10 - armor_list.get(role['armor'], 0) - shield_list.get(role['shield'], 0) for role in roles])
+
+        # per-battle state
+        levels = self.level.max()
+        hit_dice = rng.integers(1, 11, size=(n, f, levels)) * (np.arange(levels) < self.level[:, None])
+        self.max_health = hit_dice.sum(2)
+        self.health = self.max_health.copy()
+        self.armor_class = np.tile(base_armor_class, (n, 1))
+        self.attack_bonus = np.zeros((n, f), dtype=int)
+        self.alive = np.ones((n, f), dtype=bool)
+
+        cells = rng.random((n, map_width * map_height)).argsort(1)[:, :f]
+        self.x, self.y = cells // map_height, cells % map_height
+        self.occupant = np.full((n, map_width * map_height), -1)
+        self.occupant[self.rows[:, None], cells] = np.arange(f)
+
+        self.berserk = np.zeros((n, f), dtype=int)  # remaining duration
+        self.stance = np.zeros((n, f), dtype=int)
+        self.wall = np.zeros((n, f), dtype=int)
+        self.wall_cooldown = np.zeros((n, f), dtype=int)
+        self.deadlock = np.zeros(n, dtype=int)  # DefensiveAI.deadlock_counter, per battle
+
+        self.winner = np.full(n, -1)
+        self.active = np.ones(n, dtype=bool)
+
+    def fight(self):
+        while self.active.any() and self.turn < self.turn_limit:
+            self.play_round()
+        return self.winner
+
+    def play_round(self):
+        self.turn += 1
+        order = np.argsort(np.where(self.alive, -self.health, 1), axis=1, kind='stable')
+        for actor in order.T:
+            rows = np.flatnonzero(self.active & self.alive[self.rows, actor])
+            if rows.size:
+                self.take_turn(rows, actor[rows])
+
+    def take_turn(self, rows, fighters):
+        self.tick_buffs(rows, fighters)
+
+        enemies = self.alive[rows] & (self.faction != self.faction[fighters][:, None])
+        distance = np.maximum(abs(self.x[rows] - self.x[rows, fighters][:, None]),
+                              abs(self.y[rows] - self.y[rows, fighters][:, None]))
+        reachable = enemies & (distance <= self.range[fighters][:, None])
+        engaged = reachable.any(1)
+        kind = self.ai[fighters]
+
+        # DefensiveAI out of reach of every enemy turtles up when hurt, else acts as GreatestThreatAI
+        defensive = (kind == DEFENSIVE) & ~engaged
+        hurt = defensive & (self.health[rows, fighters] * 4 < self.max_health[rows, fighters])
+        self.deadlock[rows[defensive & ~hurt]] = 0
+        self.deadlock[rows[hurt]] += 1
+        breaking = hurt & (self.deadlock[rows] >= DefensiveAI.deadlock_threshold)
+        self.deadlock[rows[breaking]] = 0
+        turtling = hurt & ~breaking
+        self.take_defensive_action(rows[turtling], fighters[turtling])
+
+        strategy = np.where(defensive, GREATEST_THREAT, kind)
+        strategy[strategy == DEFENSIVE] = RANDOM
+        pool = np.where(engaged[:, None], reachable, enemies)
+        targets = self.select_targets(rows, pool, strategy)
+
+        acting = ~turtling
+        rows, fighters, targets = rows[acting], fighters[acting], targets[acting]
+        in_range = self.range[fighters] >= distance[acting][np.arange(rows.size), targets]
+        self.attack(rows[in_range], fighters[in_range], targets[in_range])
+        self.move_towards(rows[~in_range], fighters[~in_range])
+
+    def select_targets(self, rows, pool, strategy):
+        # argmax keeps the first of equal keys, like min()/max() over battle.fighters
+        keys = np.empty(pool.shape)
+        chosen = strategy == RANDOM
+        keys[chosen] = self.rng.random((chosen.sum(), pool.shape[1]))
+        chosen = strategy == LOWEST_HEALTH
+        keys[chosen] = -self.health[rows[chosen]]
+        chosen = strategy == GREATEST_THREAT
+        keys[chosen] = self.threat
+        return np.where(pool, keys, -np.inf).argmax(1)
+
+    def tick_buffs(self, rows, fighters):
+        raging = self.berserk[rows, fighters] > 0
+        r, f = rows[raging], fighters[raging]
+        self.berserk[r, f] -= 1
+        self.attack_bonus[r, f] -= 1
+
+        bracing = self.stance[rows, fighters] > 0
+        r, f = rows[bracing], fighters[bracing]
+        self.stance[r, f] -= 1
+        ended = self.stance[r, f] == 0
+        self.armor_class[r[ended], f[ended]] += STANCE_BONUS
+
+        walled = self.wall[rows, fighters] > 0
+        cooling = ~walled & (self.wall_cooldown[rows, fighters] > 0)
+        r, f = rows[walled], fighters[walled]
+        self.wall[r, f] -= 1
+        ended = self.wall[r, f] == 0
+        self.armor_class[r[ended], f[ended]] += WALL_BONUS
+        self.wall_cooldown[r[ended], f[ended]] = WALL_COOLDOWN
+        self.wall_cooldown[rows[cooling], fighters[cooling]] -= 1
+
+    def take_defensive_action(self, rows, fighters):
+        # Fighter.take_defensive_action: a shield means Shield Wall or nothing
+        shield = self.has_shield[fighters]
+        ready = shield & (self.wall[rows, fighters] == 0) & (self.wall_cooldown[rows, fighters] == 0)
+        r, f = rows[ready], fighters[ready]
+        self.armor_class[r, f] -= WALL_BONUS
+        self.wall[r, f] = WALL_DURATION
+
+        ready = ~shield & (self.stance[rows, fighters] == 0)
+        r, f = rows[ready], fighters[ready]
+        self.armor_class[r, f] -= STANCE_BONUS
+        self.stance[r, f] = STANCE_DURATION
+
+    def attack(self, rows, fighters, targets):
+        attack_roll = self.rng.integers(1, 21, size=rows.size) + self.attack_bonus[rows, fighters]
+        hit = attack_roll >= 22 - self.armor_class[rows, targets] - self.level[fighters]
+        rows, fighters, targets = rows[hit], fighters[hit], targets[hit]
+
+        dice = self.dice.max()
+        rolls = self.rng.integers(1, self.sides[fighters][:, None] + 1, size=(rows.size, dice))
+        damage = (rolls * (np.arange(dice) < self.dice[fighters][:, None])).sum(1) + self.addend[fighters]
+        self.health[rows, targets] -= damage
+
+        dead = self.health[rows, targets] <= 0
+        self.die(rows[dead], targets[dead])
+
+    def die(self, rows, fighters):
+        self.alive[rows, fighters] = False
+        self.occupant[rows, self.x[rows, fighters] * self.height + self.y[rows, fighters]] = -1
+
+        # the last teammate standing goes into a Berserk Rage
+        teammates = self.alive[rows] & (self.faction == self.faction[fighters][:, None])
+        last = teammates.sum(1) == 1
+        r, f = rows[last], teammates[last].argmax(1)
+        fresh = self.berserk[r, f] == 0
+        r, f = r[fresh], f[fresh]
+        self.attack_bonus[r, f] += BERSERK_BONUS
+        self.berserk[r, f] = BERSERK_DURATION
+
+        standing = np.stack([(self.alive[rows] & (self.faction == faction)).any(1) for faction in range(len(self.factions))], 1)
+        won = standing.sum(1) == 1
+        self.winner[rows[won]] = standing[won].argmax(1)
+        self.active[rows[won]] = False
+
+    def move_towards(self, rows, fighters):
+        # Map.step_towards_enemies: the first free neighbor closest to any
+        # enemy, if it gets closer at all; blocked fighters stay put
+        x, y = self.x[rows, fighters], self.y[rows, fighters]
+        new_x = x[:, None] + NEIGHBOR_OFFSETS[:, 0]
+        new_y = y[:, None] + NEIGHBOR_OFFSETS[:, 1]
+        inside = (new_x >= 0) & (new_x < self.width) & (new_y >= 0) & (new_y < self.height)
+        cells = np.where(inside, new_x * self.height + new_y, 0)
+        free = inside & (self.occupant[rows[:, None], cells] < 0)
+
+        enemies = self.alive[rows] & (self.faction != self.faction[fighters][:, None])
+        enemy_x, enemy_y = self.x[rows][:, None, :], self.y[rows][:, None, :]
+        distance = np.where(enemies[:, None, :], np.maximum(abs(new_x[:, :, None] - enemy_x),
+                                                            abs(new_y[:, :, None] - enemy_y)), np.inf).min(2)
+        current = np.where(enemies, np.maximum(abs(x[:, None] - self.x[rows]), abs(y[:, None] - self.y[rows])), np.inf).min(1)
+        score = np.where(free & (distance < current[:, None]), distance, np.inf)
+        step = score.argmin(1)
+        moving = np.isfinite(score[np.arange(rows.size), step])
+
+        rows, fighters, step = rows[moving], fighters[moving], step[moving]
+        self.occupant[rows, self.x[rows, fighters] * self.height + self.y[rows, fighters]] = -1
+        self.x[rows, fighters] += NEIGHBOR_OFFSETS[step, 0]
+        self.y[rows, fighters] += NEIGHBOR_OFFSETS[step, 1]
+        self.occupant[rows, self.x[rows, fighters] * self.height + self.y[rows, fighters]] = fighters
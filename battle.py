@@ -1,74 +1,292 @@
 # battle.py
 import random
+from collections import deque, namedtuple
+from time import perf_counter
+from logging import DEBUG, INFO
 from ai import *
+from dice import Dice
 from fighter import Fighter
-from map import Map
+from map import Map, EMPTY
+
+# Log levels, as in the logging module. A SILENT battle formats and keeps nothing.
+SILENT = 100
+
+def expand_roles(roles):
+    """One role per fighter; a role with a count stands for that many numbered fighters."""
+    expanded = []
+    for role in roles:
+        if 'count' not in role:
+            expanded.append(role)
+            continue
+        template = {key: value for key, value in role.items() if key != 'count'}
+        expanded.extend(dict(template, name=f"{role['name']} {number}") for number in range(1, role['count'] + 1))
+    return expanded
+
+class Prototype(namedtuple('Prototype', 'fighter_class name level ai faction weapon armor shield')):
+    __slots__ = ()
+
+    def create(self):
+        return self.fighter_class(self.name, self.level, self.ai, self.faction, self.weapon, self.armor, self.shield)
+
+# Battle.snapshot: the map as (width, height, map_type) and terrain bytes, and
+# for the living fighters their prototypes, FighterStates and cells, the
+# rosters as (faction, fighter indexes) and the timers as (fighter index,
+# turn, buff name). Plain data, so it pickles and can be restored many times.
+BattleSnapshot = namedtuple('BattleSnapshot', 'title turn winner turn_limit zones map terrain prototypes fighters cells '
+                                              'rosters timers')
+
+def compile_roles(roles):
+    """Roles as a tuple of immutable Prototypes, one per fighter."""
+    if all(isinstance(role, Prototype) for role in roles):
+        return tuple(roles)
+    return tuple(Prototype(role['class'], role['name'], role['level'], role['ai'], role['faction'],
+                           role['weapon'], role['armor'], role['shield']) for role in expand_roles(roles))
 
 class Battle:
-    def __init__(self, title, roles, verbose=False, map_width=10, map_height=10, turn_limit=100):
+    def __init__(self, title, roles, verbose=False, map_width=10, map_height=10, turn_limit=100, log_level=None, log_limit=None,
+                 recorder=None, zones=None, dice=None, profiler=None):
         self.title = title
         self.verbose = verbose
-        self.fighters = []
+        self._fighters = []  # in the order they joined; the dead are dropped lazily
+        self.departed = 0  # dead fighters still in _fighters
+        self.rosters = {}  # faction -> living fighters, in no particular order
+        self.opponent_lists = {}  # faction -> everyone else, until the roster changes
+        self.timers = {}  # (fighter, fighter's turn) -> buffs that change state then
+        self.next_id = 0
+        self.recorder = recorder  # events.EventRecorder, or None
+        self.profiler = profiler  # profiling.Profiler, or None
+        self.dice = dice or Dice()  # buffered rolls, drawn from random
         self.winner = None
         self.turn = 0
-        self.logs = []
+        self.log_level = log_level if log_level is not None else DEBUG if verbose else SILENT
+        self.logs = deque(maxlen=log_limit) if log_limit else []  # log_limit keeps only the last messages
         self.map = Map(map_width, map_height, 'grid8')
+        self.map.profiler = profiler
         self.turn_limit = turn_limit
+        self.zones = zones or {}  # faction -> (x, y, width, height) it deploys in
+        self.cell_pools = {}  # zone -> cells not yet handed out
+        self.source = None  # the prototypes of the snapshot the entrants were made for
+
+        for prototype in compile_roles(roles):
+            self.add_fighter(prototype.create())
+        self.entrants = tuple(self._fighters)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, title=None, verbose=False, log_level=None, log_limit=None, recorder=None, dice=None,
+                      profiler=None):
+        width, height, map_type = snapshot.map
+        battle = cls(title or snapshot.title, (), verbose, width, height, snapshot.turn_limit, log_level, log_limit,
+                     recorder, snapshot.zones, dice, profiler)
+        battle.restore(snapshot, title)
+        return battle
+
+    def clear(self):
+        self.map.clear_occupants()
+        self._fighters = []
+        self.departed = 0
+        self.rosters = {}
+        self.opponent_lists = {}
+        self.timers = {}
+        self.cell_pools = {}
+        self.next_id = 0
+        self.winner = None
+        self.turn = 0
+        self.logs.clear()
 
-        for role in roles:
-            fighter = role['class'](role['name'], role['level'], role['ai'], role['faction'], role['weapon'], role['armor'], role['shield'])
+    def reset(self, title=None):
+        """Fight again on the same map with the same fighters, freshly rolled and placed."""
+        # draws from random in the same order as building a new Battle would
+        self.title = title or self.title
+        self.clear()
+        for fighter in self.entrants:
+            fighter.reset()
             self.add_fighter(fighter)
 
+    def snapshot(self):
+        """The battle as it stands, as a BattleSnapshot. Take it between rounds."""
+        fighters = self.fighters
+        index = {fighter: i for i, fighter in enumerate(fighters)}
+        return BattleSnapshot(
+            self.title, self.turn, self.winner, self.turn_limit, dict(self.zones),
+            (self.map.width, self.map.height, self.map.map_type), bytes(self.map.terrain),
+            tuple(Prototype(type(fighter), fighter.name, fighter.level, fighter.ai, fighter.faction,
+                            fighter.weapon.name if fighter.weapon else None, fighter.armor, fighter.shield)
+                  for fighter in fighters),
+            tuple(fighter.save() for fighter in fighters),
+            tuple(fighter.position.x * self.map.height + fighter.position.y for fighter in fighters),
+            tuple((faction, tuple(index[fighter] for fighter in roster)) for faction, roster in self.rosters.items()),
+            tuple((index[fighter], turn, buff.name) for (fighter, turn), buffs in self.timers.items() if fighter in index
+                  for buff in buffs))
+
+    def restore(self, snapshot, title=None):
+        """Put the battle back as it was at snapshot, reusing its map and fighters when they fit."""
+        if self.source is not snapshot.prototypes:
+            self.entrants = tuple(prototype.create() for prototype in snapshot.prototypes)
+            self.source = snapshot.prototypes
+        width, height, map_type = snapshot.map
+        if (self.map.width, self.map.height, self.map.map_type) != snapshot.map:
+            self.map = Map(width, height, map_type)
+            self.map.profiler = self.profiler
+        if self.map.terrain != snapshot.terrain:
+            self.map.load_terrain([[snapshot.terrain[x * height + y] for x in range(width)] for y in range(height)])
+        self.clear()
+        self.title = title or snapshot.title
+        self.turn = snapshot.turn
+        self.winner = snapshot.winner
+        self.turn_limit = snapshot.turn_limit
+        self.zones = dict(snapshot.zones)
+        for fighter, state, cell in zip(self.entrants, snapshot.fighters, snapshot.cells):
+            fighter.restore(state)
+            self.add_fighter(fighter, self.map.get_position(*divmod(cell, height)))
+        self.rosters = {}
+        for faction, members in snapshot.rosters:
+            roster = self.rosters[faction] = [self.entrants[i] for i in members]
+            for slot, fighter in enumerate(roster):
+                fighter.slot = slot
+        for i, turn, name in snapshot.timers:
+            fighter = self.entrants[i]
+            self.schedule(fighter, turn, fighter.active_buffs[name])
+
+    def fork(self, title=None):
+        """An independent copy of the battle, with fighters of its own."""
+        return Battle.from_snapshot(self.snapshot(), title, self.verbose, self.log_level, dice=Dice())
+
     def __repr__(self):
         return f'{self.title} turn {self.turn}'
 
-    def add_fighter(self, fighter):
-        self.fighters.append(fighter)
+    @property
+    def fighters(self):
+        if self.departed:
+            self._fighters = [fighter for fighter in self._fighters if fighter.battle is self]
+            self.departed = 0
+        return self._fighters
+
+    def add_fighter(self, fighter, position=None):
+        # at a random free cell of the faction's zone, unless given a position
+        self._fighters.append(fighter)
+        roster = self.rosters.setdefault(fighter.faction, [])
+        fighter.slot = len(roster)
+        roster.append(fighter)
+        self.opponent_lists = {}
         fighter.battle = self  # Ensure fighter knows which battle they are part of
-        while True:
-            x = random.randint(0, self.map.width - 1)
-            y = random.randint(0, self.map.height - 1)
-            position = self.map.get_position(x, y)
-            if position and not position.fighter:  # Check if position is valid and unoccupied
-                self.map.occupy_position(fighter, position)
-                break
+        fighter.id = self.next_id
+        self.next_id += 1
+        if position is None:
+            self.place_fighter(fighter)
+        else:
+            self.map.occupy_position(fighter, position)
+        if self.recorder and self.recorder.battle is self:
+            self.recorder.spawn(fighter)
+
+    def place_fighter(self, fighter):
+        # Draw a random cell from the pool and swap it out, so placement
+        # never retries a taken cell. The pool is rebuilt once from the
+        # free cells when it runs dry, in case fighters have left since.
+        zone = self.zones.get(fighter.faction)
+        occupancy = self.map.occupancy
+        for rebuild in (zone not in self.cell_pools, True):
+            if rebuild:
+                self.cell_pools[zone] = [cell for cell in self.zone_cells(zone) if occupancy[cell] == EMPTY]
+            pool = self.cell_pools[zone]
+            while pool:
+                index = random.randrange(len(pool))
+                pool[index], pool[-1] = pool[-1], pool[index]
+                cell = pool.pop()
+                if occupancy[cell] == EMPTY:
+                    self.map.occupy_position(fighter, self.map.get_position(*divmod(cell, self.map.height)))
+                    return
+        where = f"{fighter.faction}'s zone {zone}" if zone else f'the {self.map.width}x{self.map.height} map'
+        raise ValueError(f'No room left to place {fighter.name} in {where}')
+
+    def zone_cells(self, zone):
+        if zone is None:
+            return range(self.map.width * self.map.height)
+        x, y, width, height = zone
+        xs = range(max(x, 0), min(x + width, self.map.width))
+        ys = range(max(y, 0), min(y + height, self.map.height))
+        return [column * self.map.height + row for column in xs for row in ys]
 
     def remove_fighter(self, fighter):
-        self.fighters.remove(fighter)
+        # swap the last of the roster into the fighter's slot
+        roster = self.rosters[fighter.faction]
+        last = roster.pop()
+        if last is not fighter:
+            roster[fighter.slot] = last
+            last.slot = fighter.slot
+        if not roster:
+            del self.rosters[fighter.faction]
+        self.opponent_lists = {}
+        self.departed += 1
         fighter.battle = None
         self.map.vacate_position(fighter.position)
 
+    def schedule(self, fighter, turn, buff):
+        self.timers.setdefault((fighter, turn), []).append(buff)
+
+    def opponents(self, faction):
+        """Living fighters not in faction, in the order they joined. Do not modify."""
+        opponents = self.opponent_lists.get(faction)
+        if opponents is None:
+            opponents = self.opponent_lists[faction] = [f for f in self.fighters if f.faction != faction]
+        return opponents
+
     def fight_battle(self):
-        self.log(f'{self.title} fighters:')
+        if self.recorder:
+            self.recorder.start_battle(self)
+        if self.profiler:
+            self.profiler.start_battle()
+        self.log('%s fighters:', self.title)
         for fighter in self.fighters:
-            self.log(fighter)
+            self.log('%s', fighter)
         while self.winner is None and self.turn < self.turn_limit:
             self.play_round()
         if self.winner:
-            self.log(f'{self.winner} wins {self.title}!')
+            self.log('%s wins %s!', self.winner, self.title)
         else:
-            self.log(f'{self.title} ends in a draw after {self.turn_limit} turns!')
+            self.log('%s ends in a draw after %d turns!', self.title, self.turn_limit)
+        if self.recorder:
+            self.recorder.end_battle(self)
+        if self.profiler:
+            self.profiler.end_battle()
         return self.winner
 
     def play_round(self):
+        profiler = self.profiler
+        started = profiler and perf_counter()
         self.turn += 1
-        self.log(f'{self}:')
+        self.log('%s:', self)
         self.display_map()
-        for fighter in sorted(self.fighters, key=lambda x: x.health, reverse=True):
+        ordered = profiler and perf_counter()
+        order = sorted(self.fighters, key=lambda x: x.health, reverse=True)
+        if profiler:
+            profiler.stop('order', ordered)
+        for fighter in order:
             if self.winner:
                 break
             fighter.take_turn()
-            factions = set(f.faction for f in self.fighters if f.is_alive())
-            if len(factions) == 1:
-                self.winner = factions.pop()
+            if len(self.rosters) == 1:
+                self.winner = next(iter(self.rosters))
+        if profiler:
+            profiler.stop('round', started)
+
+    def is_logging(self, level=INFO):
+        return level >= self.log_level
 
-    def log(self, message):
+    def log(self, message, *args, level=INFO):
+        # arguments are only formatted when the message will be kept
+        if level < self.log_level:
+            return
+        started = self.profiler and perf_counter()
+        if args:
+            message = message % args
         if self.verbose:
             print(message)
         self.logs.append(message)
+        if self.profiler:
+            self.profiler.stop('logging', started)
 
     def display_map(self):
-        if self.map.refresh_needed:
+        if self.map.refresh_needed and self.is_logging(DEBUG):
             map_grid = [['.' for _ in range(self.map.width)] for _ in range(self.map.height)]
             for fighter in self.fighters:
                 if fighter.is_alive():
@@ -76,5 +294,5 @@ class Battle:
                     if 0 <= x < self.map.width and 0 <= y < self.map.height:
                         map_grid[y][x] = fighter.name[0]
             map_display = '\n'.join([' '.join(row) for row in map_grid])
-            self.log(map_display)
+            self.log(map_display, level=DEBUG)
             self.map.refresh_needed = False
@@ -0,0 +1,198 @@
+# benchmark.py
+import argparse
+import functools
+import json
+import platform
+import random
+import sys
+import time
+from ai import RandomAttackAI, LowestHealthAI, GreatestThreatAI, DefensiveAI, ExpectedSurvivalAI, MCTSAI
+from arena import Arena
+from battle import Battle
+from fighter import Fighter
+from map import Map, Terrain
+
+# Fixed-seed timings of the hot spots, for comparing changes. Every result
+# is seconds per operation, the best of a few repeats, so lower is better
+# and one threshold fits them all.
+
+AI_CLASSES = (RandomAttackAI, LowestHealthAI, GreatestThreatAI, DefensiveAI, ExpectedSurvivalAI, MCTSAI)
+DECISION_COUNTS = {MCTSAI: 5}  # fewer decisions for the AIs that take most of a second each
+WEAPONS = ('long sword', 'two-handed sword', 'axe', 'trident', 'bow', 'sling')
+MAP_SIZES = (16, 32, 64)
+LAYOUTS = ('plain', 'rough', 'walls')
+REPEATS = 3
+THRESHOLD = 0.10  # slowdown beyond which a result counts as a regression
+
+def mixed_roles(ai, count, seed=0):
+    # count fighters a side with a spread of weapons, all run by ai
+    rng = random.Random(seed)
+    return [{'name': f'{faction} {i}', 'faction': faction, 'level': rng.randint(1, 6), 'class': Fighter,
+             'weapon': rng.choice(WEAPONS), 'armor': 'leather armor', 'shield': None, 'ai': ai}
+            for faction in ('Red', 'Blue') for i in range(count)]
+
+def layout_map(size, layout, seed=0):
+    """A size x size grid8 map: open 'plain', scattered forest and mountains for
+    'rough', or water 'walls' with a gap in each."""
+    rng = random.Random(seed)
+    map = Map(size, size, 'grid8')
+    if layout == 'rough':
+        for x in range(size):
+            for y in range(size):
+                roll = rng.random()
+                if roll < 0.1:
+                    map.set_terrain(x, y, Terrain.MOUNTAIN)
+                elif roll < 0.3:
+                    map.set_terrain(x, y, Terrain.FOREST)
+    elif layout == 'walls':
+        for x in range(4, size - 1, 4):
+            gap = rng.randrange(size)
+            for y in range(size):
+                if y != gap:
+                    map.set_terrain(x, y, Terrain.WATER)
+    elif layout != 'plain':
+        raise ValueError(f'Unknown layout: {layout}')
+    return map
+
+def best_of(run, repeats=REPEATS):
+    return min(run() for _ in range(repeats))
+
+def preserving_random(benchmark):
+    # a benchmark reseeds random for itself; the caller's RNG is left as it was, as Arena.run_blocks does
+    @functools.wraps(benchmark)
+    def wrapper(*args, **kwargs):
+        state = random.getstate()
+        try:
+            return benchmark(*args, **kwargs)
+        finally:
+            random.setstate(state)
+    return wrapper
+
+def astar_time(size, layout, searches=200, seed=0):
+    """Mean seconds for one A* search across the map, building its goal's distance field each time."""
+    map = layout_map(size, layout, seed)
+    map.path_cache_size = 0
+    rng = random.Random(seed)
+    open_cells = [(x, y) for x in range(size) for y in range(size) if map.get_position(x, y).terrain != Terrain.WATER]
+    pairs = [(map.get_position(*rng.choice(open_cells)), map.get_position(*rng.choice(open_cells)))
+             for _ in range(searches)]
+
+    def run():
+        start = time.perf_counter()
+        for source, target in pairs:
+            map.astar(source, target)
+        return (time.perf_counter() - start) / searches
+    return best_of(run)
+
+@preserving_random
+def play_round_time(fighters=20, rounds=200, seed=0):
+    """Mean seconds for one Battle.play_round of a fighters a side melee, fought again as often as needed."""
+    def run():
+        random.seed(seed)
+        battle = Battle('Benchmark', mixed_roles(GreatestThreatAI(), fighters, seed), map_width=20, map_height=20)
+        elapsed = 0
+        for _ in range(rounds):
+            if battle.winner or battle.turn >= battle.turn_limit:
+                battle.reset()
+            start = time.perf_counter()
+            battle.play_round()
+            elapsed += time.perf_counter() - start
+        return elapsed / rounds
+    return best_of(run)
+
+@preserving_random
+def ai_decision_latency(ai_class, fighters=20, decisions=2000, seed=0):
+    """Mean seconds for one take_turn, the whole decision and its action, in a fighters a side melee."""
+    def run():
+        random.seed(seed)
+        battle = Battle('Benchmark', mixed_roles(ai_class(), fighters, seed), map_width=20, map_height=20)
+        elapsed, timed, order = 0, 0, []
+        while timed < decisions:
+            # Battle.play_round one turn at a time; a finished battle is reset, untimed
+            if battle.winner or battle.turn >= battle.turn_limit:
+                battle.reset()
+                order = []
+            if not order:
+                battle.turn += 1
+                order = sorted(battle.fighters, key=lambda x: x.health, reverse=True)
+            fighter = order.pop(0)
+            if fighter.is_dead():
+                continue
+            start = time.perf_counter()
+            fighter.take_turn()
+            elapsed += time.perf_counter() - start
+            timed += 1
+            if len(battle.rosters) == 1:
+                battle.winner = next(iter(battle.rosters))
+        return elapsed / decisions
+    return best_of(run)
+
+def arena_battle_time(iterations=200, seed=0):
+    """Mean seconds per battle of a serial Arena run; its inverse is battles per second."""
+    roles = mixed_roles(GreatestThreatAI(), 3, seed)
+
+    def run():
+        start = time.perf_counter()
+        Arena(roles, iterations, seed=seed).simulate_battle()
+        return (time.perf_counter() - start) / iterations
+    return best_of(run)
+
+def run_benchmarks(quick=False):
+    """Every benchmark by name, in seconds per operation. quick shrinks the workloads for smoke runs."""
+    scale = 10 if quick else 1
+    results = {}
+    for size in MAP_SIZES:
+        for layout in LAYOUTS:
+            results[f'astar/{size}/{layout}'] = astar_time(size, layout, searches=200 // scale)
+    results['play_round'] = play_round_time(rounds=200 // scale)
+    for ai_class in AI_CLASSES:
+        decisions = DECISION_COUNTS.get(ai_class, 2000) // scale or 1
+        results[f'decision/{ai_class.__name__}'] = ai_decision_latency(ai_class, decisions=decisions)
+    results['arena/battle'] = arena_battle_time(iterations=200 // scale)
+    return results
+
+def save_baseline(results, path):
+    with open(path, 'w') as file:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, file,
+                  indent=1, sort_keys=True)
+
+def load_baseline(path):
+    with open(path) as file:
+        return json.load(file)['results']
+
+def regressions(results, baseline, threshold=THRESHOLD):
+    """(name, baseline, result) for each benchmark more than threshold slower than its baseline."""
+    return [(name, baseline[name], result) for name, result in results.items()
+            if name in baseline and result > baseline[name] * (1 + threshold)]
+
+def print_results(results, baseline=None):
+    for name, result in results.items():
+        line = f'{name}: {result * 1e6:.1f} us'
+        if name == 'arena/battle':
+            line += f' ({1 / result:.0f} battles/s)'
+        if baseline and name in baseline:
+            line += f' ({result / baseline[name] - 1:+.1%})'
+        print(line)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Time the hot spots with fixed seeds.')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='flag regressions against a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='allowed slowdown, as a fraction')
+    parser.add_argument('--quick', action='store_true', help='smaller workloads, for a smoke run')
+    options = parser.parse_args(args)
+
+    results = run_benchmarks(options.quick)
+    baseline = load_baseline(options.compare) if options.compare else None
+    print_results(results, baseline)
+    if options.save:
+        save_baseline(results, options.save)
+    if baseline:
+        slower = regressions(results, baseline, options.threshold)
+        for name, before, after in slower:
+            print(f'Regression: {name} {before * 1e6:.1f} us -> {after * 1e6:.1f} us')
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
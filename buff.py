@@ -1,86 +1,108 @@
 # buff.py
+from collections import namedtuple
+from logging import DEBUG
 
-class Buff:
-    def __init__(self, name, duration, apply_fn, tick_fn, remove_fn=None, cooldown=0):
-        self.name = name
-        self.duration = duration
-        self.remaining_duration = duration
-        self.cooldown = cooldown
-        self.remaining_cooldown = cooldown  # Cooldown starts only after the buff expires
-        self.apply_fn = apply_fn
-        self.tick_fn = tick_fn
-        self.remove_fn = remove_fn
+# A BuffSpec is shared by every application of a buff. modifiers are added to
+# the fighter's stats when it is applied and taken off when it expires; decay
+# is added to them again on each of the fighter's turns while it lasts, and
+# heal is given on application and on each of those turns.
+BuffSpec = namedtuple('BuffSpec', 'name duration cooldown modifiers decay heal', defaults=(0, (), (), 0))
 
-    def apply(self, fighter):
-        self.remaining_duration = self.duration  # Set duration
-        self.apply_fn(fighter)
-
-    def tick(self, fighter):
-        if self.remaining_duration > 0:
-            self.remaining_duration -= 1
-            fighter.battle.log(f"{self.name} duration: {self.remaining_duration} for {fighter.name}")
-            self.tick_fn(fighter)
-            if self.remaining_duration == 0:
-                self.start_cooldown(fighter)
-        elif self.remaining_cooldown > 0:
-            self.remaining_cooldown -= 1
-            fighter.battle.log(f"{self.name} cooldown: {self.remaining_cooldown} for {fighter.name}")
-
-    def start_cooldown(self, fighter):
-        if self.remove_fn:
-            self.remove_fn(fighter)
-        self.remaining_cooldown = self.cooldown  # Set cooldown
-        fighter.battle.log(f"Buff {self.name} expired for {fighter.name}, cooldown started")
+BERSERK_RAGE = BuffSpec('Berserk Rage', duration=5, modifiers=(('attack_bonus', 5),), decay=(('attack_bonus', -1),))
+DEFENSIVE_STANCE = BuffSpec('Defensive Stance', duration=1, modifiers=(('armor_class', -4),))
+SHIELD_WALL = BuffSpec('Shield Wall', duration=2, cooldown=5, modifiers=(('armor_class', -6),))
+HEAL_OVER_TIME = BuffSpec('Heal Over Time', duration=3, heal=5)
 
-class BuffCreator:
-    @staticmethod
-    def create_berserk_rage():
-        def apply_fn(fighter):
-            fighter.attack_bonus += 5
+class Buff:
+    # Timing is counted in the owner's turns. Instead of ticking every turn,
+    # a buff asks its battle to wake it on the turns where something happens.
+    def __init__(self, spec):
+        self.spec = spec
+        self.fighter = None
+        self.applied_at = None  # the owner's turns_taken when applied
 
-        def tick_fn(fighter):
-            fighter.attack_bonus -= 1
+    @property
+    def name(self):
+        return self.spec.name
 
-        def remove_fn(fighter):
-            pass  # No removal effect
+    @property
+    def duration(self):
+        return self.spec.duration
 
-        return Buff('Berserk Rage', duration=5, apply_fn=apply_fn, tick_fn=tick_fn, remove_fn=remove_fn)
+    @property
+    def cooldown(self):
+        return self.spec.cooldown
 
-    @staticmethod
-    def create_defensive_stance():
-        def apply_fn(fighter):
-            fighter.armor_class -= 4
+    def elapsed(self):
+        return 0 if self.fighter is None else self.fighter.turns_taken - self.applied_at
 
-        def tick_fn(fighter):
-            pass  # No ticking effect
+    @property
+    def remaining_duration(self):
+        return max(0, self.duration - self.elapsed())
 
-        def remove_fn(fighter):
-            fighter.armor_class += 4  # Remove buff effect after expiration
+    @property
+    def remaining_cooldown(self):
+        # the cooldown only starts counting down once the buff expires
+        return max(0, self.cooldown - max(0, self.elapsed() - self.duration))
 
-        return Buff('Defensive Stance', duration=1, apply_fn=apply_fn, tick_fn=tick_fn, remove_fn=remove_fn)
+    def has_ticks(self):
+        return bool(self.spec.decay or self.spec.heal)
 
-    @staticmethod
-    def create_shield_wall():
-        def apply_fn(fighter):
-            fighter.armor_class -= 6
+    def apply(self, fighter):
+        self.fighter = fighter
+        self.applied_at = fighter.turns_taken
+        for stat, amount in self.spec.modifiers:
+            fighter.modifiers[stat] += amount
+        self.heal(fighter)
+        end = self.applied_at + self.duration
+        fighter.battle.schedule(fighter, self.applied_at + 1 if self.has_ticks() else end, self)
+        if self.cooldown:
+            fighter.battle.schedule(fighter, end + self.cooldown, self)
+
+    def update(self, fighter):
+        elapsed = self.elapsed()
+        if elapsed <= self.duration:
+            if self.has_ticks():
+                for stat, amount in self.spec.decay:
+                    fighter.modifiers[stat] += amount
+                self.heal(fighter)
+                if elapsed < self.duration:
+                    fighter.battle.schedule(fighter, fighter.turns_taken + 1, self)
+            if elapsed == self.duration:
+                self.expire(fighter)
+        if elapsed == self.duration + self.cooldown:
+            fighter.remove_buff(self)
+            if self.cooldown:
+                fighter.battle.log('%s cooldown over for %s', self.name, fighter.name, level=DEBUG)
+
+    def heal(self, fighter):
+        if self.spec.heal:
+            fighter.health += self.spec.heal
+            if fighter.battle.recorder:
+                fighter.battle.recorder.heal(fighter, self.spec.heal)
+
+    def expire(self, fighter):
+        for stat, amount in self.spec.modifiers:
+            fighter.modifiers[stat] -= amount
+        for stat, amount in self.spec.decay:
+            fighter.modifiers[stat] -= amount * self.duration
+        if fighter.battle.recorder:
+            fighter.battle.recorder.buff_expired(fighter, self)
+        fighter.battle.log('Buff %s expired for %s, cooldown started', self.name, fighter.name, level=DEBUG)
 
-        def tick_fn(fighter):
-            pass  # No ticking effect
+class BuffCreator:
+    @staticmethod
+    def create_berserk_rage():
+        return Buff(BERSERK_RAGE)
 
-        def remove_fn(fighter):
-            fighter.armor_class += 6  # Remove buff effect after expiration
+    @staticmethod
+    def create_defensive_stance():
+        return Buff(DEFENSIVE_STANCE)
 
-        return Buff('Shield Wall', duration=2, apply_fn=apply_fn, tick_fn=tick_fn, remove_fn=remove_fn, cooldown=5)
+    @staticmethod
+    def create_shield_wall():
+        return Buff(SHIELD_WALL)
 
     @staticmethod
     def create_heal_over_time():
-        def apply_fn(fighter):
-            fighter.health += 5  # Heal 5 HP immediately
-
-        def tick_fn(fighter):
-            fighter.health += 5  # Heal 5 HP each turn
-
-        def remove_fn(fighter):
-            pass  # No removal effect
-
-        return Buff('Heal Over Time', duration=3, apply_fn=apply_fn, tick_fn=tick_fn, remove_fn=remove_fn)
+        return Buff(HEAL_OVER_TIME)
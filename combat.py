@@ -0,0 +1,77 @@
+# combat.py
+from functools import lru_cache
+from dice import dice_distribution, hit_probability
+from weapon import weapon_list
+
+# Exact combat math, memoized so AIs can ask for it every turn. Weapons are
+# given by name, as in weapon_list; distributions are ((value, p), ...) pairs
+# in increasing order of value.
+
+TAIL = 1e-12  # turns_to_kill stops once less than this much probability is left
+
+def weapon_dice(weapon):
+    dice, sides, addend, range = weapon_list[weapon]
+    return dice, sides, addend
+
+@lru_cache(maxsize=None)
+def damage_distribution(weapon, damage_bonus=0):
+    dice, sides, addend = weapon_dice(weapon)
+    return tuple((total + addend + damage_bonus, p) for total, p in dice_distribution(dice, sides))
+
+@lru_cache(maxsize=None)
+def average_damage(weapon, damage_bonus=0):
+    dice, sides, addend = weapon_dice(weapon)
+    return dice * (1 + sides) / 2 + addend + damage_bonus
+
+def hit_chance(attack_bonus, armor_class, level):
+    """P(hit) for an attacker of level with attack_bonus against armor_class."""
+    return hit_probability(22 - armor_class - level - attack_bonus)
+
+@lru_cache(maxsize=None)
+def health_distribution(level):
+    return dice_distribution(level, 10)
+
+@lru_cache(maxsize=None)
+def expected_damage_per_turn(weapon, damage_bonus=0, attack_bonus=0, armor_class=10, level=1):
+    return hit_chance(attack_bonus, armor_class, level) * average_damage(weapon, damage_bonus)
+
+@lru_cache(maxsize=4096)
+def turns_to_kill(health, weapon, damage_bonus=0, attack_bonus=0, armor_class=10, level=1, max_turns=1000):
+    """((turns, p), ...) for the attacks needed to bring health to 0 or below."""
+    if health <= 0:
+        return ((0, 1.0),)
+    hit = hit_chance(attack_bonus, armor_class, level)
+    if hit == 0:
+        return ()
+    damage = damage_distribution(weapon, damage_bonus)
+    alive = {health: 1.0}  # remaining health -> P(still standing)
+    distribution = []
+    for turn in range(1, max_turns + 1):
+        survivors = {}
+        killed = 0.0
+        for left, p in alive.items():
+            survivors[left] = survivors.get(left, 0.0) + p * (1 - hit)
+            for amount, q in damage:
+                if amount >= left:
+                    killed += p * hit * q
+                else:
+                    survivors[left - amount] = survivors.get(left - amount, 0.0) + p * hit * q
+        if killed:
+            distribution.append((turn, killed))
+        alive = survivors
+        if sum(alive.values()) < TAIL:
+            break
+    return tuple(distribution)
+
+def expected_turns_to_kill(health, weapon, damage_bonus=0, attack_bonus=0, armor_class=10, level=1):
+    distribution = turns_to_kill(health, weapon, damage_bonus, attack_bonus, armor_class, level)
+    if not distribution:
+        return float('inf')
+    return sum(turns * p for turns, p in distribution) / sum(p for turns, p in distribution)
+
+def fighter_damage_per_turn(attacker, defender):
+    """Expected damage attacker deals defender with one attack, as they stand now."""
+    if attacker.weapon is None or attacker.weapon.name not in weapon_list:
+        return 0.0
+    return expected_damage_per_turn(attacker.weapon.name, attacker.damage_bonus, attacker.attack_bonus,
+                                     defender.armor_class, attacker.level)
@@ -0,0 +1,84 @@
+# dice.py
+import random
+from array import array
+from functools import lru_cache
+
+# Buffered dice. Uniform draws are taken from random 32 bits at a time, a
+# whole block per getrandbits call, so seeding random still fixes every roll.
+# An attack is settled with a single draw from an alias table over
+# "miss, or hit for d damage".
+
+BLOCK_SIZE = 4096
+SCALE = 2.0 ** -32
+
+@lru_cache(maxsize=None)
+def dice_distribution(dice, sides):
+    """((total, probability), ...) for the sum of dice rolls of 1..sides."""
+    distribution = {0: 1.0}
+    for _ in range(dice):
+        rolled = {}
+        for total, p in distribution.items():
+            for face in range(1, sides + 1):
+                rolled[total + face] = rolled.get(total + face, 0) + p / sides
+        distribution = rolled
+    return tuple(sorted(distribution.items()))
+
+def hit_probability(needed):
+    # Fighter.attack hits when 1d20 + attack_bonus >= 22 - armor_class - level,
+    # that is when the d20 shows at least needed
+    return min(20, max(0, 21 - needed)) / 20
+
+def alias_table(outcomes, probabilities):
+    # Vose's alias method: column i keeps outcome i with probability keep[i]
+    # and hands the rest of the column to outcome alias[i]
+    n = len(outcomes)
+    scaled = [p * n for p in probabilities]
+    keep, alias = [1.0] * n, list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        low, high = small.pop(), large.pop()
+        keep[low], alias[low] = scaled[low], high
+        scaled[high] -= 1 - scaled[low]
+        (small if scaled[high] < 1 else large).append(high)
+    return tuple(outcomes), tuple(keep), tuple(outcomes[i] for i in alias)
+
+@lru_cache(maxsize=None)
+def attack_table(dice, sides, addend, needed):
+    """Alias table over None for a miss, else the damage dealt."""
+    hit = hit_probability(needed)
+    outcomes, probabilities = [None], [1 - hit]
+    for total, p in dice_distribution(dice, sides):
+        outcomes.append(total + addend)
+        probabilities.append(hit * p)
+    return alias_table(outcomes, probabilities)
+
+class Dice:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.block = array('I')
+        self.next = 0
+
+    def refill(self):
+        self.block = array('I', random.getrandbits(32 * self.block_size).to_bytes(4 * self.block_size, 'little'))
+        self.next = 0
+
+    def uniform(self):
+        if self.next == len(self.block):
+            self.refill()
+        value = self.block[self.next]
+        self.next += 1
+        return value * SCALE
+
+    def roll(self, dice, sides):
+        return sum(int(self.uniform() * sides) + 1 for _ in range(dice))
+
+    def sample(self, table):
+        outcomes, keep, aliases = table
+        scaled = self.uniform() * len(outcomes)
+        column = int(scaled)
+        return outcomes[column] if scaled - column < keep[column] else aliases[column]
+
+    def attack(self, weapon, damage_bonus, needed):
+        """Damage dealt by one swing of weapon, or None for a miss."""
+        return self.sample(attack_table(weapon.dice, weapon.sides, weapon.addend + damage_bonus, needed))
@@ -0,0 +1,203 @@
+# events.py
+import json
+import struct
+from collections import namedtuple
+from enum import IntEnum
+from map import Map, Terrain, TERRAINS
+
+# Compact battle archives. Each battle is a length-prefixed JSON header
+# (title, map, roster) followed by fixed-width event records and an END
+# record, so a whole Arena run can stream into one file. A battle's header
+# is written by fight_battle, or by its first event if it is played round by
+# round, and its END record when the next battle starts or the file closes.
+
+class EventType(IntEnum):
+    END = 0
+    SPAWN = 1           # fighter, x, y, health
+    MOVE = 2            # fighter, x, y
+    HIT = 3             # fighter, target, damage, target health
+    MISS = 4            # fighter, target
+    BUFF_APPLIED = 5    # fighter, buff code
+    BUFF_EXPIRED = 6    # fighter, buff code
+    DEATH = 7           # fighter
+    WINNER = 8          # faction index, or -1 for a draw
+    HEAL = 9            # fighter, amount, health
+
+MAGIC = b'ARN1'
+HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<BHHhhh')  # type, turn, fighter, a, b, c
+
+BUFF_NAMES = ['Berserk Rage', 'Defensive Stance', 'Shield Wall', 'Heal Over Time']
+BUFF_CODES = {name: code for code, name in enumerate(BUFF_NAMES)}
+
+Event = namedtuple('Event', 'type turn fighter a b c')
+
+def terrain_changes(map):
+    plain = Terrain.PLAIN.value
+    if map.terrain.count(plain) == len(map.terrain):
+        return []
+    return [[index // map.height, index % map.height, code] for index, code in enumerate(map.terrain) if code != plain]
+
+class EventRecorder:
+    def __init__(self, path, buffer_size=1 << 16):
+        self.file = open(path, 'wb')
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.battle = None
+        self.factions = {}
+
+    def close(self):
+        if self.battle is not None:
+            self.end_battle(self.battle)
+        self.flush()
+        self.file.close()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+    def record(self, battle, type, fighter=0, a=0, b=0, c=0):
+        if battle is not self.battle:
+            self.start_battle(battle)
+        self.buffer += RECORD.pack(type, battle.turn, fighter, a, b, c)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def start_battle(self, battle):
+        if battle is self.battle:
+            return
+        if self.battle is not None:
+            self.end_battle(self.battle)
+        self.battle = battle
+        self.factions = {}
+        for fighter in battle.fighters:
+            self.factions.setdefault(fighter.faction, len(self.factions))
+        header = {
+            'title': battle.title,
+            'map': [battle.map.width, battle.map.height, battle.map.map_type],
+            'terrain': terrain_changes(battle.map),
+            'factions': list(self.factions),
+            'fighters': [{'id': fighter.id, 'name': fighter.name, 'faction': fighter.faction, 'level': fighter.level,
+                          'max_health': fighter.max_health, 'weapon': fighter.weapon.name if fighter.weapon else None}
+                         for fighter in battle.fighters],
+        }
+        header = json.dumps(header, separators=(',', ':')).encode()
+        self.buffer += HEADER.pack(MAGIC, len(header)) + header
+        for fighter in battle.fighters:
+            self.spawn(fighter)
+
+    def end_battle(self, battle):
+        self.record(battle, EventType.WINNER, a=self.factions.get(battle.winner, -1))
+        self.record(battle, EventType.END)
+        self.battle = None
+
+    def spawn(self, fighter):
+        self.record(fighter.battle, EventType.SPAWN, fighter.id, fighter.position.x, fighter.position.y, fighter.health)
+
+    def move(self, fighter):
+        self.record(fighter.battle, EventType.MOVE, fighter.id, fighter.position.x, fighter.position.y)
+
+    def hit(self, fighter, target, damage, health):
+        self.record(fighter.battle, EventType.HIT, fighter.id, target.id, damage, health)
+
+    def miss(self, fighter, target):
+        self.record(fighter.battle, EventType.MISS, fighter.id, target.id)
+
+    def buff_applied(self, fighter, buff):
+        self.record(fighter.battle, EventType.BUFF_APPLIED, fighter.id, BUFF_CODES.get(buff.name, -1))
+
+    def buff_expired(self, fighter, buff):
+        self.record(fighter.battle, EventType.BUFF_EXPIRED, fighter.id, BUFF_CODES.get(buff.name, -1))
+
+    def heal(self, fighter, amount):
+        self.record(fighter.battle, EventType.HEAL, fighter.id, amount, fighter.health)
+
+    def death(self, fighter):
+        self.record(fighter.battle, EventType.DEATH, fighter.id)
+
+#############################################################################
+# Reading archives back
+
+class ReplayFighter:
+    def __init__(self, id, name, faction, max_health):
+        self.id = id
+        self.name = name
+        self.faction = faction
+        self.max_health = max_health
+        self.health = max_health
+        self.position = None
+        self.buffs = []
+
+    def __repr__(self):
+        return f'{self.name} ({self.health}/{self.max_health}) [{self.faction}]'
+
+    def is_alive(self):
+        return self.health > 0
+
+class BattleReplay:
+    def __init__(self, header, events):
+        self.title = header['title']
+        self.width, self.height, self.map_type = header['map']
+        self.terrain = header['terrain']
+        self.factions = header['factions']
+        self.fighters = header['fighters']
+        self.events = events
+        winner = next((event.a for event in reversed(events) if event.type == EventType.WINNER), -1)
+        self.winner = self.factions[winner] if winner >= 0 else None
+        self.turns = events[-1].turn if events else 0
+
+    def __repr__(self):
+        return f'{self.title} ({len(self.events)} events, {self.turns} turns)'
+
+    def state_at(self, turn):
+        """Map and fighters as they stood at the end of the given turn (0 is deployment)."""
+        map = Map(self.width, self.height, self.map_type)
+        for x, y, terrain in self.terrain:
+            map.set_terrain(x, y, TERRAINS[terrain])
+        fighters = {info['id']: ReplayFighter(info['id'], info['name'], info['faction'], info['max_health'])
+                    for info in self.fighters}
+
+        for event in self.events:
+            if event.turn > turn:
+                break
+            fighter = fighters.get(event.fighter)
+            if event.type == EventType.SPAWN:
+                if fighter is None:
+                    fighter = fighters[event.fighter] = ReplayFighter(event.fighter, f'#{event.fighter}', None, event.c)
+                fighter.health = event.c
+                map.occupy_position(fighter, map.get_position(event.a, event.b))
+            elif event.type == EventType.MOVE:
+                map.move_fighter(fighter, map.get_position(event.a, event.b))
+            elif event.type == EventType.HIT:
+                fighters[event.a].health = event.c
+            elif event.type == EventType.HEAL:
+                fighter.health = event.b
+            elif event.type == EventType.BUFF_APPLIED:
+                fighter.buffs.append(BUFF_NAMES[event.a] if event.a >= 0 else '?')
+            elif event.type == EventType.BUFF_EXPIRED:
+                name = BUFF_NAMES[event.a] if event.a >= 0 else '?'
+                if name in fighter.buffs:
+                    fighter.buffs.remove(name)
+            elif event.type == EventType.DEATH:
+                map.vacate_position(fighter.position)
+        return map, fighters
+
+def read_battles(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset < len(data):
+        magic, length = HEADER.unpack_from(data, offset)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a battle archive (offset {offset})')
+        offset += HEADER.size
+        header = json.loads(data[offset:offset + length])
+        offset += length
+        events = []
+        while True:
+            event = Event(*RECORD.unpack_from(data, offset))
+            offset += RECORD.size
+            if event.type == EventType.END:
+                break
+            events.append(event)
+        yield BattleReplay(header, events)
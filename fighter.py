@@ -1,4 +1,7 @@
 import random
+from collections import namedtuple
+from logging import DEBUG
+from time import perf_counter
 from map import *
 from buff import *
 from weapon import *
@@ -22,6 +25,11 @@ shield_list = {
     'large shield': 2
 }
 
+# Everything a battle changes about a fighter, as Fighter.save captures it;
+# buffs are (spec, applied_at) pairs
+FighterState = namedtuple('FighterState', 'weapon health max_health turns_taken base_armor_class base_attack_bonus '
+                                          'base_damage_bonus modifiers buffs')
+
 # Dice rolling function
 def roll(dice, sides):
     return sum(random.randint(1, sides) for _ in range(dice))
@@ -33,19 +41,73 @@ class Fighter:
     def __init__(self, name, level, ai, faction, weapon=None, armor=None, shield=None):
         self.name = name
         self.level = level
-        self.max_health = sum(roll(1, 10) for _ in range(level))
-        self.health = self.max_health
         self.faction = faction
-        self.position = None  # This will be set when the fighter is added to the map
         self.weapon = create_weapon(weapon)
         self.armor = armor
         self.shield = shield
-        self.armor_class = 10 - armor_list.get(self.armor, 0) - shield_list.get(self.shield, 0)
-        self.battle = None
+        self.id = None  # set by the battle
+        self.slot = None  # index in the battle's roster for the faction
         self.ai = ai
-        self.buffs = []
-        self.attack_bonus = 0
-        self.damage_bonus = 0
+        self.reset()
+
+    def reset(self):
+        # everything a new battle starts afresh, hit points included
+        self.max_health = sum(roll(1, 10) for _ in range(self.level))
+        self.health = self.max_health
+        self.position = None  # This will be set when the fighter is added to the map
+        self.battle = None
+        self.turns_taken = 0
+        self.active_buffs = {}  # name -> Buff, until its cooldown is over
+        self.modifiers = {'armor_class': 0, 'attack_bonus': 0, 'damage_bonus': 0}  # running totals of buff modifiers
+        self.base_armor_class = 10 - armor_list.get(self.armor, 0) - shield_list.get(self.shield, 0)
+        self.base_attack_bonus = 0
+        self.base_damage_bonus = 0
+
+    def save(self):
+        return FighterState(self.weapon, self.health, self.max_health, self.turns_taken, self.base_armor_class,
+                            self.base_attack_bonus, self.base_damage_bonus, tuple(self.modifiers.items()),
+                            tuple((buff.spec, buff.applied_at) for buff in self.active_buffs.values()))
+
+    def restore(self, state):
+        # as saved, out of any battle; the battle puts the fighter back and reschedules its buffs
+        self.weapon, self.health, self.max_health, self.turns_taken = state[:4]
+        self.base_armor_class, self.base_attack_bonus, self.base_damage_bonus = state[4:7]
+        self.modifiers = dict(state.modifiers)
+        self.active_buffs = {}
+        for spec, applied_at in state.buffs:
+            buff = self.active_buffs[spec.name] = Buff(spec)
+            buff.fighter, buff.applied_at = self, applied_at
+        self.position = None
+        self.battle = None
+
+    # effective stats are the base plus whatever buffs add; setting one moves the base
+    @property
+    def armor_class(self):
+        return self.base_armor_class + self.modifiers['armor_class']
+
+    @armor_class.setter
+    def armor_class(self, value):
+        self.base_armor_class = value - self.modifiers['armor_class']
+
+    @property
+    def attack_bonus(self):
+        return self.base_attack_bonus + self.modifiers['attack_bonus']
+
+    @attack_bonus.setter
+    def attack_bonus(self, value):
+        self.base_attack_bonus = value - self.modifiers['attack_bonus']
+
+    @property
+    def damage_bonus(self):
+        return self.base_damage_bonus + self.modifiers['damage_bonus']
+
+    @damage_bonus.setter
+    def damage_bonus(self, value):
+        self.base_damage_bonus = value - self.modifiers['damage_bonus']
+
+    @property
+    def buffs(self):
+        return list(self.active_buffs.values())
 
     def __repr__(self):
         ai_name = self.ai.__class__.__name__ if hasattr(self.ai, '__class__') else str(self.ai)
@@ -61,79 +123,101 @@ class Fighter:
     def take_turn(self):
         if self.is_dead():
             return # RIP
-        # Tick buffs before taking turn
-        for buff in self.buffs[:]:
-            buff.tick(self)
-        # Remove buffs that have finished cooldown
-        self.buffs = [buff for buff in self.buffs if buff.remaining_cooldown > 0 or buff.remaining_duration > 0]
+        # Update only the buffs that change state this turn
+        profiler = self.battle.profiler
+        started = profiler and perf_counter()
+        self.turns_taken += 1
+        due = self.battle.timers.pop((self, self.turns_taken), None)
+        if due:
+            for buff in due:
+                buff.update(self)
+        if profiler:
+            profiler.stop('buffs', started)
+            started = perf_counter()
         self.ai.take_turn(self)
+        if profiler:
+            profiler.stop('ai', started)
 
     def attack(self, opponent):
         if opponent is None or opponent.health <= 0:
-            self.battle.log(f'{self.name} cannot attack because the opponent is not valid or is already dead.')
+            self.battle.log('%s cannot attack because the opponent is not valid or is already dead.', self.name, level=DEBUG)
             return
 
         if self.weapon is None:
-            self.battle.log(f'{self.name} has no weapon to attack with.')
+            self.battle.log('%s has no weapon to attack with.', self.name, level=DEBUG)
             return
 
         if not self.battle.map.is_within_range(self.position, opponent.position, self.weapon.range):
-            self.battle.log(f'{self.name} cannot attack {opponent.name} because they are out of range.')
+            self.battle.log('%s cannot attack %s because they are out of range.', self.name, opponent.name, level=DEBUG)
             return
 
-        attack_roll = roll(1, 20) + self.attack_bonus
-        to_hit_target = 22 - opponent.armor_class - self.level
+        profiler = self.battle.profiler
+        started = profiler and perf_counter()
+        # one draw settles both the 1d20 + attack_bonus >= 22 - armor_class - level
+        # roll and the weapon's damage
+        needed = 22 - opponent.armor_class - self.level - self.attack_bonus
+        damage = self.battle.dice.attack(self.weapon, self.damage_bonus, needed)
 
-        if attack_roll >= to_hit_target:
-            damage_dice = self.weapon.dice
-            damage_size = self.weapon.sides
-            bonus_damage = self.weapon.addend
-            damage = roll(damage_dice, damage_size) + bonus_damage + self.damage_bonus
+        if damage is not None:
+            if self.battle.recorder:
+                self.battle.recorder.hit(self, opponent, damage, opponent.health - damage)
             opponent.take_damage(damage, self)
-            self.battle.log(f'{self.name} attacks {opponent.name} with {self.weapon.name} for {damage} damage!')
+            self.battle.log('%s attacks %s with %s for %d damage!', self.name, opponent.name, self.weapon.name, damage)
         else:
-            self.battle.log(f'{self.name} misses {opponent.name}')
+            if self.battle.recorder:
+                self.battle.recorder.miss(self, opponent)
+            self.battle.log('%s misses %s', self.name, opponent.name)
+        if profiler:
+            profiler.stop('attack', started)
 
     def take_damage(self, damage, attacker):
-        self.battle.log(f'{attacker.name} attacks {self.name} for {damage} damage!')
+        self.battle.log('%s attacks %s for %d damage!', attacker.name, self.name, damage)
         self.health -= damage
         if self.health <= 0:
             self.die()
 
     def die(self):
-        self.battle.log(f'{self.name} dies!')
-        teammates = [f for f in self.battle.fighters if f.faction == self.faction and f != self]
-        if len(teammates) == 1:
-            last_teammate = teammates[0]
+        self.battle.log('%s dies!', self.name)
+        if self.battle.recorder:
+            self.battle.recorder.death(self)
+        roster = self.battle.rosters[self.faction]
+        if len(roster) == 2:
+            last_teammate = roster[1 - self.slot]
             berserk_rage_buff = BuffCreator.create_berserk_rage()
             last_teammate.apply_buff(berserk_rage_buff)
-            self.battle.log(f'{last_teammate.name} goes into a Berserk Rage!')
+            self.battle.log('%s goes into a Berserk Rage!', last_teammate.name)
         self.battle.remove_fighter(self)
         self.battle = None
 
     def take_defensive_action(self):
-        shield_wall_buff_active = any(buff.name == 'Shield Wall' and buff.remaining_cooldown == 0 for buff in self.buffs)
-        if self.shield and not shield_wall_buff_active:
+        if self.shield:
             self.apply_buff(BuffCreator.create_shield_wall())
-        else:
-            defensive_stance_buff_active = any(buff.name == 'Defensive Stance' and buff.remaining_cooldown == 0 for buff in self.buffs)
-            if not defensive_stance_buff_active:
-                self.apply_buff(BuffCreator.create_defensive_stance())
+        elif DEFENSIVE_STANCE.name not in self.active_buffs:
+            self.apply_buff(BuffCreator.create_defensive_stance())
 
     def apply_buff(self, buff):
-        for active_buff in self.buffs:
-            if active_buff.name == buff.name and (active_buff.remaining_duration > 0 or active_buff.remaining_cooldown > 0):
-                self.battle.log(f'{self.name} already has buff: {buff.name} with remaining duration: {active_buff.remaining_duration} or cooldown: {active_buff.remaining_cooldown}')
-                return
+        active_buff = self.active_buffs.get(buff.name)
+        if active_buff:
+            self.battle.log('%s already has buff: %s with remaining duration: %d or cooldown: %d', self.name, buff.name,
+                            active_buff.remaining_duration, active_buff.remaining_cooldown, level=DEBUG)
+            return
+        self.active_buffs[buff.name] = buff
         buff.apply(self)
-        self.buffs.append(buff)
-        self.battle.log(f'{self.name} gains buff: {buff.name}')
+        if self.battle.recorder:
+            self.battle.recorder.buff_applied(self, buff)
+        self.battle.log('%s gains buff: %s', self.name, buff.name)
+
+    def remove_buff(self, buff):
+        if self.active_buffs.get(buff.name) is buff:
+            del self.active_buffs[buff.name]
 
     def move_to(self, position: Position):
         if self.battle and self.position:
             if self.battle.map.is_position_occupied(position):
-                self.battle.log(f"{self.name} cannot move to {position}, position is occupied.")
+                self.battle.log('%s cannot move to %s, position is occupied.', self.name, position, level=DEBUG)
                 return
-            terrain_cost = TERRAIN_COSTS.get(position.terrain, 1)
             self.battle.map.move_fighter(self, position)
-            self.battle.log(f'{self.name} moves to {position} with terrain cost {terrain_cost}')
+            if self.battle.recorder:
+                self.battle.recorder.move(self)
+            if self.battle.is_logging(DEBUG):
+                self.battle.log('%s moves to %s with terrain cost %s', self.name, position, TERRAIN_COSTS.get(position.terrain, 1), level=DEBUG)
@@ -1,6 +1,10 @@
 # map.py
+from array import array
+from collections import OrderedDict
 from enum import Enum
 import heapq
+from itertools import islice, takewhile
+from time import perf_counter
 from typing import List, Tuple, Dict
 
 # Position and Terrain classes for spatial mechanics
@@ -17,13 +21,80 @@ TERRAIN_COSTS = {
     Terrain.WATER: float('inf')  # Impassable
 }
 
+# Maps store terrain as Terrain.value codes
+TERRAINS = {terrain.value: terrain for terrain in Terrain}
+TERRAIN_COSTS_BY_CODE = [float('inf')] * (max(TERRAINS) + 1)
+for code, terrain in TERRAINS.items():
+    TERRAIN_COSTS_BY_CODE[code] = TERRAIN_COSTS[terrain]
+
+# Neighbor directions, in the order get_neighbors returns them
+NEIGHBOR_DELTAS = {
+    'grid8': [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)],
+    'grid4': [(-1, 0), (0, -1), (0, 1), (1, 0)],
+    'hex': [(-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0)],
+}
+
+OFFSET_TABLES = {}  # (map_type, radius) -> offsets, filled by offsets_within
+
+EMPTY = -1  # occupancy of a cell with nobody in it
+PATH_CACHE_SIZE = 64  # distance fields, one per goal cell
+BUCKET_SIZE = 8  # side of the square buckets in the spatial index
+
+def offset_distance(map_type, dx, dy):
+    if map_type == 'grid4':
+        return abs(dx) + abs(dy)
+    elif map_type == 'grid8':
+        return max(abs(dx), abs(dy))
+    return (abs(dx) + abs(dx + dy) + abs(dy)) // 2
+
+def offsets_within(map_type, radius):
+    # every (dx, dy) other than (0, 0) within radius, nearest first; the
+    # radius 1 table is NEIGHBOR_DELTAS in get_neighbors order
+    offsets = OFFSET_TABLES.get((map_type, radius))
+    if offsets is None:
+        square = [(dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)]
+        distances = {offset: offset_distance(map_type, *offset) for offset in square}
+        offsets = OFFSET_TABLES[map_type, radius] = tuple(sorted(
+            (offset for offset in square if 0 < distances[offset] <= radius),
+            key=lambda offset: (distances[offset], offset)))
+    return offsets
+
 class Position:
-    def __init__(self, x, y, map_type, terrain=Terrain.PLAIN):
+    # A Position made by a Map is a view onto that map's cell arrays; one
+    # made by hand carries its own terrain and fighter.
+    def __init__(self, x, y, map_type, terrain=Terrain.PLAIN, map=None):
         self.x = x
         self.y = y
         self.map_type = map_type
-        self.terrain = terrain
-        self.fighter = None
+        self.map = map
+        self._terrain = terrain
+        self._fighter = None
+
+    @property
+    def terrain(self):
+        if self.map is None:
+            return self._terrain
+        return TERRAINS[self.map.terrain[self.x * self.map.height + self.y]]
+
+    @terrain.setter
+    def terrain(self, terrain):
+        if self.map is None:
+            self._terrain = terrain
+        else:
+            self.map.set_terrain(self.x, self.y, terrain)
+
+    @property
+    def fighter(self):
+        if self.map is None:
+            return self._fighter
+        return self.map.fighter_at(self.x * self.map.height + self.y)
+
+    @fighter.setter
+    def fighter(self, fighter):
+        if self.map is None:
+            self._fighter = fighter
+        else:
+            self.map.set_occupant(self.x * self.map.height + self.y, fighter)
 
     def __repr__(self):
         return f"({self.x}, {self.y}, {self.map_type}, {self.terrain})"
@@ -40,30 +111,158 @@ class Position:
         return (self.x, self.y) < (other.x, other.y)
 
 class Map:
+    # Cells are indexed x * height + y. terrain holds Terrain codes and
+    # occupancy holds fighter ids (indexes into occupants) or EMPTY.
     def __init__(self, width, height, map_type='grid4'):
         self.width = width
         self.height = height
         self.map_type = map_type
-        self.grid = [[Position(x, y, map_type, Terrain.PLAIN) for y in range(height)] for x in range(width)]
+        self.terrain = bytearray([Terrain.PLAIN.value]) * (width * height)
+        self.occupancy = array('i', [EMPTY]) * (width * height)
+        self.occupants = []  # fighter id -> fighter
+        self.occupant_ids = {}  # fighter -> id
+        self.views = {}  # Position views, made on demand
+        self._grid = None  # every view as a list of columns, once something asks for grid
+        self.neighbor_table = [None] * (width * height)  # cell -> neighbor cells, filled on demand
+        self.version = 0  # bumped on every change to terrain or occupancy
+        self.terrain_version = 0
+        self.faction_versions = {}  # bumped whenever a fighter of that faction comes or goes
+        self.fields = {}  # faction -> (versions, distance field)
+        self.path_cache = OrderedDict()  # (goal cell, terrain version) -> distance field to the goal
+        self.path_cache_size = PATH_CACHE_SIZE
+        self.path_cache_hits = 0
+        self.path_cache_misses = 0
+        self.buckets = {}  # faction -> {(bucket x, bucket y): fighters}
         self.refresh_needed = False
+        self.profiler = None  # profiling.Profiler, set by the battle when profiling
+
+    @property
+    def grid(self):
+        # a cell's view never changes, so the grid is built once and kept
+        if self._grid is None:
+            self._grid = [[self.get_position(x, y) for y in range(self.height)] for x in range(self.width)]
+        return self._grid
 
     def get_position(self, x, y):
         if 0 <= x < self.width and 0 <= y < self.height:
-            return self.grid[x][y]
+            index = x * self.height + y
+            view = self.views.get(index)
+            if view is None:
+                view = self.views[index] = Position(x, y, self.map_type, map=self)
+            return view
         return None
 
+    def fighter_at(self, index):
+        id = self.occupancy[index]
+        return None if id == EMPTY else self.occupants[id]
+
+    def set_occupant(self, index, fighter):
+        self.version += 1
+        previous = self.fighter_at(index)
+        if previous is not None:
+            self.bump_faction(previous)
+            self.bucket(previous, index).remove(previous)
+        if fighter is None:
+            self.occupancy[index] = EMPTY
+            return
+        self.bump_faction(fighter)
+        id = self.occupant_ids.get(fighter)
+        if id is None:
+            id = self.occupant_ids[fighter] = len(self.occupants)
+            self.occupants.append(fighter)
+        self.occupancy[index] = id
+        self.bucket(fighter, index).append(fighter)
+
+    def bucket(self, fighter, index):
+        x, y = divmod(index, self.height)
+        key = (x // BUCKET_SIZE, y // BUCKET_SIZE)
+        return self.buckets.setdefault(getattr(fighter, 'faction', None), {}).setdefault(key, [])
+
+    def bump_faction(self, fighter):
+        faction = getattr(fighter, 'faction', None)
+        self.faction_versions[faction] = self.faction_versions.get(faction, 0) + 1
+
     def set_terrain(self, x, y, terrain):
-        pos = self.get_position(x, y)
-        if pos:
-            pos.terrain = terrain
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.terrain[x * self.height + y] = terrain.value
+            self.terrain_version += 1
+            self.version += 1
+
+    def fill_terrain(self, terrain, x=0, y=0, width=None, height=None):
+        width = self.width - x if width is None else width
+        height = self.height - y if height is None else height
+        x0, x1 = max(x, 0), min(x + width, self.width)
+        y0, y1 = max(y, 0), min(y + height, self.height)
+        if y1 > y0:
+            column = bytes([terrain.value]) * (y1 - y0)
+            for column_x in range(x0, x1):
+                start = column_x * self.height + y0
+                self.terrain[start:start + y1 - y0] = column
+        self.terrain_version += 1
+        self.version += 1
+
+    def load_terrain(self, rows):
+        # rows[y][x] of Terrain members or codes, as the map is printed
+        for y, row in enumerate(rows):
+            for x, terrain in enumerate(row):
+                self.terrain[x * self.height + y] = getattr(terrain, 'value', terrain)
+        self.terrain_version += 1
+        self.version += 1
+
+    def clear_occupants(self):
+        for fighter in self.occupants:
+            if fighter.position is not None and fighter.position.map is self:
+                fighter.position = None
+        self.occupancy = array('i', [EMPTY]) * (self.width * self.height)
+        self.occupants = []
+        self.occupant_ids = {}
+        self.faction_versions = {}
+        self.fields = {}
+        self.buckets = {}
+        self.version += 1
+        self.refresh_needed = True
+
+    def reset(self):
+        self.clear_occupants()
+        self.terrain = bytearray([Terrain.PLAIN.value]) * (self.width * self.height)
+        self.terrain_version += 1
+        self.version += 1
+
+    def copy(self):
+        # the copy shares fighters, which keep pointing at their own map
+        other = Map.__new__(Map)
+        other.width = self.width
+        other.height = self.height
+        other.map_type = self.map_type
+        other.terrain = bytearray(self.terrain)
+        other.occupancy = array('i', self.occupancy)
+        other.occupants = list(self.occupants)
+        other.occupant_ids = dict(self.occupant_ids)
+        other.views = {}
+        other._grid = None
+        other.neighbor_table = self.neighbor_table
+        other.terrain_version = self.terrain_version
+        other.faction_versions = dict(self.faction_versions)
+        other.fields = {}
+        other.version = self.version
+        other.path_cache = OrderedDict()
+        other.path_cache_size = self.path_cache_size
+        other.path_cache_hits = other.path_cache_misses = 0
+        other.buckets = {faction: {key: list(fighters) for key, fighters in buckets.items()}
+                         for faction, buckets in self.buckets.items()}
+        other.refresh_needed = True
+        other.profiler = None
+        return other
 
     def occupy_position(self, fighter, pos):
+        pos = pos and self.get_position(pos.x, pos.y)
         if pos and pos.fighter is None:
             pos.fighter = fighter
             fighter.position = pos
             self.refresh_needed = True
 
     def vacate_position(self, pos):
+        pos = pos and self.get_position(pos.x, pos.y)
         if pos and pos.fighter:
             pos.fighter.position = None
             pos.fighter = None
@@ -90,20 +289,166 @@ class Map:
 
     def get_neighbors(self, pos):
         neighbors = []
-        if self.map_type == 'grid8':
-            deltas = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
-        elif self.map_type == 'grid4':
-            deltas = [(-1, 0), (0, -1), (0, 1), (1, 0)]
-        elif self.map_type == 'hex':
-            deltas = [(-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0)]
-
-        for dx, dy in deltas:
+        for dx, dy in NEIGHBOR_DELTAS[self.map_type]:
             neighbor = self.get_position(pos.x + dx, pos.y + dy)
             if neighbor:
                 neighbors.append(neighbor)
 
         return neighbors
 
+    def cell_neighbors(self, cell):
+        neighbors = self.neighbor_table[cell]
+        if neighbors is None:
+            x, y = divmod(cell, self.height)
+            neighbors = self.neighbor_table[cell] = tuple(
+                (x + dx) * self.height + y + dy for dx, dy in NEIGHBOR_DELTAS[self.map_type]
+                if 0 <= x + dx < self.width and 0 <= y + dy < self.height)
+        return neighbors
+
+    def cells_within(self, pos, radius):
+        x, y, width, height = pos.x, pos.y, self.width, self.height
+        return [(x + dx) * height + y + dy for dx, dy in offsets_within(self.map_type, radius)
+                if 0 <= x + dx < width and 0 <= y + dy < height]
+
+    def fighters_within(self, pos, radius):
+        """Fighters on other cells within radius of pos, nearest first."""
+        occupancy, occupants = self.occupancy, self.occupants
+        return [occupants[occupancy[cell]] for cell in self.cells_within(pos, radius) if occupancy[cell] != EMPTY]
+
+    def distance_field(self, faction):
+        """Terrain-weighted cost from every cell to the nearest fighter not in faction."""
+        # only rebuilt once terrain or some other faction's fighters have changed, so the
+        # faction's own fighters must not shape it; step_towards_enemies skips occupied cells
+        profiler = self.profiler
+        started = profiler and perf_counter()
+        versions = (self.terrain_version, tuple(item for item in self.faction_versions.items() if item[0] != faction))
+        cached = self.fields.get(faction)
+        if cached is not None and cached[0] == versions:
+            distance = cached[1]
+            if profiler:
+                profiler.count('fields.cache_hits')
+        else:
+            sources = []
+            for fighter in self.occupants:
+                position = fighter.position
+                if position is not None and position.map is self and fighter.faction != faction:
+                    sources.append(position.x * self.height + position.y)
+            distance = self.build_field(sources)
+            self.fields[faction] = (versions, distance)
+        if profiler:
+            profiler.stop('pathfinding', started)
+        return distance
+
+    def field_to(self, goal):
+        """Terrain-weighted cost from every cell to the goal Position; fighters do not shape it."""
+        profiler = self.profiler
+        started = profiler and perf_counter()
+        distance = self.goal_field(goal.x * self.height + goal.y)
+        if profiler:
+            profiler.stop('pathfinding', started)
+        return distance
+
+    def goal_field(self, goal):
+        # every path query goes through here: movers step down these fields, A* uses
+        # them as its heuristic, and they stay valid until the terrain changes
+        key = (goal, self.terrain_version)
+        distance = self.path_cache.get(key)
+        if distance is None:
+            self.path_cache_misses += 1
+            distance = self.path_cache[key] = self.build_field(key[:1])
+            if len(self.path_cache) > self.path_cache_size:
+                self.path_cache.popitem(last=False)
+        else:
+            self.path_cache_hits += 1
+            self.path_cache.move_to_end(key)
+            if self.profiler:
+                self.profiler.count('fields.cache_hits')
+        return distance
+
+    def build_field(self, sources):
+        # multi-source Dijkstra over terrain costs
+        if self.profiler:
+            self.profiler.count('fields.built')
+        inf = float('inf')
+        terrain, costs = self.terrain, TERRAIN_COSTS_BY_CODE
+        neighbor_table, cell_neighbors = self.neighbor_table, self.cell_neighbors
+        distance = [inf] * (self.width * self.height)
+        frontier = []
+        for cell in sources:
+            distance[cell] = 0
+            frontier.append((0, cell))
+        heapq.heapify(frontier)
+
+        while frontier:
+            cost, cell = heapq.heappop(frontier)
+            if cost > distance[cell]:
+                continue
+            cost += costs[terrain[cell]]
+            if cost == inf:
+                continue
+            for neighbor in neighbor_table[cell] or cell_neighbors(cell):
+                if cost < distance[neighbor]:
+                    distance[neighbor] = cost
+                    heapq.heappush(frontier, (cost, neighbor))
+        return distance
+
+    def step_towards_enemies(self, position, faction):
+        """The free neighboring Position downhill on faction's distance field, or None."""
+        return self.step_downhill(position, self.distance_field(faction))
+
+    def step_towards(self, position, goal):
+        """The free neighboring Position downhill on the goal's distance field, or None."""
+        return self.step_downhill(position, self.field_to(goal))
+
+    def step_downhill(self, position, distance):
+        terrain, occupancy, costs = self.terrain, self.occupancy, TERRAIN_COSTS_BY_CODE
+        cell = position.x * self.height + position.y
+        best, best_cost = None, float('inf')
+        for neighbor in self.neighbor_table[cell] or self.cell_neighbors(cell):
+            if occupancy[neighbor] == EMPTY and distance[neighbor] < distance[cell]:
+                cost = costs[terrain[neighbor]] + distance[neighbor]
+                if cost < best_cost:
+                    best, best_cost = neighbor, cost
+        return None if best is None else self.get_position(*divmod(best, self.height))
+
+    def enemies_by_distance(self, position, faction):
+        """Yield (distance, fighter) for fighters not in faction, nearest first."""
+        # Buckets are searched in square rings; anything in ring r + 1 is at
+        # least r * BUCKET_SIZE + 1 away under all three metrics. Ties come
+        # out in placement order, like a scan of battle.fighters.
+        bucket_x, bucket_y = position.x // BUCKET_SIZE, position.y // BUCKET_SIZE
+        last_ring = max(bucket_x, bucket_y, (self.width - 1) // BUCKET_SIZE - bucket_x,
+                        (self.height - 1) // BUCKET_SIZE - bucket_y)
+        enemy_buckets = [buckets for other, buckets in self.buckets.items() if other != faction]
+        found = []
+        for ring in range(last_ring + 1):
+            for x in range(bucket_x - ring, bucket_x + ring + 1):
+                edge = x in (bucket_x - ring, bucket_x + ring)
+                for y in range(bucket_y - ring, bucket_y + ring + 1) if edge else (bucket_y - ring, bucket_y + ring):
+                    for buckets in enemy_buckets:
+                        for fighter in buckets.get((x, y), ()):
+                            distance = self.calculate_distance(position, fighter.position)
+                            heapq.heappush(found, (distance, self.occupant_ids[fighter], fighter))
+            bound = ring * BUCKET_SIZE + 1
+            while found and found[0][0] < bound:
+                distance, _, fighter = heapq.heappop(found)
+                yield distance, fighter
+        while found:
+            distance, _, fighter = heapq.heappop(found)
+            yield distance, fighter
+
+    def nearest_enemy(self, position, faction):
+        for distance, fighter in self.enemies_by_distance(position, faction):
+            return fighter
+        return None
+
+    def k_nearest_enemies(self, position, faction, k):
+        return [fighter for distance, fighter in islice(self.enemies_by_distance(position, faction), k)]
+
+    def enemies_within(self, position, faction, distance):
+        nearby = takewhile(lambda found: found[0] <= distance, self.enemies_by_distance(position, faction))
+        return [fighter for _, fighter in nearby]
+
     def move_towards(self, start_pos, target_pos):
         if self.map_type == 'grid4':
             dx = target_pos.x - start_pos.x
@@ -160,42 +505,60 @@ class Map:
         return self.calculate_distance(a, b)
 
     def astar(self, start: Position, goal: Position) -> List[Position]:
-        open_set = []
-        heapq.heappush(open_set, (0, start))
-        came_from: Dict[Position, Position] = {}
-        g_score: Dict[Position, int] = {start: 0}
-        f_score: Dict[Position, int] = {start: self.heuristic(start, goal)}
-
-        open_set_hash = {start}
+        if not (self.is_valid_position(start) and self.is_valid_position(goal)):
+            return []
+        profiler = self.profiler
+        started = profiler and perf_counter()
+        path = self.search_path(start.x * self.height + start.y, goal.x * self.height + goal.y)
+        if profiler:
+            profiler.stop('pathfinding', started)
+        return [start] + path[1:] if path else []
+
+    def search_path(self, source, target) -> List[Position]:
+        # Searches flat cell indexes; since cells are numbered x * height + y,
+        # heap ties still break on (x, y) exactly as Positions would. The goal's
+        # cached field is the heuristic: exact but for fighters in the way.
+        height = self.height
+        estimate = self.goal_field(target)
+        terrain, occupancy, costs = self.terrain, self.occupancy, TERRAIN_COSTS_BY_CODE
+        neighbor_table, cell_neighbors = self.neighbor_table, self.cell_neighbors
+        inf = float('inf')
+
+        open_set = [(0, source)]
+        open_cells = {source}
+        came_from: Dict[int, int] = {}
+        g_score: Dict[int, float] = {source: 0}
+        expanded = 0  # every push is either expanded or still on the heap at the end
 
         while open_set:
             current = heapq.heappop(open_set)[1]
-            open_set_hash.remove(current)
+            open_cells.remove(current)
+            expanded += 1
 
-            if current == goal:
+            if current == target:
                 path = []
-                while current in came_from:
-                    path.append(current)
+                while True:
+                    path.append(self.get_position(*divmod(current, height)))
+                    if current not in came_from:
+                        break
                     current = came_from[current]
-                path.append(start)
                 path.reverse()
+                if self.profiler:
+                    self.profiler.search(expanded, expanded + len(open_set), len(path) - 1)
                 return path
 
-            for neighbor in self.get_neighbors(current):
-                # Calculate terrain cost
-                terrain_cost = TERRAIN_COSTS.get(neighbor.terrain, float('inf'))
-
-                # If the neighbor is occupied by a fighter, increase the cost significantly
-                if neighbor.fighter:
-                    terrain_cost = float('inf')
-
-                tentative_g_score = g_score[current] + terrain_cost
-                if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
+            current_g = g_score[current]
+            for neighbor in neighbor_table[current] or cell_neighbors(current):
+                # occupied cells are as impassable as water
+                tentative_g_score = current_g + (costs[terrain[neighbor]] if occupancy[neighbor] == EMPTY else inf)
+                old_g_score = g_score.get(neighbor)
+                if old_g_score is None or tentative_g_score < old_g_score:
                     came_from[neighbor] = current
                     g_score[neighbor] = tentative_g_score
-                    f_score[neighbor] = tentative_g_score + self.heuristic(neighbor, goal)
-                    if neighbor not in open_set_hash:
-                        heapq.heappush(open_set, (f_score[neighbor], neighbor))
-                        open_set_hash.add(neighbor)
+                    if neighbor not in open_cells:
+                        heapq.heappush(open_set, (tentative_g_score + estimate[neighbor], neighbor))
+                        open_cells.add(neighbor)
 
+        if self.profiler:
+            self.profiler.search(expanded, expanded, 0)
         return []
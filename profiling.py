@@ -0,0 +1,107 @@
+# profiling.py
+import tracemalloc
+from time import perf_counter
+
+# Opt-in instrumentation. A Battle, its Map and the AIs only look for a
+# profiler when battle.profiler is set, so an unprofiled battle pays one
+# attribute check per phase. The timed code reads
+#     start = profiler and perf_counter()
+#     ...
+#     if profiler:
+#         profiler.stop('phase', start)
+# Phases nest: a turn's 'ai' time includes its 'movement', 'pathfinding'
+# and 'attack' time, and 'round' includes everything but 'setup'.
+# 'pathfinding' covers distance field lookups, most of them cache hits,
+# field builds and A* searches, wherever they are made from.
+
+PHASES = ('setup', 'round', 'order', 'buffs', 'ai', 'movement', 'pathfinding', 'attack', 'logging')
+
+class Profiler:
+    def __init__(self, allocations=False):
+        self.allocations = allocations  # trace memory per battle with tracemalloc; slows everything down
+        self.timers = {}  # phase -> [calls, seconds]
+        self.counters = {}
+        self.battles = 0
+        self.peak_memory = []  # per battle, bytes above what was allocated when it started
+        self.retained_memory = []  # per battle, bytes still allocated when it ended
+        self.tracing = False  # whether this profiler started tracemalloc
+        self.memory_start = 0
+
+    def stop(self, phase, start):
+        timer = self.timers.get(phase)
+        if timer is None:
+            timer = self.timers[phase] = [0, 0.0]
+        timer[0] += 1
+        timer[1] += perf_counter() - start
+
+    def count(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def search(self, expanded, pushes, path_length):
+        self.count('astar.searches')
+        self.count('astar.expanded', expanded)
+        self.count('astar.pushes', pushes)
+        self.count('astar.path_length', path_length)
+
+    def start_battle(self):
+        self.battles += 1
+        if self.allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+
+    def end_battle(self):
+        if self.allocations and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak_memory.append(peak - self.memory_start)
+            self.retained_memory.append(current - self.memory_start)
+
+    def close(self):
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def __getstate__(self):
+        # tallies only; whoever unpickles it did not start any tracing
+        return dict(self.__dict__, tracing=False)
+
+    def merge(self, other):
+        """Add another profiler's tallies, say from another Arena block, to this one."""
+        for phase, (calls, seconds) in other.timers.items():
+            timer = self.timers.setdefault(phase, [0, 0.0])
+            timer[0] += calls
+            timer[1] += seconds
+        for counter, amount in other.counters.items():
+            self.count(counter, amount)
+        self.battles += other.battles
+        self.peak_memory.extend(other.peak_memory)
+        self.retained_memory.extend(other.retained_memory)
+
+    def breakdown(self):
+        """(phase, calls, seconds) in PHASES order, with 'targeting' for the ai time not spent moving or attacking."""
+        rows = [(phase, *self.timers[phase]) for phase in PHASES if phase in self.timers]
+        if 'ai' in self.timers:
+            seconds = self.timers['ai'][1] - sum(self.timers.get(phase, (0, 0.0))[1] for phase in ('movement', 'attack'))
+            rows.insert(rows.index(('ai', *self.timers['ai'])) + 1, ('targeting', self.timers['ai'][0], seconds))
+        return rows
+
+    def print_breakdown(self):
+        total = sum(self.timers.get(phase, (0, 0.0))[1] for phase in ('setup', 'round'))
+        print(f'Profile of {self.battles} battles:')
+        for phase, calls, seconds in self.breakdown():
+            print(f'  {phase}: {seconds:.3f} s ({seconds / max(total, 1e-9):.1%}), {calls} calls, '
+                  f'{seconds / max(calls, 1) * 1e6:.1f} us per call')
+        built = self.counters.get('fields.built', 0)
+        if built or self.counters.get('fields.cache_hits'):
+            print(f'  distance fields: {built} built, {self.counters.get("fields.cache_hits", 0)} cache hits')
+        searches = self.counters.get('astar.searches', 0)
+        if searches:
+            print(f'  astar per search: {self.counters["astar.expanded"] / searches:.1f} nodes expanded, '
+                  f'{self.counters["astar.pushes"] / searches:.1f} heap pushes, '
+                  f'{self.counters["astar.path_length"] / searches:.1f} path length')
+        if self.peak_memory:
+            print(f'  memory per battle: {sum(self.peak_memory) / len(self.peak_memory) / 1024:.1f} KiB mean peak, '
+                  f'{max(self.peak_memory) / 1024:.1f} KiB max peak, '
+                  f'{sum(self.retained_memory) / len(self.retained_memory) / 1024:.1f} KiB mean retained')
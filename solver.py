@@ -0,0 +1,202 @@
+# solver.py
+from functools import lru_cache
+from ai import RandomAttackAI, LowestHealthAI, GreatestThreatAI, DefensiveAI
+from battle import expand_roles
+from combat import damage_distribution, health_distribution, hit_chance
+from fighter import Fighter, armor_list, shield_list
+from weapon import weapon_list
+
+# Exact victory probabilities for melee duels, as an absorbing Markov chain
+# over (health, health) states. Once the duellists are adjacent neither AI
+# moves again, so only the approach decides who swings first. The chain has
+# no clock, so its answer is only exact when the battle's turn limit hardly
+# ever comes into it: a Chernoff bound on the duel's length says how often
+# it could still be going at the limit, and solve gives up unless that is
+# negligible.
+
+BUILTIN_AIS = (RandomAttackAI, LowestHealthAI, GreatestThreatAI, DefensiveAI)
+
+@lru_cache(maxsize=None)
+def distance_distribution(width, height):
+    # grid8 distance between two distinct, uniformly placed fighters
+    cells = [(x, y) for x in range(width) for y in range(height)]
+    counts = {}
+    for x1, y1 in cells:
+        for x2, y2 in cells:
+            if (x1, y1) != (x2, y2):
+                distance = max(abs(x1 - x2), abs(y1 - y2))
+                counts[distance] = counts.get(distance, 0) + 1
+    total = sum(counts.values())
+    return tuple((distance, count / total) for distance, count in sorted(counts.items()))
+
+@lru_cache(maxsize=None)
+def swing_table(hit, damage, max_health):
+    """One swing against a defender at each health up to max_health: P(it kills),
+    and the (damage, P(hit for that damage)) pairs that leave the defender standing
+    at health - damage. Depends only on the attacker, so every opponent shares it."""
+    kills = [0.0] * (max_health + 1)
+    for health in range(1, max_health + 1):
+        kills[health] = hit * sum(p for amount, p in damage if amount >= health)
+    return tuple(kills), tuple((amount, hit * p) for amount, p in damage)
+
+@lru_cache(maxsize=256)
+def duel_tables(hit_a, damage_a, hit_b, damage_b, max_a, max_b):
+    """P(A wins) for every (health_a, health_b): at the start of a round, and
+    when only A's (after_a) or only B's (after_b) swing is left in the round."""
+    miss_a, miss_b = 1 - hit_a, 1 - hit_b
+    stalemate = 1 - miss_a * miss_b
+    kills_a, wounds_a = swing_table(hit_a, damage_a, max_b)
+    kills_b, wounds_b = swing_table(hit_b, damage_b, max_a)
+    zeros = [0.0] * (max_b + 1)
+    start, after_a, after_b = [zeros], [zeros], [zeros]
+
+    # every hit lowers a + b, so smaller states are always solved first: B's
+    # swings lead to earlier rows, taken a whole row at a time, and A's to
+    # earlier cells of the same row
+    for a in range(1, max_a + 1):
+        swings_b, hits_b = zeros, zeros
+        for amount, q in wounds_b:
+            if amount >= a:
+                break
+            swings_b = [x + q * y for x, y in zip(swings_b, start[a - amount])]
+            hits_b = [x + q * y for x, y in zip(hits_b, after_a[a - amount])]
+        row, row_a, row_b = [0.0] * (max_b + 1), [0.0] * (max_b + 1), [0.0] * (max_b + 1)
+        for b in range(1, max_b + 1):
+            swing_a = hits_a = kills_a[b]
+            for amount, q in wounds_a:
+                if amount >= b:
+                    break
+                swing_a += q * row[b - amount]
+                hits_a += q * row_b[b - amount]
+            if stalemate == 0:
+                value = 0.0
+            elif a >= b:  # the healthier fighter swings first, A on ties
+                value = (miss_a * swings_b[b] + hits_a) / stalemate
+            else:
+                value = (miss_b * swing_a + hits_b[b]) / stalemate
+            row[b] = value
+            row_a[b] = miss_a * value + swing_a
+            row_b[b] = miss_b * value + swings_b[b]
+        start.append(row)
+        after_a.append(row_a)
+        after_b.append(row_b)
+    return start, after_a, after_b
+
+@lru_cache(maxsize=256)
+def duel_lengths(hit_a, damage_a, hit_b, damage_b, max_a, max_b, z):
+    """E[z ** R] for every (health_a, health_b), R being the rounds the duel lasts
+    from the start of a round, counting the one it ends in; None if z is too
+    big for the sum to converge."""
+    # laid out like duel_tables, but every ending counts, and a round that goes
+    # by costs a factor of z
+    miss_a, miss_b = 1 - hit_a, 1 - hit_b
+    loop = 1 - z * miss_a * miss_b  # both miss and the round starts over
+    if loop <= 0:
+        return None
+    kills_a, wounds_a = swing_table(hit_a, damage_a, max_b)
+    kills_b, wounds_b = swing_table(hit_b, damage_b, max_a)
+    zeros = [0.0] * (max_b + 1)
+    start, after_a, after_b = [zeros], [zeros], [zeros]
+
+    for a in range(1, max_a + 1):
+        swings_b = hits_b = [kills_b[a]] * (max_b + 1)
+        for amount, q in wounds_b:
+            if amount >= a:
+                break
+            swings_b = [x + q * y for x, y in zip(swings_b, start[a - amount])]
+            hits_b = [x + q * y for x, y in zip(hits_b, after_a[a - amount])]
+        row, row_a, row_b = [0.0] * (max_b + 1), [0.0] * (max_b + 1), [0.0] * (max_b + 1)
+        for b in range(1, max_b + 1):
+            swing_a = hits_a = kills_a[b]
+            for amount, q in wounds_a:
+                if amount >= b:
+                    break
+                swing_a += q * row[b - amount]
+                hits_a += q * row_b[b - amount]
+            if a >= b:
+                value = z * (miss_a * swings_b[b] + hits_a) / loop
+            else:
+                value = z * (miss_b * swing_a + hits_b[b]) / loop
+            row[b] = value
+            row_a[b] = miss_a * value + swing_a
+            row_b[b] = miss_b * value + swings_b[b]
+        start.append(row)
+        after_a.append(row_a)
+        after_b.append(row_b)
+    return start
+
+def loadout(role):
+    armor_class = 10 - armor_list.get(role['armor'], 0) - shield_list.get(role['shield'], 0)
+    return role['level'], role['weapon'], armor_class
+
+def supports(roles):
+    roles = expand_roles(roles)
+    if len(roles) != 2 or roles[0]['faction'] == roles[1]['faction']:
+        return False
+    for role in roles:
+        if role['class'] is not Fighter or type(role['ai']) not in BUILTIN_AIS:
+            return False
+        if role['weapon'] not in weapon_list or weapon_list[role['weapon']][3] != 1:
+            return False
+    return True
+
+@lru_cache(maxsize=None)
+def duel_probability(loadout_a, loadout_b, map_width=10, map_height=10):
+    """P(A wins) for a melee duel on an open grid8 map, A listed first."""
+    level_a, weapon_a, armor_class_a = loadout_a
+    level_b, weapon_b, armor_class_b = loadout_b
+    start, after_a, after_b = duel_tables(
+        hit_chance(0, armor_class_b, level_a), damage_distribution(weapon_a),
+        hit_chance(0, armor_class_a, level_b), damage_distribution(weapon_b),
+        10 * level_a, 10 * level_b)
+
+    # The fighters close one square per move in turn order, so on an odd
+    # starting distance the first in order swings first; on an even one the
+    # second in order gets the first swing as the last action of a round.
+    odd = sum(p for distance, p in distance_distribution(map_width, map_height) if distance % 2)
+    total = 0.0
+    for a, p_a in health_distribution(level_a):
+        for b, p_b in health_distribution(level_b):
+            second_swings = after_b[a][b] if a >= b else after_a[a][b]
+            total += p_a * p_b * (odd * start[a][b] + (1 - odd) * second_swings)
+    return total
+
+@lru_cache(maxsize=None)
+def draw_bound(loadout_a, loadout_b, map_width=10, map_height=10, turn_limit=100):
+    """An upper bound on P(the duel is still going after turn_limit rounds)."""
+    level_a, weapon_a, armor_class_a = loadout_a
+    level_b, weapon_b, armor_class_b = loadout_b
+    hit_a, hit_b = hit_chance(0, armor_class_b, level_a), hit_chance(0, armor_class_a, level_b)
+    # the approach takes at most half the distance in rounds, and the fight
+    # lasts past the rest with P(R > rounds) <= E[z ** R] / z ** (rounds + 1)
+    rounds = turn_limit - max(distance for distance, p in distance_distribution(map_width, map_height)) // 2
+    stalemate = (1 - hit_a) * (1 - hit_b)
+    best = 1.0
+    for share in (0.5, 0.25, 0.75):  # of the way from 1 to where E[z ** R] blows up
+        z = min(1 + share * (1 / stalemate - 1), 1.5) if stalemate else 1.5
+        table = duel_lengths(hit_a, damage_distribution(weapon_a), hit_b, damage_distribution(weapon_b),
+                             10 * level_a, 10 * level_b, z)
+        moment = sum(p_a * p_b * table[a][b] for a, p_a in health_distribution(level_a)
+                     for b, p_b in health_distribution(level_b))
+        best = min(best, moment / z ** (rounds + 1))
+        if best < 1e-6:
+            break
+    return best
+
+def solve(roles, map_width=10, map_height=10, turn_limit=100, tolerance=1e-3):
+    """Exact victory probabilities by faction, or None if unsupported or if
+    more than tolerance of the battles might end in a draw at turn_limit.
+
+    A new pair of loadouts costs a table of 100 * level_a * level_b states for
+    the odds, and one to three more for the draw bound, at about 1.5 us a state
+    each: some 10 ms for two level 5 fighters and 40 ms for two level 10 ones.
+    Repeated pairs are cached and cost next to nothing."""
+    if not supports(roles):
+        return None
+    first, second = expand_roles(roles)
+    if hit_chance(0, loadout(second)[2], first['level']) == hit_chance(0, loadout(first)[2], second['level']) == 0:
+        return {first['faction']: 0.0, second['faction']: 0.0}  # nobody can ever land a blow
+    if draw_bound(loadout(first), loadout(second), map_width, map_height, turn_limit) > tolerance:
+        return None
+    p = duel_probability(loadout(first), loadout(second), map_width, map_height)
+    return {first['faction']: p, second['faction']: 1 - p}
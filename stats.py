@@ -0,0 +1,84 @@
+# stats.py
+from math import exp, lgamma, log, sqrt
+from statistics import NormalDist
+
+# Binomial confidence intervals for win probabilities
+
+def z_score(confidence):
+    return NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+
+def wilson_interval(wins, n, confidence=0.95):
+    if n == 0:
+        return 0.0, 1.0
+    z = z_score(confidence)
+    p = wins / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z * sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+def clopper_pearson_interval(wins, n, confidence=0.95):
+    if n == 0:
+        return 0.0, 1.0
+    alpha = 1 - confidence
+    lower = 0.0 if wins == 0 else beta_ppf(alpha / 2, wins, n - wins + 1)
+    upper = 1.0 if wins == n else beta_ppf(1 - alpha / 2, wins + 1, n - wins)
+    return lower, upper
+
+INTERVALS = {
+    'wilson': wilson_interval,
+    'clopper-pearson': clopper_pearson_interval,
+}
+
+def interval(wins, n, confidence=0.95, method='wilson'):
+    return INTERVALS[method](wins, n, confidence)
+
+#############################################################################
+# Beta distribution helpers (no scipy here)
+
+def _beta_continued_fraction(a, b, x):
+    # Lentz's method, as in Numerical Recipes' betacf
+    tiny = 1e-300
+    qab, qap, qam = a + b, a + 1, a - 1
+    c = 1.0
+    d = 1 - qab * x / qap
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 + aa * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 + aa * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-12:
+            break
+    return h
+
+def beta_cdf(x, a, b):
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a * log(x) + b * log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _beta_continued_fraction(a, b, x) / a
+    return 1 - front * _beta_continued_fraction(b, a, 1 - x) / b
+
+def beta_ppf(q, a, b):
+    low, high = 0.0, 1.0
+    for _ in range(60):
+        mid = (low + high) / 2
+        if beta_cdf(mid, a, b) < q:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
@@ -0,0 +1,169 @@
+# sweep.py
+import csv
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from arena import Arena, BLOCK_SIZES
+
+# Matchup sweeps: one Arena per cell of a grid over role fields, such as
+# every weapon x armor x level for one role against a fixed enemy team.
+# Grid keys are 'Role name.field' with the fields of a role dict. Each
+# cell is seeded from the sweep's seed and its index alone, so a cell's
+# result never depends on the worker count or on which cells ran before,
+# and a partly written sweep can be resumed.
+#
+# No setup is shared between cells: each one compiles its roles and builds
+# its own Arena, Battle and Map, some 50 us against about 0.3 ms per battle
+# fought. What carries over is the process pool and, in each worker, the
+# memoized combat tables such as damage distributions and hit chances.
+
+def run_cell(roles, iterations, seed, options):
+    arena = Arena(roles, iterations, seed=seed, **options)
+    arena.simulate_battle()
+    return arena.iterations_run, arena.wins
+
+class Sweep:
+    def __init__(self, roles, grid, iterations=1000, seed=None, workers=1, engine='python',
+                 precision=None, confidence=0.95, interval='wilson'):
+        if engine not in BLOCK_SIZES:
+            raise ValueError(f'Unknown engine: {engine}')
+        self.roles = roles
+        self.iterations = iterations
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.seeded = seed is not None  # a drawn seed gives way to the one in a file being resumed
+        self.workers = workers
+        self.options = {'engine': engine, 'precision': precision, 'confidence': confidence, 'interval': interval}
+        self.keys = list(grid)
+        self.values = [list(values) for values in grid.values()]
+        names = [role['name'] for role in roles]
+        self.axes = []  # (role index, field) per grid key
+        for key in self.keys:
+            name, _, field = key.rpartition('.')
+            if name not in names or field not in roles[names.index(name)] and field != 'count':
+                raise ValueError(f'No role field {key!r} to sweep')
+            self.axes.append((names.index(name), field))
+        self.factions = sorted({role['faction'] for role in roles})
+        self.columns = (['cell'] + self.keys + ['seed', 'iterations', 'draws'] +
+                        [f'wins_{faction}' for faction in self.factions] +
+                        [f'rate_{faction}' for faction in self.factions])
+
+    def __len__(self):
+        count = 1
+        for values in self.values:
+            count *= len(values)
+        return count
+
+    def cells(self):
+        """(index, values) for each cell, the last key varying fastest."""
+        return enumerate(product(*self.values))
+
+    def cell_values(self, index):
+        values = []
+        for choices in reversed(self.values):
+            index, i = divmod(index, len(choices))
+            values.append(choices[i])
+        return tuple(reversed(values))
+
+    def cell_roles(self, values):
+        roles = [dict(role) for role in self.roles]
+        for (index, field), value in zip(self.axes, values):
+            roles[index][field] = value
+        return roles
+
+    def cell_seed(self, index):
+        return f'{self.seed}/cell-{index}'
+
+    def check_row(self, row, path):
+        # a row to resume from has to be the one this sweep would write for its cell
+        cell = int(row[0])
+        if not 0 <= cell < len(self):
+            raise ValueError(f'{path}: cell {cell} is not in this sweep')
+        values = self.cell_values(cell)
+        seed, iterations = row[1 + len(self.keys)], int(row[2 + len(self.keys)])
+        if (row[1:1 + len(self.keys)] != ['' if value is None else str(value) for value in values] or
+                seed != self.cell_seed(cell) or
+                iterations > self.iterations or (self.options['precision'] is None and iterations != self.iterations)):
+            raise ValueError(f'{path}: cell {cell} was run with other values, seed or iterations')
+
+    def run(self, path, resume=True):
+        """Run the cells not yet in the CSV at path, appending a row as each one finishes."""
+        done = set()
+        if resume and os.path.exists(path) and os.path.getsize(path):
+            with open(path, newline='') as file:
+                reader = csv.reader(file)
+                if next(reader) != self.columns:
+                    raise ValueError(f'{path} is from a different sweep')
+                rows = [row for row in reader if row]
+            if rows and not self.seeded:
+                self.seed = rows[0][1 + len(self.keys)].rpartition('/cell-')[0]
+            for row in rows:
+                self.check_row(row, path)
+            done = {int(row[0]) for row in rows}
+        else:
+            with open(path, 'w', newline='') as file:
+                csv.writer(file).writerow(self.columns)
+
+        jobs = ((index, values) for index, values in self.cells() if index not in done)
+        ran = 0
+        with open(path, 'a', newline='') as file:
+            writer = csv.writer(file)
+            for index, values, (iterations, wins) in self.run_cells(jobs):
+                draws = iterations - sum(wins.values())
+                writer.writerow([index, *values, self.cell_seed(index), iterations, draws] +
+                                [wins.get(faction, 0) for faction in self.factions] +
+                                [wins.get(faction, 0) / max(iterations, 1) for faction in self.factions])
+                file.flush()  # a finished cell survives an interrupted sweep
+                ran += 1
+        return ran
+
+    def run_cells(self, jobs):
+        if self.workers <= 1:
+            for index, values in jobs:
+                yield index, values, run_cell(self.cell_roles(values), self.iterations, self.cell_seed(index), self.options)
+            return
+
+        # one pool for the whole sweep, with a bounded window of cells in flight
+        with ProcessPoolExecutor(self.workers) as pool:
+            pending = deque()
+            try:
+                while True:
+                    while len(pending) < 2 * self.workers:
+                        job = next(jobs, None)
+                        if job is None:
+                            break
+                        index, values = job
+                        future = pool.submit(run_cell, self.cell_roles(values), self.iterations, self.cell_seed(index),
+                                             self.options)
+                        pending.append((index, values, future))
+                    if not pending:
+                        break
+                    index, values, future = pending.popleft()
+                    yield index, values, future.result()
+            finally:
+                for index, values, future in pending:
+                    future.cancel()
+
+def read_results(path):
+    """The sweep's CSV as columns, in cell order; counts as ints and rates as floats."""
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = sorted((row for row in reader if row), key=lambda row: int(row[0]))
+    columns = {}
+    for i, name in enumerate(header):
+        column = [row[i] for row in rows]
+        if name in ('cell', 'iterations', 'draws') or name.startswith('wins_'):
+            column = [int(value) for value in column]
+        elif name.startswith('rate_'):
+            column = [float(value) for value in column]
+        columns[name] = column
+    return columns
+
+def save_npz(path, npz_path=None):
+    """Write the sweep's CSV as a compressed NumPy archive, one array per column."""
+    import numpy as np  # numpy is optional
+    npz_path = npz_path or os.path.splitext(path)[0] + '.npz'
+    np.savez_compressed(npz_path, **{name: np.array(column) for name, column in read_results(path).items()})
+    return npz_path
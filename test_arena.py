@@ -1,7 +1,10 @@
 # test_arena.py
 import unittest
+import random
 from arena import Arena
-from ai import GreatestThreatAI, LowestHealthAI, DefensiveAI, RandomAttackAI
+from ai import GreatestThreatAI, LowestHealthAI, DefensiveAI
+from battle import Battle
+from buff import BuffCreator
 from fighter import Fighter
 
 test_roles = [
@@ -25,5 +28,72 @@ class TestArena(unittest.TestCase):
             self.assertTrue(any(f'Blue: ' in message for message in log.output))
             self.assertTrue(any(f'Red: ' in message for message in log.output))
 
+duel_roles = [
+            {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI()},
+            {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': LowestHealthAI()},
+]
+
+class TestParallelArena(unittest.TestCase):
+    def test_seeded_runs_are_reproducible(self):
+        first = Arena(duel_roles, iterations=150, seed=42)
+        first.simulate_battle()
+        second = Arena(duel_roles, iterations=150, seed=42)
+        second.simulate_battle()
+        self.assertEqual(first.wins, second.wins)
+        self.assertEqual(sum(first.wins.values()), 150)
+
+    def test_workers_match_single_process(self):
+        serial = Arena(duel_roles, iterations=250, seed=7)
+        serial.simulate_battle()
+        parallel = Arena(duel_roles, iterations=250, seed=7, workers=2)
+        parallel.simulate_battle()
+        self.assertEqual(serial.wins, parallel.wins)
+
+class TestEarlyStopping(unittest.TestCase):
+    def test_stops_when_intervals_are_tight(self):
+        arena = Arena(duel_roles, iterations=5000, seed=3, precision=0.05)
+        arena.simulate_battle()
+        self.assertLess(arena.iterations_run, arena.iterations)
+        self.assertEqual(sum(arena.wins.values()), arena.iterations_run)
+        for low, high in arena.confidence_intervals().values():
+            self.assertLessEqual((high - low) / 2, 0.05)
+
+    def test_respects_iteration_cap(self):
+        arena = Arena(duel_roles, iterations=200, seed=3, precision=0.001, interval='clopper-pearson')
+        arena.simulate_battle()
+        self.assertEqual(arena.iterations_run, 200)
+
+    def test_early_stopping_is_reproducible_across_workers(self):
+        serial = Arena(duel_roles, iterations=2000, seed=11, precision=0.06)
+        serial.simulate_battle()
+        parallel = Arena(duel_roles, iterations=2000, seed=11, precision=0.06, workers=2)
+        parallel.simulate_battle()
+        self.assertEqual(serial.iterations_run, parallel.iterations_run)
+        self.assertEqual(serial.wins, parallel.wins)
+
+class TestSnapshotArena(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+        self.battle = Battle('What If', duel_roles + [dict(test_roles[2], ai=DefensiveAI())])
+        self.battle.play_round()
+
+    def test_continuations(self):
+        snapshot = self.battle.snapshot()
+        first = Arena.from_snapshot(snapshot, iterations=150, seed=8)
+        first.simulate_battle()
+        second = Arena.from_snapshot(snapshot, iterations=150, seed=8)
+        second.simulate_battle()
+        self.assertEqual(first.wins, second.wins)
+        self.assertEqual(first.iterations_run, 150)
+        self.assertEqual(first.factions, {'Red', 'Blue'})
+
+    def test_what_if(self):
+        alice = next(f for f in self.battle.fighters if f.name == 'Alice')
+        alice.apply_buff(BuffCreator.create_shield_wall())
+        arena = Arena.from_snapshot(self.battle.snapshot(), iterations=50, seed=8)
+        self.assertEqual(arena.exact_probabilities().keys(), {'Red', 'Blue'})
+        with self.assertRaises(ValueError):
+            Arena.from_snapshot(self.battle.snapshot(), engine='numpy')
+
 if __name__ == '__main__':
     unittest.main()
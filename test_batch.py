@@ -0,0 +1,58 @@
+# test_batch.py
+import unittest
+from ai import GreatestThreatAI, LowestHealthAI, DefensiveAI, RandomAttackAI
+from arena import Arena
+from fighter import Fighter
+
+try:
+    import numpy as np
+    from batch import BatchBattle, make_rng, simulate_batch
+except ImportError:
+    np = None
+
+test_roles = [
+            {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI()},
+            {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': LowestHealthAI()},
+            {'name': 'Alice', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'trident', 'armor': 'ring mail', 'shield': 'small shield', 'ai': DefensiveAI()},
+            {'name': 'Rae', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'bow', 'armor': 'ring mail', 'shield': None, 'ai': RandomAttackAI()},
+]
+
+@unittest.skipUnless(np, 'numpy is not installed')
+class TestBatchBattle(unittest.TestCase):
+    def setUp(self):
+        self.battle = BatchBattle(test_roles, 500, make_rng(1))
+
+    def test_initial_state(self):
+        self.assertEqual(self.battle.health.shape, (500, 4))
+        self.assertTrue((self.battle.health >= self.battle.level).all())
+        self.assertTrue((self.battle.health <= self.battle.level * 10).all())
+        self.assertEqual(list(self.battle.armor_class[0]), [5, 8, 6, 7])
+        cells = self.battle.x * self.battle.height + self.battle.y
+        self.assertTrue(all(len(set(row)) == 4 for row in cells))
+
+    def test_fight(self):
+        winners = self.battle.fight()
+        self.assertTrue(((winners >= 0) | (self.battle.turn == self.battle.turn_limit)).all())
+        for row in np.flatnonzero(winners >= 0):
+            survivors = self.battle.faction[self.battle.alive[row]]
+            self.assertTrue((survivors == winners[row]).all())
+        self.assertTrue((self.battle.attack_bonus >= 0).all())
+
+    def test_seeded_batches_are_reproducible(self):
+        self.assertEqual(simulate_batch(test_roles, 300, 'seed'), simulate_batch(test_roles, 300, 'seed'))
+
+    def test_rejects_unsupported_roles(self):
+        roles = [dict(test_roles[0], ai=GreatestThreatAI), test_roles[1]]
+        with self.assertRaises(ValueError):
+            BatchBattle(roles, 10, make_rng(1))
+
+    def test_matches_python_engine(self):
+        duel = test_roles[:2]
+        python = Arena(duel, iterations=400, seed=5)
+        python.simulate_battle()
+        lockstep = Arena(duel, iterations=20000, seed=5, engine='numpy')
+        lockstep.simulate_battle()
+        self.assertAlmostEqual(python.wins['Red'] / 400, lockstep.wins['Red'] / 20000, delta=0.06)
+
+if __name__ == '__main__':
+    unittest.main()
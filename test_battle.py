@@ -1,8 +1,14 @@
 # test_battle.py
+import pickle
+import random
 import unittest
-from battle import Battle
+from logging import DEBUG, INFO
+from battle import Battle, SILENT, compile_roles
 from ai import GreatestThreatAI, LowestHealthAI, DefensiveAI, RandomAttackAI
+from buff import BuffCreator
+from dice import Dice
 from fighter import Fighter
+from map import Terrain
 
 test_roles = [
             {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI},
@@ -51,5 +57,225 @@ class TestBattle(unittest.TestCase):
         self.assertIsNone(self.battle.map.get_position(old_position.x, old_position.y).fighter)
         self.assertEqual(self.battle.map.get_position(new_position.x, new_position.y).fighter, fighter)
 
+class TestBattleLogging(unittest.TestCase):
+    roles = [
+        {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI()},
+        {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': LowestHealthAI()},
+    ]
+
+    def test_silent_battle_keeps_nothing(self):
+        battle = Battle('Silent Battle', self.roles)
+        self.assertEqual(battle.log_level, SILENT)
+        battle.fight_battle()
+        self.assertEqual(len(battle.logs), 0)
+
+    def test_log_levels(self):
+        battle = Battle('Quiet Battle', self.roles, log_level=INFO)
+        battle.log('%s hits %s', 'Glenda', 'Hiro')
+        battle.log('%s moves', 'Glenda', level=DEBUG)
+        self.assertEqual(list(battle.logs), ['Glenda hits Hiro'])
+        self.assertTrue(battle.is_logging(INFO))
+        self.assertFalse(battle.is_logging(DEBUG))
+
+    def test_lazy_formatting(self):
+        class Exploding:
+            def __str__(self):
+                raise AssertionError('formatted a message nobody keeps')
+        battle = Battle('Silent Battle', self.roles)
+        battle.log('%s', Exploding())
+        battle.log('%s', Exploding(), level=DEBUG)
+
+    def test_log_limit(self):
+        battle = Battle('Short Memory', self.roles, log_level=DEBUG, log_limit=3)
+        battle.fight_battle()
+        self.assertEqual(len(battle.logs), 3)
+        self.assertIn('Short Memory', battle.logs[-1])
+
+class TestRangedTargets(unittest.TestCase):
+    roles = [
+        {'name': 'Rae', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'bow', 'armor': 'ring mail', 'shield': None, 'ai': LowestHealthAI()},
+        {'name': 'Xi', 'faction': 'Red', 'level': 3, 'class': Fighter, 'weapon': 'axe', 'armor': 'chain mail', 'shield': None, 'ai': RandomAttackAI()},
+        {'name': 'Glenda', 'faction': 'Red', 'level': 1, 'class': Fighter, 'weapon': 'long sword', 'armor': None, 'shield': None, 'ai': RandomAttackAI()},
+    ]
+
+    def test_archer_shoots_enemy_in_range(self):
+        battle = Battle('Archery', self.roles, log_level=DEBUG)
+        archer, near, weak = battle.fighters
+        battle.map.clear_occupants()
+        for fighter, (x, y) in zip(battle.fighters, [(0, 0), (4, 3), (9, 9)]):
+            battle.map.occupy_position(fighter, battle.map.get_position(x, y))
+        weak.health = 1
+        battle.logs.clear()
+        archer.take_turn()
+        self.assertEqual((archer.position.x, archer.position.y), (0, 0))
+        self.assertTrue(any('Xi' in message for message in battle.logs))
+        self.assertFalse(any('Glenda' in message for message in battle.logs))
+
+class TestRosters(unittest.TestCase):
+    roles = [
+        {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI()},
+        {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': LowestHealthAI()},
+        {'name': 'Alice', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'trident', 'armor': 'ring mail', 'shield': 'small shield', 'ai': DefensiveAI()},
+        {'name': 'Rae', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'bow', 'armor': 'ring mail', 'shield': None, 'ai': RandomAttackAI()},
+    ]
+
+    def setUp(self):
+        self.battle = Battle('Roster Battle', self.roles)
+        self.glenda, self.hiro, self.alice, self.rae = self.battle.fighters
+
+    def test_rosters_and_opponents(self):
+        self.assertEqual(self.battle.rosters['Blue'], [self.hiro, self.alice, self.rae])
+        self.assertEqual(self.battle.opponents('Red'), [self.hiro, self.alice, self.rae])
+        self.hiro.die()
+        self.assertEqual(sorted(f.name for f in self.battle.rosters['Blue']), ['Alice', 'Rae'])
+        self.assertEqual(self.battle.opponents('Red'), [self.alice, self.rae])
+        self.assertEqual(self.battle.fighters, [self.glenda, self.alice, self.rae])
+
+    def test_last_teammate_goes_berserk(self):
+        self.alice.die()
+        self.assertFalse(any(buff.name == 'Berserk Rage' for buff in self.rae.buffs))
+        self.hiro.die()
+        self.assertTrue(any(buff.name == 'Berserk Rage' for buff in self.rae.buffs))
+
+    def test_victory(self):
+        for fighter in (self.hiro, self.alice, self.rae):
+            fighter.die()
+        self.assertEqual(list(self.battle.rosters), ['Red'])
+        self.battle.play_round()
+        self.assertEqual(self.battle.winner, 'Red')
+
+class TestBattleReset(unittest.TestCase):
+    roles = TestRosters.roles
+
+    def snapshot(self, battle):
+        return [(f.name, f.max_health, f.health, f.position.x, f.position.y) for f in battle.fighters]
+
+    def test_reset_matches_new_battle(self):
+        battle = Battle('Reused Battle', self.roles)
+        battle.fight_battle()
+        random.seed(7)
+        battle.reset('Second Battle')
+        random.seed(7)
+        fresh = Battle('Second Battle', self.roles)
+        self.assertEqual(self.snapshot(battle), self.snapshot(fresh))
+        self.assertEqual((battle.title, battle.turn, battle.winner), ('Second Battle', 0, None))
+        self.assertEqual(len(battle.map.occupants), 4)
+        self.assertTrue(all(f.battle is battle and not f.buffs for f in battle.fighters))
+
+    def test_compile_roles(self):
+        prototypes = compile_roles(self.roles + [dict(self.roles[0], name='Guard', count=2)])
+        self.assertEqual(len(prototypes), 6)
+        self.assertEqual(prototypes[-1].name, 'Guard 2')
+        self.assertIs(compile_roles(prototypes), prototypes)
+        self.assertEqual(Battle('Compiled Battle', prototypes).fighters[-1].name, 'Guard 2')
+
+class TestSnapshot(unittest.TestCase):
+    roles = TestRosters.roles
+
+    def state(self, battle):
+        return ([(f.name, f.health, f.position.x, f.position.y, f.armor_class, f.turns_taken, sorted(f.active_buffs))
+                 for f in battle.fighters],
+                {faction: [f.name for f in roster] for faction, roster in battle.rosters.items()},
+                sorted((f.name, turn, [buff.name for buff in buffs]) for (f, turn), buffs in battle.timers.items()),
+                battle.turn, battle.winner)
+
+    def setUp(self):
+        random.seed(11)
+        self.battle = Battle('Snapshot Battle', self.roles)
+        self.battle.map.fill_terrain(Terrain.FOREST, 0, 0, 3, 3)
+        for _ in range(2):
+            self.battle.play_round()
+        alice = next(f for f in self.battle.fighters if f.name == 'Alice')
+        alice.apply_buff(BuffCreator.create_shield_wall())
+
+    def test_restore(self):
+        snapshot = self.battle.snapshot()
+        before = self.state(self.battle)
+        self.battle.fight_battle()
+        self.battle.restore(snapshot)
+        self.assertEqual(self.state(self.battle), before)
+        self.assertEqual(self.battle.map.terrain, bytearray(snapshot.terrain))
+
+    def test_fork_is_independent(self):
+        before = self.state(self.battle)
+        fork = self.battle.fork('Fork')
+        self.assertEqual(self.state(fork), before)
+        self.assertTrue(all(f.battle is fork for f in fork.fighters))
+        self.assertFalse(set(fork.fighters) & set(self.battle.fighters))
+        self.assertEqual(fork.map.terrain, self.battle.map.terrain)
+        fork.fight_battle()
+        self.assertEqual(self.state(self.battle), before)
+
+    def test_continuations_repeat(self):
+        snapshot = pickle.loads(pickle.dumps(self.battle.snapshot()))
+        fork = Battle.from_snapshot(snapshot)
+        outcomes = []
+        for _ in range(2):
+            random.seed(5)
+            fork.dice = Dice()
+            fork.restore(snapshot)
+            outcomes.append((fork.fight_battle(), fork.turn, [f.health for f in fork.fighters]))
+        self.assertEqual(outcomes[0], outcomes[1])
+
+class TestMovement(unittest.TestCase):
+    roles = TestRosters.roles
+
+    def place(self, battle, cells):
+        battle.map.clear_occupants()
+        for fighter, (x, y) in zip(battle.fighters, cells):
+            battle.map.occupy_position(fighter, battle.map.get_position(x, y))
+
+    def test_fighter_walks_towards_its_target(self):
+        battle = Battle('Chase', [dict(self.roles[0], ai=LowestHealthAI())] + self.roles[1:3])
+        self.place(battle, [(0, 0), (3, 0), (0, 6)])
+        glenda, hiro, alice = battle.fighters
+        alice.health = 1  # the target, though Hiro is closer
+        glenda.take_turn()
+        self.assertEqual((glenda.position.x, glenda.position.y), (0, 1))
+
+    def test_blocked_fighter_holds_its_ground(self):
+        roles = [dict(self.roles[2], name=name, faction='Red') for name in ('Glenda', 'Ann', 'Bo', 'Cy')] + self.roles[1:2]
+        battle = Battle('Crowded', roles)
+        self.place(battle, [(0, 0), (1, 0), (0, 1), (1, 1), (9, 9)])
+        glenda = battle.fighters[0]
+        glenda.take_turn()
+        self.assertEqual((glenda.position.x, glenda.position.y), (0, 0))
+        self.assertEqual(battle.map.path_cache_misses, 1)  # only Glenda's field to Hiro
+
+    def test_path_cache_hits_in_battle(self):
+        random.seed(3)
+        battle = Battle('Cached', self.roles)
+        battle.fight_battle()
+        # the Blue fighters chase Glenda, and whoever's target stays put reuses its field
+        self.assertGreater(battle.map.path_cache_hits, battle.map.path_cache_misses)
+
+class TestMassBattle(unittest.TestCase):
+    roles = [
+        {'name': 'Pikeman', 'faction': 'Red', 'level': 1, 'class': Fighter, 'weapon': 'spear', 'armor': None, 'shield': None, 'ai': RandomAttackAI(), 'count': 300},
+        {'name': 'Archer', 'faction': 'Blue', 'level': 1, 'class': Fighter, 'weapon': 'bow', 'armor': None, 'shield': None, 'ai': RandomAttackAI(), 'count': 200},
+    ]
+
+    def test_role_counts(self):
+        battle = Battle('Mass Battle', self.roles, map_width=30, map_height=30)
+        self.assertEqual(len(battle.fighters), 500)
+        self.assertEqual(battle.fighters[0].name, 'Pikeman 1')
+        self.assertEqual(battle.fighters[-1].name, 'Archer 200')
+        self.assertEqual(len({(f.position.x, f.position.y) for f in battle.fighters}), 500)
+
+    def test_zones(self):
+        battle = Battle('Mass Battle', self.roles, map_width=30, map_height=30,
+                        zones={'Red': (0, 0, 10, 30), 'Blue': (20, 0, 10, 30)})
+        for fighter in battle.fighters:
+            self.assertEqual(fighter.position.x < 10, fighter.faction == 'Red')
+            self.assertEqual(fighter.position.x >= 20, fighter.faction == 'Blue')
+
+    def test_full_map(self):
+        battle = Battle('Packed Battle', self.roles, map_width=25, map_height=20)
+        self.assertTrue(all(position.fighter for row in battle.map.grid for position in row))
+        with self.assertRaises(ValueError):
+            Battle('Overfull Battle', self.roles, map_width=20, map_height=20)
+        with self.assertRaises(ValueError):
+            Battle('Crowded Zone', self.roles, map_width=30, map_height=30, zones={'Red': (0, 0, 10, 10)})
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,46 @@
+# test_benchmark.py
+import os
+import random
+import tempfile
+import unittest
+from ai import DefensiveAI, MCTSAI
+from benchmark import (AI_CLASSES, ai_decision_latency, astar_time, layout_map, play_round_time, regressions,
+                       save_baseline, load_baseline)
+from map import Terrain
+
+class TestBenchmark(unittest.TestCase):
+    def test_layouts(self):
+        walls = layout_map(16, 'walls')
+        column = [walls.get_position(4, y).terrain for y in range(16)]
+        self.assertEqual(column.count(Terrain.PLAIN), 1)  # the gap
+        self.assertTrue(walls.astar(walls.get_position(0, 0), walls.get_position(15, 15)))
+        self.assertEqual(layout_map(16, 'rough', seed=1).terrain, layout_map(16, 'rough', seed=1).terrain)
+        with self.assertRaises(ValueError):
+            layout_map(16, 'swamp')
+
+    def test_timings(self):
+        self.assertGreater(astar_time(16, 'rough', searches=5), 0)
+        self.assertGreater(play_round_time(fighters=3, rounds=5), 0)
+
+    def test_decisions(self):
+        self.assertIn(MCTSAI, AI_CLASSES)
+        random.seed(7)
+        state = random.getstate()
+        for ai_class in (DefensiveAI, MCTSAI):
+            self.assertGreater(ai_decision_latency(ai_class, fighters=3, decisions=5), 0)
+        self.assertEqual(random.getstate(), state)  # the caller's RNG is left alone
+
+    def test_regressions(self):
+        baseline = {'astar/16/plain': 1.0, 'play_round': 2.0}
+        results = {'astar/16/plain': 1.05, 'play_round': 2.5, 'arena/battle': 9.0}
+        self.assertEqual(regressions(results, baseline), [('play_round', 2.0, 2.5)])
+        self.assertEqual(regressions(results, baseline, threshold=0.3), [])
+
+    def test_baseline_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            save_baseline({'play_round': 0.002}, path)
+            self.assertEqual(load_baseline(path), {'play_round': 0.002})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -106,5 +106,50 @@ class TestBuff(unittest.TestCase):
             test_fighter.take_turn()
         self.assertEqual(buff.remaining_cooldown, 0, "Buff cooldown did not decrease correctly")
 
+class TestBuffEngine(unittest.TestCase):
+    def setUp(self):
+        roles = [
+            {'name': 'Alice', 'faction': 'Order', 'level': 5, 'class': Fighter, 'ai': RandomAttackAI(), 'weapon': 'long sword', 'armor': 'chain mail', 'shield': 'small shield'},
+            {'name': 'Bob', 'faction': 'Chaos', 'level': 4, 'class': Fighter, 'ai': DefensiveAI(), 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None},
+        ]
+        self.battle = Battle('Buff Engine Battle', roles)
+        self.alice, self.bob = self.battle.fighters
+        self.battle.map.clear_occupants()  # far apart, so turns pass without fighting
+        self.battle.map.occupy_position(self.alice, self.battle.map.get_position(0, 0))
+        self.battle.map.occupy_position(self.bob, self.battle.map.get_position(9, 9))
+
+    def test_specs_are_shared(self):
+        self.assertIs(BuffCreator.create_shield_wall().spec, BuffCreator.create_shield_wall().spec)
+
+    def test_stats_aggregate_modifiers(self):
+        base = self.alice.armor_class
+        self.alice.apply_buff(BuffCreator.create_shield_wall())
+        self.alice.apply_buff(BuffCreator.create_defensive_stance())
+        self.assertEqual(self.alice.armor_class, base - 10)
+        self.alice.armor_class += 1  # moves the base, not the buffs
+        self.assertEqual(self.alice.base_armor_class, base + 1)
+        self.alice.take_turn()
+        self.assertEqual(self.alice.armor_class, base - 5)
+        self.alice.take_turn()
+        self.assertEqual(self.alice.armor_class, base + 1)
+
+    def test_only_due_buffs_are_scheduled(self):
+        buff = BuffCreator.create_shield_wall()
+        self.alice.apply_buff(buff)
+        self.assertEqual(sorted(turn for fighter, turn in self.battle.timers), [2, 7])
+        for turn in range(7):
+            self.assertIn(buff.name, [b.name for b in self.alice.buffs])
+            self.alice.take_turn()
+        self.assertEqual(self.alice.buffs, [])
+        self.assertEqual(self.battle.timers, {})
+
+    def test_shield_wall_waits_for_cooldown(self):
+        self.alice.take_defensive_action()
+        for _ in range(3):
+            self.alice.take_turn()
+        self.alice.take_defensive_action()
+        self.assertEqual(self.alice.buffs[0].remaining_cooldown, 4)
+        self.assertEqual(self.alice.armor_class, self.alice.base_armor_class)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,98 @@
+# test_combat.py
+import unittest
+import combat
+from ai import GreatestThreatAI, ExpectedSurvivalAI, RandomAttackAI
+from arena import Arena
+from battle import Battle
+from fighter import Fighter
+from map import Terrain
+from weapon import weapon_list
+
+class TestCombat(unittest.TestCase):
+    def test_damage_distribution(self):
+        self.assertEqual(combat.damage_distribution('dagger', 2), tuple((d, 1 / 4) for d in range(3, 7)))
+        self.assertAlmostEqual(sum(d * p for d, p in combat.damage_distribution('morning star', 1)),
+                               combat.average_damage('morning star', 1))
+
+    def test_hit_chance(self):
+        self.assertEqual(combat.hit_chance(0, 5, 6), 0.5)
+        self.assertEqual(combat.hit_chance(5, 5, 6), 0.75)
+        self.assertEqual(combat.hit_chance(0, -20, 1), 0.0)
+
+    def test_expected_damage_per_turn(self):
+        self.assertEqual(combat.expected_damage_per_turn('long sword', 0, 0, 5, 6), 0.5 * 4.5)
+
+    def test_turns_to_kill(self):
+        self.assertEqual(combat.turns_to_kill(1, 'dagger', 0, 0, 10, 15), ((1, 1.0),))
+        geometric = dict(combat.turns_to_kill(1, 'dagger', 0, 0, 5, 6))
+        self.assertAlmostEqual(geometric[3], 0.125)
+        distribution = combat.turns_to_kill(30, 'two-handed sword', 0, 0, 5, 3)
+        self.assertAlmostEqual(sum(p for turns, p in distribution), 1.0)
+        self.assertEqual(combat.turns_to_kill(10, 'dagger', 0, 0, -20, 1), ())
+        self.assertEqual(combat.expected_turns_to_kill(10, 'dagger', 0, 0, -20, 1), float('inf'))
+
+    def test_turns_to_kill_is_memoized(self):
+        self.assertIs(combat.turns_to_kill(12, 'axe'), combat.turns_to_kill(12, 'axe'))
+
+    def test_threat_matches_weapon_average(self):
+        ai = GreatestThreatAI()
+        for weapon, (dice, sides, addend, range) in weapon_list.items():
+            if weapon is None:
+                continue
+            fighter = Fighter('Target', 1, ai, 'Red', weapon)
+            fighter.damage_bonus = 2
+            self.assertEqual(ai.calculate_threat(fighter), dice * (1 + sides) / 2 + addend + 2)
+
+    def test_fighter_damage_per_turn(self):
+        attacker = Fighter('Attacker', 6, GreatestThreatAI(), 'Red', 'long sword')
+        defender = Fighter('Defender', 1, GreatestThreatAI(), 'Blue', 'dagger', 'chain mail')
+        self.assertEqual(combat.fighter_damage_per_turn(attacker, defender), 0.5 * 4.5)
+
+class TestExpectedSurvivalAI(unittest.TestCase):
+    roles = [
+        {'name': 'Hero', 'faction': 'Red', 'level': 4, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': ExpectedSurvivalAI()},
+        {'name': 'Brute', 'faction': 'Blue', 'level': 6, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': None, 'shield': None, 'ai': RandomAttackAI()},
+        {'name': 'Archer', 'faction': 'Blue', 'level': 2, 'class': Fighter, 'weapon': 'sling', 'armor': None, 'shield': None, 'ai': RandomAttackAI()},
+    ]
+
+    def setUp(self):
+        self.battle = Battle('Survival Battle', self.roles)
+        self.hero, self.brute, self.archer = self.battle.fighters
+        self.battle.map.clear_occupants()
+        for fighter, (x, y) in zip(self.battle.fighters, [(0, 0), (9, 9), (3, 0)]):
+            self.battle.map.occupy_position(fighter, self.battle.map.get_position(x, y))
+
+    def test_expected_survival(self):
+        ai = self.hero.ai
+        damage_per_turn = combat.fighter_damage_per_turn(self.brute, self.hero)
+        self.assertAlmostEqual(ai.expected_survival(self.hero, self.brute), 8 + self.hero.health / damage_per_turn)
+        damage_per_turn = combat.fighter_damage_per_turn(self.archer, self.hero)
+        self.assertAlmostEqual(ai.expected_survival(self.hero, self.archer), self.hero.health / damage_per_turn)
+
+    def test_targets_the_most_dangerous_opponent(self):
+        # against armor class 5 the Brute hits half the time for 5.5 and has 8 squares
+        # to close in; the Archer is in range and hits 30% of the time for 2.5
+        ai = self.hero.ai
+        self.hero.health = 20
+        self.assertAlmostEqual(ai.expected_survival(self.hero, self.brute), 8 + 20 / 2.75)
+        self.assertAlmostEqual(ai.expected_survival(self.hero, self.archer), 20 / 0.75)
+        self.assertIs(ai.select_target(self.hero), self.brute)
+        self.hero.health = 5  # 9.8 turns against the Brute, 6.7 against the Archer
+        self.assertIs(ai.select_target(self.hero), self.archer)
+        self.battle.map.move_fighter(self.brute, self.battle.map.get_position(1, 1))
+        self.assertIs(ai.select_target(self.hero), self.brute)
+
+    def test_path_distance(self):
+        # a river with a ford at y = 9 makes the Brute walk 18 squares instead of 9
+        self.battle.map.fill_terrain(Terrain.WATER, 5, 0, 1, 9)
+        self.battle.map.move_fighter(self.brute, self.battle.map.get_position(9, 0))
+        self.hero.health = 20
+        self.assertAlmostEqual(self.hero.ai.expected_survival(self.hero, self.brute), 17 + 20 / 2.75)
+
+    def test_plays_in_arena(self):
+        arena = Arena(self.roles, iterations=20, seed=2)
+        arena.simulate_battle()
+        self.assertEqual(arena.iterations_run, 20)
+
+if __name__ == '__main__':
+    unittest.main()
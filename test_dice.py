@@ -0,0 +1,58 @@
+# test_dice.py
+import random
+import unittest
+from dice import Dice, alias_table, attack_table, dice_distribution, hit_probability
+from weapon import create_weapon
+
+class TestDice(unittest.TestCase):
+    def setUp(self):
+        random.seed(12)
+        self.dice = Dice(block_size=256)
+
+    def test_dice_distribution(self):
+        self.assertEqual(dict(dice_distribution(2, 4))[5], 4 / 16)
+        self.assertAlmostEqual(sum(p for total, p in dice_distribution(3, 6)), 1.0)
+
+    def test_hit_probability(self):
+        self.assertEqual(hit_probability(11), 0.5)
+        self.assertEqual(hit_probability(-3), 1.0)
+        self.assertEqual(hit_probability(25), 0.0)
+
+    def test_alias_table_keeps_probabilities(self):
+        outcomes, keep, aliases = alias_table(['a', 'b', 'c'], [0.5, 0.3, 0.2])
+        mass = {'a': 0.0, 'b': 0.0, 'c': 0.0}
+        for outcome, kept, alias in zip(outcomes, keep, aliases):
+            mass[outcome] += kept / 3
+            mass[alias] += (1 - kept) / 3
+        for outcome, p in zip('abc', [0.5, 0.3, 0.2]):
+            self.assertAlmostEqual(mass[outcome], p)
+
+    def test_attack_matches_rolls(self):
+        # 1d20 needing 14 and 2d4+1 damage, sampled against the exact distribution
+        weapon = create_weapon('morning star')
+        draws = 40000
+        counts = {}
+        for _ in range(draws):
+            damage = self.dice.attack(weapon, 1, 14)
+            counts[damage] = counts.get(damage, 0) + 1
+        expected = {None: 13 / 20}
+        expected.update({total + 1: 7 / 20 * p for total, p in dice_distribution(2, 4)})
+        self.assertEqual(set(counts), set(expected))
+        for outcome, p in expected.items():
+            self.assertAlmostEqual(counts[outcome] / draws, p, delta=4 * (p * (1 - p) / draws) ** 0.5 + 1e-9)
+
+    def test_tables_are_cached(self):
+        self.assertIs(attack_table(1, 8, 0, 11), attack_table(1, 8, 0, 11))
+
+    def test_roll(self):
+        rolls = [self.dice.roll(3, 6) for _ in range(1000)]
+        self.assertEqual((min(rolls), max(rolls)), (3, 18))
+
+    def test_seeded_streams_repeat(self):
+        random.seed(5)
+        first = [Dice().uniform() for _ in range(3)]
+        random.seed(5)
+        self.assertEqual(first, [Dice().uniform() for _ in range(3)])
+
+if __name__ == '__main__':
+    unittest.main()
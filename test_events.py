@@ -0,0 +1,101 @@
+# test_events.py
+import os
+import tempfile
+import unittest
+from ai import GreatestThreatAI, LowestHealthAI, DefensiveAI
+from arena import Arena
+from battle import Battle
+from buff import BuffCreator
+from events import EventRecorder, EventType, RECORD, read_battles
+from fighter import Fighter
+
+test_roles = [
+            {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI()},
+            {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': LowestHealthAI()},
+            {'name': 'Alice', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'trident', 'armor': 'ring mail', 'shield': 'small shield', 'ai': DefensiveAI()},
+]
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'battles.arena')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record_battles(self, count):
+        recorder = EventRecorder(self.path)
+        battles = []
+        for i in range(count):
+            battle = Battle(f'Battle {i + 1}', test_roles, recorder=recorder)
+            battle.starting_positions = {f.id: (f.position.x, f.position.y) for f in battle.fighters}
+            battle.fight_battle()
+            battles.append(battle)
+        recorder.close()
+        return battles
+
+    def test_round_trip(self):
+        battles = self.record_battles(3)
+        replays = list(read_battles(self.path))
+        self.assertEqual([replay.title for replay in replays], ['Battle 1', 'Battle 2', 'Battle 3'])
+        for battle, replay in zip(battles, replays):
+            self.assertEqual(replay.winner, battle.winner)
+            self.assertEqual(replay.turns, battle.turn)
+            self.assertEqual(replay.events[0].type, EventType.SPAWN)
+
+    def test_deployment_state(self):
+        battle = self.record_battles(1)[0]
+        replay = next(read_battles(self.path))
+        map, fighters = replay.state_at(0)
+        for id, (x, y) in battle.starting_positions.items():
+            self.assertIs(map.get_position(x, y).fighter, fighters[id])
+            self.assertEqual(fighters[id].health, fighters[id].max_health)
+
+    def test_final_state(self):
+        battle = self.record_battles(1)[0]
+        replay = next(read_battles(self.path))
+        map, fighters = replay.state_at(replay.turns)
+        survivors = {f.id: f for f in battle.fighters}
+        for id, fighter in fighters.items():
+            if id in survivors:
+                self.assertEqual(fighter.health, survivors[id].health)
+                self.assertEqual((fighter.position.x, fighter.position.y), (survivors[id].position.x, survivors[id].position.y))
+            else:
+                self.assertLessEqual(fighter.health, 0)
+                self.assertIsNone(fighter.position)
+
+    def test_round_by_round(self):
+        recorder = EventRecorder(self.path)
+        battle = Battle('Rounds', test_roles, recorder=recorder)
+        glenda = battle.fighters[0]
+        glenda.health -= 12
+        glenda.apply_buff(BuffCreator.create_heal_over_time())  # the first event writes the header
+        for _ in range(3):
+            battle.play_round()
+        recorder.close()
+        replay = next(read_battles(self.path))
+        self.assertEqual(replay.title, 'Rounds')
+        self.assertIsNone(replay.winner)
+        self.assertIn(EventType.HEAL, [event.type for event in replay.events])
+        map, fighters = replay.state_at(3)
+        for fighter in battle.fighters:
+            self.assertEqual(fighters[fighter.id].health, fighter.health)
+
+    def test_records_are_fixed_width(self):
+        self.record_battles(2)
+        replays = list(read_battles(self.path))
+        events = sum(len(replay.events) + 1 for replay in replays)  # plus END records
+        headers = os.path.getsize(self.path) - events * RECORD.size
+        self.assertLess(headers, 2 * 1024)
+
+    def test_arena_records_every_block(self):
+        arena = Arena(test_roles[:2], iterations=150, seed=4, record=self.directory.name)
+        arena.simulate_battle()
+        files = sorted(name for name in os.listdir(self.directory.name) if name.startswith('block-'))
+        self.assertEqual(files, ['block-00000.arena', 'block-00001.arena'])
+        replays = [replay for name in files for replay in read_battles(os.path.join(self.directory.name, name))]
+        self.assertEqual(len(replays), 150)
+        self.assertEqual(sum(replay.winner == 'Red' for replay in replays), arena.wins['Red'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,9 @@
 # test_map.py
+import random
 import unittest
 from ai import *
 from fighter import Fighter
-from map import Map, Position, Terrain
+from map import Map, Position, Terrain, EMPTY, NEIGHBOR_DELTAS, offset_distance, offsets_within
 
 class TestPosition(unittest.TestCase):
 
@@ -38,6 +39,8 @@ class TestMap(unittest.TestCase):
         self.assertEqual(map.height, self.height)
         self.assertEqual(len(map.grid), self.width)
         self.assertTrue(all(len(row) == self.height for row in map.grid))
+        self.assertIs(map.grid, map.grid)
+        self.assertIs(map.grid[1][2], map.get_position(1, 2))
 
     def test_set_terrain(self):
         map = self.create_map('grid4')
@@ -201,5 +204,234 @@ class TestMap(unittest.TestCase):
         self.assertEqual(path[0], start)
         self.assertEqual(path[-1], goal)
 
+class TestMapStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.map = Map(6, 4, 'grid8')
+        self.fighter = Fighter('Test Fighter', 3, RandomAttackAI(), "Odds")
+
+    def test_positions_are_views(self):
+        pos = self.map.get_position(2, 3)
+        self.assertIs(self.map.get_position(2, 3), pos)
+        self.map.set_terrain(2, 3, Terrain.MOUNTAIN)
+        self.assertEqual(pos.terrain, Terrain.MOUNTAIN)
+        self.assertEqual(self.map.terrain[2 * 4 + 3], Terrain.MOUNTAIN.value)
+        pos.terrain = Terrain.FOREST
+        self.assertEqual(self.map.get_position(2, 3).terrain, Terrain.FOREST)
+
+    def test_occupancy_holds_fighter_ids(self):
+        self.map.occupy_position(self.fighter, self.map.get_position(1, 2))
+        id = self.map.occupancy[1 * 4 + 2]
+        self.assertIs(self.map.occupants[id], self.fighter)
+        self.assertEqual(sum(1 for cell in self.map.occupancy if cell != EMPTY), 1)
+
+    def test_occupy_standalone_position(self):
+        self.map.occupy_position(self.fighter, Position(3, 1, 'grid8'))
+        self.assertIs(self.map.get_position(3, 1).fighter, self.fighter)
+        self.assertIs(self.fighter.position.map, self.map)
+
+    def test_fill_terrain(self):
+        self.map.fill_terrain(Terrain.WATER, 1, 1, 2, 2)
+        water = {(x, y) for x in range(6) for y in range(4) if self.map.get_position(x, y).terrain == Terrain.WATER}
+        self.assertEqual(water, {(1, 1), (1, 2), (2, 1), (2, 2)})
+        self.map.fill_terrain(Terrain.FOREST, 4, 2, 10, 10)  # clipped to the map
+        self.assertEqual(self.map.get_position(5, 3).terrain, Terrain.FOREST)
+
+    def test_load_terrain(self):
+        rows = [[Terrain.PLAIN] * 6, [Terrain.FOREST] * 6, [1, 2, 3, 4, 1, 2], [Terrain.WATER] * 6]
+        self.map.load_terrain(rows)
+        self.assertEqual(self.map.get_position(0, 1).terrain, Terrain.FOREST)
+        self.assertEqual(self.map.get_position(2, 2).terrain, Terrain.MOUNTAIN)
+        self.assertEqual(self.map.get_position(5, 3).terrain, Terrain.WATER)
+
+    def test_copy(self):
+        self.map.set_terrain(0, 0, Terrain.FOREST)
+        self.map.occupy_position(self.fighter, self.map.get_position(1, 1))
+        other = self.map.copy()
+        other.set_terrain(0, 0, Terrain.WATER)
+        other.vacate_position(other.get_position(1, 1))
+        self.assertEqual(self.map.get_position(0, 0).terrain, Terrain.FOREST)
+        self.assertIs(self.map.get_position(1, 1).fighter, self.fighter)
+
+    def test_reset(self):
+        pos = self.map.get_position(1, 1)
+        self.map.set_terrain(1, 1, Terrain.FOREST)
+        self.map.occupy_position(self.fighter, pos)
+        self.map.clear_occupants()
+        self.assertIsNone(pos.fighter)
+        self.assertIsNone(self.fighter.position)
+        self.assertEqual(pos.terrain, Terrain.FOREST)
+        self.map.reset()
+        self.assertEqual(pos.terrain, Terrain.PLAIN)
+
+class TestPathCache(unittest.TestCase):
+
+    def setUp(self):
+        self.map = Map(6, 4, 'grid8')
+        self.fighter = Fighter('Test Fighter', 3, RandomAttackAI(), "Odds")
+
+    def test_version_bumps(self):
+        versions = [self.map.version]
+        self.map.occupy_position(self.fighter, self.map.get_position(0, 0))
+        versions.append(self.map.version)
+        self.map.move_fighter(self.fighter, self.map.get_position(1, 0))
+        versions.append(self.map.version)
+        self.map.vacate_position(self.fighter.position)
+        versions.append(self.map.version)
+        self.map.set_terrain(2, 2, Terrain.FOREST)
+        versions.append(self.map.version)
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_repeated_query_hits_cache(self):
+        start, goal = self.map.get_position(0, 0), self.map.get_position(5, 3)
+        path = self.map.astar(start, goal)
+        self.assertEqual(self.map.astar(Position(0, 0, 'grid8'), goal)[1:], path[1:])
+        self.assertEqual((self.map.path_cache_hits, self.map.path_cache_misses), (1, 1))
+
+    def test_changes_invalidate_cache(self):
+        start, goal = self.map.get_position(0, 0), self.map.get_position(2, 0)
+        self.assertEqual(len(self.map.astar(start, goal)), 3)
+        self.map.fill_terrain(Terrain.WATER, 1, 0, 1, 3)
+        self.assertEqual(len(self.map.astar(start, goal)), 7)
+        self.assertEqual(self.map.path_cache_misses, 2)
+
+    def test_fighters_keep_the_cache(self):
+        start, goal = self.map.get_position(0, 0), self.map.get_position(4, 0)
+        self.assertEqual(len(self.map.astar(start, goal)), 5)
+        for y in range(3):
+            self.map.occupy_position(Fighter(f'Wall {y}', 1, RandomAttackAI(), "Evens"), self.map.get_position(2, y))
+        path = self.map.astar(start, goal)
+        self.assertEqual(len(path), 7)  # around the wall through (2, 3)
+        self.assertEqual((path[3].x, path[3].y), (2, 3))
+        self.assertEqual((self.map.path_cache_hits, self.map.path_cache_misses), (1, 1))
+
+    def test_cache_is_bounded(self):
+        self.map.path_cache_size = 2
+        for x in range(4):
+            self.map.astar(self.map.get_position(0, 0), self.map.get_position(x, 3))
+        self.assertEqual(len(self.map.path_cache), 2)
+
+class TestRangeQueries(unittest.TestCase):
+
+    def test_offsets_within(self):
+        for map_type, deltas in NEIGHBOR_DELTAS.items():
+            self.assertEqual(list(offsets_within(map_type, 1)), deltas)
+            map = Map(9, 9, map_type)
+            center = map.get_position(4, 4)
+            offsets = offsets_within(map_type, 3)
+            self.assertEqual(len(offsets), sum(1 for x in range(9) for y in range(9)
+                                               if 0 < map.calculate_distance(center, map.get_position(x, y)) <= 3))
+            distances = [offset_distance(map_type, dx, dy) for dx, dy in offsets]
+            self.assertEqual(distances, sorted(distances))
+
+    def test_cells_within_clips_to_map(self):
+        map = Map(6, 4, 'grid8')
+        self.assertEqual(len(map.cells_within(map.get_position(0, 0), 2)), 8)
+        self.assertEqual(len(map.cells_within(map.get_position(2, 2), 1)), 8)
+
+    def test_fighters_within(self):
+        map = Map(6, 4, 'grid4')
+        fighters = [Fighter(name, 1, RandomAttackAI(), "Odds") for name in ('A', 'B', 'C')]
+        for fighter, (x, y) in zip(fighters, [(0, 0), (2, 1), (1, 0)]):
+            map.occupy_position(fighter, map.get_position(x, y))
+        self.assertEqual(map.fighters_within(map.get_position(0, 0), 3), [fighters[2], fighters[1]])
+        self.assertEqual(map.fighters_within(map.get_position(0, 0), 2), [fighters[2]])
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(3)
+
+    def populate(self, map_type, count=40):
+        map = Map(30, 20, map_type)
+        fighters = []
+        while len(fighters) < count:
+            pos = map.get_position(random.randrange(30), random.randrange(20))
+            if pos.fighter is None:
+                fighter = Fighter(f'F{len(fighters)}', 1, RandomAttackAI(), random.choice(["Odds", "Evens"]))
+                map.occupy_position(fighter, pos)
+                fighters.append(fighter)
+        return map, fighters
+
+    def test_matches_scan(self):
+        for map_type in ('grid4', 'grid8', 'hex'):
+            map, fighters = self.populate(map_type)
+            for _ in range(20):
+                pos = map.get_position(random.randrange(30), random.randrange(20))
+                enemies = [f for f in fighters if f.faction != "Odds"]
+                scan = sorted(enemies, key=lambda f: map.calculate_distance(pos, f.position))
+                self.assertEqual(map.nearest_enemy(pos, "Odds"), scan[0])
+                self.assertEqual(map.k_nearest_enemies(pos, "Odds", 5), scan[:5])
+                self.assertEqual(map.enemies_within(pos, "Odds", 6),
+                                 [f for f in scan if map.calculate_distance(pos, f.position) <= 6])
+
+    def test_index_follows_moves(self):
+        map, fighters = self.populate('grid8', 2)
+        odd = Fighter('Odd', 1, RandomAttackAI(), "Odds")
+        map.occupy_position(odd, map.get_position(0, 0))
+        for fighter in fighters:
+            map.vacate_position(fighter.position)
+        enemy = Fighter('Enemy', 1, RandomAttackAI(), "Evens")
+        map.occupy_position(enemy, map.get_position(29, 19))
+        self.assertIs(map.nearest_enemy(odd.position, "Odds"), enemy)
+        map.move_fighter(enemy, map.get_position(1, 1))
+        self.assertEqual(map.enemies_within(odd.position, "Odds", 1), [enemy])
+        map.vacate_position(enemy.position)
+        self.assertIsNone(map.nearest_enemy(odd.position, "Odds"))
+
+class TestDistanceField(unittest.TestCase):
+
+    def setUp(self):
+        self.map = Map(6, 4, 'grid8')
+        self.enemy = Fighter('Enemy', 3, RandomAttackAI(), "Evens")
+        self.ally = Fighter('Ally', 3, RandomAttackAI(), "Odds")
+        self.map.occupy_position(self.enemy, self.map.get_position(5, 0))
+
+    def field_at(self, x, y):
+        return self.map.distance_field("Odds")[x * self.map.height + y]
+
+    def test_distance_to_nearest_enemy(self):
+        self.assertEqual(self.field_at(5, 0), 0)
+        self.assertEqual(self.field_at(4, 1), 1)
+        self.assertEqual(self.field_at(0, 3), 5)
+        self.map.fill_terrain(Terrain.FOREST, 4, 0, 1, 4)
+        self.assertEqual(self.field_at(3, 0), 3)
+
+    def test_field_is_shared_until_enemies_move(self):
+        field = self.map.distance_field("Odds")
+        self.map.occupy_position(self.ally, self.map.get_position(0, 0))
+        self.assertIs(self.map.distance_field("Odds"), field)
+        self.map.move_fighter(self.enemy, self.map.get_position(5, 3))
+        self.assertIsNot(self.map.distance_field("Odds"), field)
+        self.assertEqual(self.field_at(5, 0), 3)
+
+    def test_step_towards_enemies(self):
+        self.map.occupy_position(self.ally, self.map.get_position(0, 0))
+        self.assertEqual(self.map.step_towards_enemies(self.ally.position, "Odds"), self.map.get_position(1, 0))
+        self.assertIsNone(self.map.step_towards_enemies(self.map.get_position(4, 0), "Odds"))
+
+    def test_step_towards_goal(self):
+        self.map.occupy_position(self.ally, self.map.get_position(0, 0))
+        goal = self.map.get_position(0, 3)
+        self.assertEqual(self.map.step_towards(self.ally.position, goal), self.map.get_position(0, 1))
+        field = self.map.field_to(goal)
+        self.map.move_fighter(self.enemy, self.map.get_position(5, 3))
+        self.assertIs(self.map.field_to(goal), field)  # only terrain shapes it
+        self.map.set_terrain(0, 1, Terrain.WATER)
+        self.assertIsNot(self.map.field_to(goal), field)
+        self.assertEqual(self.map.step_towards(self.ally.position, goal), self.map.get_position(1, 1))
+
+    def test_allies_do_not_shape_the_field(self):
+        # the field is cached across allied moves, so it must not depend on them
+        self.map.distance_field("Odds")
+        fresh = Map(6, 4, 'grid8')
+        fresh.occupy_position(Fighter('Enemy', 3, RandomAttackAI(), "Evens"), fresh.get_position(5, 0))
+        for y in range(4):
+            self.map.occupy_position(Fighter(f'Wall {y}', 1, RandomAttackAI(), "Odds"), self.map.get_position(2, y))
+            fresh.occupy_position(Fighter(f'Wall {y}', 1, RandomAttackAI(), "Odds"), fresh.get_position(2, y))
+        self.assertEqual(self.map.distance_field("Odds"), fresh.distance_field("Odds"))
+        self.assertEqual(self.field_at(0, 0), 5)
+        self.assertIsNone(self.map.step_towards_enemies(self.map.get_position(1, 0), "Odds"))  # the wall is in the way
+
 if __name__ == '__main__':
     unittest.main()
@@ -71,6 +71,25 @@ class TestPathfinding(unittest.TestCase):
         self.assertEqual(path, expected_path)
 
 
+    def test_occupied_goal(self):
+        class Dummy:
+            position = None
+        start = self.map.get_position(0, 0)
+        goal = self.map.get_position(4, 0)
+        self.map.occupy_position(Dummy(), goal)
+        self.map.occupy_position(Dummy(), self.map.get_position(1, 0))
+        path = self.map.astar(start, goal)
+        self.assertEqual([(p.x, p.y) for p in path], [(0, 0), (1, 1), (2, 0), (3, 0), (4, 0)])
+        self.assertIs(path[1], self.map.get_position(1, 1))
+
+    def test_grid4_and_hex_paths(self):
+        for map_type, length in (('grid4', 9), ('hex', 9)):
+            map = Map(width=5, height=5, map_type=map_type)
+            path = map.astar(map.get_position(0, 0), map.get_position(4, 4))
+            self.assertEqual(len(path), length)
+            for a, b in zip(path, path[1:]):
+                self.assertTrue(map.is_adjacent(a, b))
+
     def test_out_of_bounds(self):
         start = Position(-1, -1, 'grid8')
         end = Position(6, 6, 'grid8')
@@ -0,0 +1,98 @@
+# test_profiling.py
+import io
+import random
+import tracemalloc
+import unittest
+from contextlib import redirect_stdout
+from ai import GreatestThreatAI, LowestHealthAI
+from arena import Arena
+from battle import Battle
+from fighter import Fighter
+from map import Map
+from profiling import Profiler
+
+test_roles = [
+    {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI()},
+    {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': LowestHealthAI()},
+    {'name': 'Alice', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'trident', 'armor': 'ring mail', 'shield': 'small shield', 'ai': GreatestThreatAI()},
+]
+
+class TestProfiler(unittest.TestCase):
+    def test_battle_phases(self):
+        random.seed(1)
+        profiler = Profiler()
+        battle = Battle('Profiled', test_roles, profiler=profiler)
+        battle.fight_battle()
+        self.assertEqual(profiler.battles, 1)
+        self.assertEqual(profiler.timers['round'][0], battle.turn)
+        self.assertGreater(profiler.timers['ai'][0], battle.turn)
+        self.assertGreaterEqual(profiler.timers['round'][1], profiler.timers['ai'][1])
+        # movers look up their target's distance field, building it when the target has moved
+        self.assertGreater(profiler.timers['pathfinding'][0], 0)
+        self.assertEqual(profiler.timers['pathfinding'][0], profiler.counters.get('fields.cache_hits', 0) + profiler.counters['fields.built'])
+        self.assertEqual(profiler.counters['fields.built'], battle.map.path_cache_misses)
+        self.assertGreaterEqual(profiler.timers['movement'][1], profiler.timers['pathfinding'][1])
+        self.assertNotIn('logging', profiler.timers)  # a silent battle logs nothing
+
+    def test_astar_counters(self):
+        map = Map(10, 10, 'grid8')
+        map.profiler = profiler = Profiler()
+        start, goal = map.get_position(0, 0), map.get_position(5, 0)
+        self.assertEqual(len(map.astar(start, goal)), 6)
+        map.astar(start, goal)
+        self.assertEqual(profiler.counters['astar.searches'], 2)
+        self.assertEqual((profiler.counters['fields.built'], profiler.counters['fields.cache_hits']), (1, 1))  # the goal's field
+        self.assertEqual(profiler.counters['astar.path_length'], 10)
+        self.assertGreaterEqual(profiler.counters['astar.expanded'], 6)
+        self.assertGreaterEqual(profiler.counters['astar.pushes'], profiler.counters['astar.expanded'])
+        self.assertEqual(profiler.timers['pathfinding'][0], 2)
+
+    def test_unprofiled_battle(self):
+        random.seed(1)
+        battle = Battle('Plain', test_roles)
+        self.assertIsNone(battle.profiler)
+        self.assertIsNone(battle.map.profiler)
+        battle.fight_battle()
+
+    def test_merge(self):
+        first, second = Profiler(), Profiler()
+        first.timers['round'] = [2, 0.5]
+        second.timers['round'] = [3, 0.25]
+        second.counters['astar.searches'] = 4
+        second.battles = 1
+        first.merge(second)
+        self.assertEqual(first.timers['round'], [5, 0.75])
+        self.assertEqual(first.counters, {'astar.searches': 4})
+        self.assertEqual(first.battles, 1)
+
+class TestArenaProfile(unittest.TestCase):
+    def test_aggregates_blocks(self):
+        plain = Arena(test_roles, iterations=150, seed=2)
+        plain.simulate_battle()
+        profiled = Arena(test_roles, iterations=150, seed=2, profile=True, workers=2)
+        profiled.simulate_battle()
+        self.assertEqual(profiled.wins, plain.wins)  # profiling draws nothing from random
+        self.assertEqual(profiled.profiler.battles, 150)
+        self.assertEqual(profiled.profiler.timers['setup'][0], 150)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            profiled.print_profile()
+        self.assertIn('Profile of 150 battles', output.getvalue())
+        self.assertIn('targeting', output.getvalue())
+
+    def test_allocations(self):
+        arena = Arena(test_roles, iterations=5, seed=2, profile='allocations')
+        arena.simulate_battle()
+        self.assertEqual(len(arena.profiler.peak_memory), 5)
+        self.assertTrue(all(peak > 0 for peak in arena.profiler.peak_memory))
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_profile_is_opt_in(self):
+        arena = Arena(test_roles, iterations=5, seed=2)
+        with self.assertRaises(ValueError):
+            arena.print_profile()
+        with self.assertRaises(ValueError):
+            Arena(test_roles, engine='numpy', profile=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# test_search.py
+import random
+import unittest
+from ai import MCTSAI, SearchState, GreatestThreatAI
+from arena import Arena
+from battle import Battle
+from buff import BuffCreator, DEFENSIVE_STANCE
+from dice import Dice
+from fighter import Fighter
+
+test_roles = [
+    {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': MCTSAI(rollouts=50)},
+    {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': GreatestThreatAI()},
+    {'name': 'Alice', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'trident', 'armor': 'ring mail', 'shield': 'small shield', 'ai': GreatestThreatAI()},
+]
+
+class TestSearchState(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+        self.battle = Battle('Search Battle', test_roles)
+        self.glenda, self.hiro, self.alice = self.battle.fighters
+        self.battle.map.clear_occupants()
+        for fighter, (x, y) in zip(self.battle.fighters, [(2, 2), (3, 3), (7, 7)]):
+            self.battle.map.occupy_position(fighter, self.battle.map.get_position(x, y))
+
+    def test_mirrors_battle(self):
+        self.glenda.apply_buff(BuffCreator.create_defensive_stance())
+        state = SearchState(self.battle, Dice())
+        self.assertEqual(state.health, [f.health for f in self.battle.fighters])
+        self.assertEqual(state.stats['armor_class'][0], self.glenda.armor_class)
+        self.assertEqual(state.buffs[0], ((DEFENSIVE_STANCE, 0),))
+        self.assertEqual(state.enemies_in_reach(0), [1])
+
+    def test_copies_are_independent(self):
+        state = SearchState(self.battle, Dice())
+        other = state.copy()
+        other.move(0, -1, -1)
+        other.health[1] = 0
+        other.apply_buff(0, DEFENSIVE_STANCE)
+        self.assertEqual((state.xs[0], state.ys[0]), (2, 2))
+        self.assertEqual(state.health[1], self.hiro.health)
+        self.assertEqual(state.buffs[0], ())
+        self.assertEqual(state.stats['armor_class'][0], self.glenda.armor_class)
+
+    def test_buffs_run_out(self):
+        state = SearchState(self.battle, Dice())
+        armor_class = state.stats['armor_class'][0]
+        state.apply_buff(0, DEFENSIVE_STANCE)
+        self.assertEqual(state.stats['armor_class'][0], armor_class - 4)
+        state.start_turn(0)
+        self.assertEqual(state.stats['armor_class'][0], armor_class)
+        self.assertEqual(state.buffs[0], ())
+
+    def test_death_ends_search(self):
+        state = SearchState(self.battle, Dice())
+        state.health[2] = 0
+        state.die(2)
+        self.assertFalse(state.is_over())
+        self.assertEqual(state.stats['attack_bonus'][1], self.hiro.attack_bonus + 5)  # Berserk Rage
+        state.health[1] = 0
+        state.die(1)
+        self.assertTrue(state.is_over())
+        self.assertEqual(state.score('Red'), 1.0)
+
+class TestMCTSAI(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+        self.battle = Battle('Search Battle', test_roles)
+        self.glenda, self.hiro, self.alice = self.battle.fighters
+        self.battle.map.clear_occupants()
+        for fighter, (x, y) in zip(self.battle.fighters, [(2, 2), (3, 3), (7, 7)]):
+            self.battle.map.occupy_position(fighter, self.battle.map.get_position(x, y))
+        self.glenda.turns_taken = 1
+
+    def test_finishes_off_a_wounded_enemy(self):
+        battle = Battle('Duel', test_roles[:2])
+        glenda, hiro = battle.fighters
+        battle.map.clear_occupants()
+        battle.map.occupy_position(glenda, battle.map.get_position(2, 2))
+        battle.map.occupy_position(hiro, battle.map.get_position(3, 3))
+        glenda.turns_taken = 1
+        hiro.health = 1
+        self.assertEqual(MCTSAI(rollouts=100).search(glenda), ('attack', hiro.id))
+
+    def test_reuses_tree(self):
+        ai = MCTSAI(rollouts=50)
+        ai.search(self.glenda)
+        turns_taken, node = ai.trees[self.glenda]
+        visits = node.visits
+        self.assertEqual(turns_taken, 1)
+        self.glenda.turns_taken = 2
+        ai.search(self.glenda)
+        self.assertEqual(node.visits, visits + 50)
+        self.glenda.turns_taken = 5  # not the next turn, start afresh
+        ai.search(self.glenda)
+        self.assertIsNot(ai.trees[self.glenda][1], node)
+
+    def test_time_budget(self):
+        ai = MCTSAI(rollouts=None, time_budget=0.01)
+        self.assertIsNotNone(ai.search(self.glenda))
+        with self.assertRaises(ValueError):
+            MCTSAI(rollouts=None)
+
+    def test_plays_in_arena(self):
+        arena = Arena(test_roles, iterations=5, seed=4)
+        arena.simulate_battle()
+        self.assertEqual(arena.iterations_run, 5)
+
+    def test_workers_agree(self):
+        roles = [dict(role, ai=MCTSAI(rollouts=3)) if role['faction'] == 'Red' else role for role in test_roles]
+        serial = Arena(roles, iterations=200, seed=5)
+        serial.simulate_battle()
+        parallel = Arena(roles, iterations=200, seed=5, workers=3)
+        parallel.simulate_battle()
+        self.assertEqual(parallel.wins, serial.wins)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# test_solver.py
+import unittest
+from ai import GreatestThreatAI, DefensiveAI
+from arena import Arena
+from fighter import Fighter
+import solver
+
+duel_roles = [
+            {'name': 'Glenda', 'faction': 'Red', 'level': 3, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI()},
+            {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'morning star', 'armor': 'leather armor', 'shield': 'small shield', 'ai': DefensiveAI()},
+]
+
+class TestDistributions(unittest.TestCase):
+    def test_damage_distribution(self):
+        self.assertEqual(solver.damage_distribution('flail'), tuple((d, 1 / 6) for d in range(2, 8)))
+        morning_star = dict(solver.damage_distribution('morning star'))
+        self.assertAlmostEqual(morning_star[5], 4 / 16)
+        self.assertAlmostEqual(sum(morning_star.values()), 1)
+
+    def test_hit_chance(self):
+        self.assertEqual(solver.hit_chance(0, 5, 6), 0.5)  # needs 11 or better
+        self.assertEqual(solver.hit_chance(0, 10, 15), 1.0)
+        self.assertEqual(solver.hit_chance(0, -10, 1), 0.0)
+
+    def test_distance_distribution(self):
+        distances = dict(solver.distance_distribution(10, 10))
+        self.assertAlmostEqual(sum(distances.values()), 1)
+        self.assertEqual(max(distances), 9)
+
+class TestSolver(unittest.TestCase):
+    def test_probabilities_sum_to_one(self):
+        probabilities = solver.solve(duel_roles)
+        self.assertAlmostEqual(sum(probabilities.values()), 1)
+
+    def test_symmetric_duel(self):
+        mirror = [dict(duel_roles[0]), dict(duel_roles[0], name='Twin', faction='Blue')]
+        probabilities = solver.solve(mirror)
+        # A wins health ties on turn order, so the first listed is slightly favoured
+        self.assertGreater(probabilities['Red'], 0.5)
+        self.assertLess(probabilities['Red'], 0.55)
+
+    def test_unsupported_scenarios(self):
+        ranged = [duel_roles[0], dict(duel_roles[1], weapon='bow')]
+        self.assertIsNone(solver.solve(ranged))
+        self.assertIsNone(solver.solve(duel_roles + [dict(duel_roles[1], name='Rae')]))
+
+    def test_matches_simulation(self):
+        arena = Arena(duel_roles, iterations=600, seed=9)
+        arena.simulate_battle()
+        exact = Arena(duel_roles).exact_probabilities()
+        self.assertAlmostEqual(exact['Red'], arena.wins['Red'] / 600, delta=0.07)
+
+    def test_turn_limit(self):
+        # heavy armor at level 1: one swing in ten lands, and some duels run out the clock
+        armored = [dict(role, level=1, weapon='dagger', armor='plate mail', shield='large shield') for role in duel_roles]
+        self.assertGreater(solver.draw_bound(solver.loadout(armored[0]), solver.loadout(armored[1])), 1e-3)
+        self.assertIsNone(solver.solve(armored))
+        self.assertIsNotNone(solver.solve(armored, turn_limit=1000))
+        self.assertLess(solver.draw_bound(solver.loadout(duel_roles[0]), solver.loadout(duel_roles[1])), 1e-9)
+        arena = Arena(armored, iterations=100, seed=1)
+        arena.exact_probabilities()
+        self.assertEqual(arena.iterations_run, 100)
+
+    def test_falls_back_to_simulation(self):
+        ranged = [duel_roles[0], dict(duel_roles[1], weapon='bow')]
+        arena = Arena(ranged, iterations=100, seed=1)
+        probabilities = arena.exact_probabilities()
+        self.assertEqual(arena.iterations_run, 100)
+        self.assertAlmostEqual(sum(probabilities.values()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
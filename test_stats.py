@@ -0,0 +1,31 @@
+# test_stats.py
+import unittest
+from stats import wilson_interval, clopper_pearson_interval, beta_cdf, interval
+
+class TestIntervals(unittest.TestCase):
+    def test_wilson_interval(self):
+        low, high = wilson_interval(50, 100)
+        self.assertAlmostEqual(low, 0.4038, places=4)
+        self.assertAlmostEqual(high, 0.5962, places=4)
+
+    def test_clopper_pearson_interval(self):
+        low, high = clopper_pearson_interval(50, 100)
+        self.assertAlmostEqual(low, 0.3983, places=4)
+        self.assertAlmostEqual(high, 0.6017, places=4)
+
+    def test_extreme_counts(self):
+        self.assertEqual(clopper_pearson_interval(0, 20)[0], 0.0)
+        self.assertEqual(clopper_pearson_interval(20, 20)[1], 1.0)
+        self.assertAlmostEqual(clopper_pearson_interval(0, 20)[1], 0.1684, places=4)
+        self.assertEqual(wilson_interval(0, 0), (0.0, 1.0))
+
+    def test_beta_cdf(self):
+        self.assertAlmostEqual(beta_cdf(0.5, 2, 2), 0.5)
+        self.assertAlmostEqual(beta_cdf(0.3, 1, 1), 0.3)
+
+    def test_interval_methods(self):
+        self.assertEqual(interval(30, 60, method='wilson'), wilson_interval(30, 60))
+        self.assertEqual(interval(30, 60, method='clopper-pearson'), clopper_pearson_interval(30, 60))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# test_sweep.py
+import csv
+import os
+import tempfile
+import unittest
+from ai import GreatestThreatAI
+from fighter import Fighter
+from sweep import Sweep, read_results, save_npz
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+test_roles = [
+    {'name': 'Glenda', 'faction': 'Red', 'level': 6, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': GreatestThreatAI()},
+    {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': GreatestThreatAI()},
+]
+
+grid = {'Glenda.weapon': ['dagger', 'long sword'], 'Glenda.armor': [None, 'plate mail'], 'Glenda.level': [1, 6]}
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'sweep.csv')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def rows(self):
+        with open(self.path, newline='') as file:
+            return list(csv.reader(file))
+
+    def test_grid(self):
+        sweep = Sweep(test_roles, grid, iterations=10, seed=1)
+        cells = list(sweep.cells())
+        self.assertEqual(len(sweep), 8)
+        self.assertEqual(cells[1], (1, ('dagger', None, 6)))
+        self.assertEqual([sweep.cell_values(index) for index, values in cells], [values for index, values in cells])
+        roles = sweep.cell_roles(cells[1][1])
+        self.assertEqual((roles[0]['weapon'], roles[0]['armor'], roles[0]['level']), ('dagger', None, 6))
+        self.assertEqual(roles[1], test_roles[1])
+        self.assertEqual(test_roles[0]['level'], 6)  # the base roles are left alone
+
+    def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            Sweep(test_roles, {'Glenda.charisma': [1, 2]})
+        with self.assertRaises(ValueError):
+            Sweep(test_roles, {'Nobody.level': [1, 2]})
+
+    def test_writes_every_cell(self):
+        sweep = Sweep(test_roles, grid, iterations=10, seed=1)
+        self.assertEqual(sweep.run(self.path), 8)
+        results = read_results(self.path)
+        self.assertEqual(results['cell'], list(range(8)))
+        for i in range(8):
+            self.assertEqual(results['wins_Red'][i] + results['wins_Blue'][i] + results['draws'][i], 10)
+            self.assertAlmostEqual(results['rate_Red'][i], results['wins_Red'][i] / 10)
+        # a level 6 Glenda in plate mail beats a level 1 Glenda without armor
+        self.assertGreater(results['wins_Red'][7], results['wins_Red'][4])
+
+    def test_resume(self):
+        Sweep(test_roles, grid, iterations=10, seed=1).run(self.path)
+        complete = self.rows()
+        with open(self.path, 'w', newline='') as file:
+            csv.writer(file).writerows(complete[:4])  # interrupted after three cells
+
+        self.assertEqual(Sweep(test_roles, grid, iterations=10, seed=1).run(self.path), 5)
+        self.assertEqual(self.rows(), complete)
+        self.assertEqual(Sweep(test_roles, grid, iterations=10, seed=1).run(self.path), 0)
+
+    def test_resume_from_another_sweep(self):
+        Sweep(test_roles, grid, iterations=10, seed=1).run(self.path)
+        with self.assertRaises(ValueError):
+            Sweep(test_roles, {'Glenda.level': [1, 2]}, iterations=10, seed=1).run(self.path)
+        other_weapons = dict(grid, **{'Glenda.weapon': ['two-handed sword', 'battle axe']})
+        with self.assertRaises(ValueError):
+            Sweep(test_roles, other_weapons, iterations=10, seed=1).run(self.path)
+        with self.assertRaises(ValueError):
+            Sweep(test_roles, grid, iterations=10, seed=99).run(self.path)
+        with self.assertRaises(ValueError):
+            Sweep(test_roles, grid, iterations=20, seed=1).run(self.path)
+
+    def test_resume_unseeded(self):
+        Sweep(test_roles, grid, iterations=10).run(self.path)
+        complete = self.rows()
+        with open(self.path, 'w', newline='') as file:
+            csv.writer(file).writerows(complete[:4])
+        sweep = Sweep(test_roles, grid, iterations=10)
+        self.assertEqual(sweep.run(self.path), 5)  # on with the seed the file was started with
+        self.assertEqual(self.rows(), complete)
+
+    def test_workers_agree(self):
+        Sweep(test_roles, grid, iterations=10, seed=1).run(self.path)
+        serial = self.rows()
+        Sweep(test_roles, grid, iterations=10, seed=1, workers=2).run(self.path, resume=False)
+        self.assertEqual(self.rows(), serial)
+
+    @unittest.skipUnless(numpy, 'numpy is not installed')
+    def test_save_npz(self):
+        Sweep(test_roles, grid, iterations=10, seed=1).run(self.path)
+        with numpy.load(save_npz(self.path)) as arrays:
+            self.assertEqual(list(arrays['cell']), list(range(8)))
+            self.assertEqual(list(arrays['Glenda.level']), ['1', '6'] * 4)
+            self.assertEqual(arrays['wins_Red'].dtype.kind, 'i')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# test_tournament.py
+import unittest
+from ai import BaseAI, GreatestThreatAI, RandomAttackAI, DefensiveAI, LowestHealthAI
+from fighter import Fighter
+from tournament import Elo, Glicko, Tournament
+
+setups = [[
+    {'name': 'Glenda', 'faction': 'Red', 'level': 4, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': None},
+    {'name': 'Hiro', 'faction': 'Blue', 'level': 4, 'class': Fighter, 'weapon': 'long sword', 'armor': 'chain mail', 'shield': None, 'ai': None},
+], [
+    {'name': 'Glenda', 'faction': 'Red', 'level': 3, 'class': Fighter, 'weapon': 'spear', 'armor': 'leather armor', 'shield': 'small shield', 'ai': None},
+    {'name': 'Bob', 'faction': 'Red', 'level': 2, 'class': Fighter, 'weapon': 'sling', 'armor': None, 'shield': None, 'ai': None},
+    {'name': 'Hiro', 'faction': 'Blue', 'level': 3, 'class': Fighter, 'weapon': 'two-handed sword', 'armor': 'leather armor', 'shield': None, 'ai': None},
+    {'name': 'Alice', 'faction': 'Blue', 'level': 2, 'class': Fighter, 'weapon': 'trident', 'armor': 'ring mail', 'shield': None, 'ai': None},
+]]
+
+class PacifistAI(BaseAI):
+    def take_turn(self, fighter):
+        fighter.take_defensive_action()
+
+class TestRatings(unittest.TestCase):
+    def test_elo(self):
+        elo = Elo()
+        self.assertEqual(elo.expected('a', 'b'), 0.5)
+        elo.update('a', 'b', 30, 40)
+        self.assertAlmostEqual(elo.rating('a'), 1508)
+        self.assertAlmostEqual(elo.rating('a') + elo.rating('b'), 3000)
+
+    def test_glicko(self):
+        glicko = Glicko()
+        glicko.update('a', 'b', 30, 40)
+        rating, deviation = glicko.ratings['a']
+        self.assertGreater(rating, 1500)
+        self.assertLess(deviation, 350)
+        self.assertAlmostEqual(rating - 1500, 1500 - glicko.rating('b'))
+        glicko.update('a', 'b', 20, 40)  # an even batch between unequal ratings pulls them together
+        self.assertLess(glicko.rating('a'), rating)
+
+class TestTournament(unittest.TestCase):
+    def test_round_robin(self):
+        entrants = [RandomAttackAI(), GreatestThreatAI(), DefensiveAI()]
+        tournament = Tournament(entrants, setups, games=200, batch=10, seed=1, minimum_games=40)
+        standings = tournament.run()
+        self.assertEqual(sorted(name for name, rating in standings), ['DefensiveAI', 'GreatestThreatAI', 'RandomAttackAI'])
+        self.assertEqual(set(tournament.results), {('RandomAttackAI', 'GreatestThreatAI'), ('RandomAttackAI', 'DefensiveAI'),
+                                                  ('GreatestThreatAI', 'DefensiveAI')})
+        for pairing, result in tournament.results.items():
+            self.assertLessEqual(sum(result), 200)
+            self.assertTrue(tournament.is_settled(pairing))
+
+    def test_stops_decided_pairings(self):
+        tournament = Tournament([GreatestThreatAI(), PacifistAI()], setups[:1], games=1000, batch=10, seed=1,
+                                minimum_games=20)
+        tournament.run()
+        pairing = ('GreatestThreatAI', 'PacifistAI')
+        self.assertTrue(tournament.is_decided(pairing))
+        self.assertEqual(sum(tournament.results[pairing]), 20)
+        self.assertEqual(tournament.standings()[0][0], 'GreatestThreatAI')
+
+    def test_seeded(self):
+        entrants = {'threat': GreatestThreatAI(), 'lowest': LowestHealthAI(), 'random': RandomAttackAI()}
+        first = Tournament(entrants, setups, games=80, batch=10, seed=2).run()
+        self.assertEqual(Tournament(entrants, setups, games=80, batch=10, seed=2, workers=2).run(), first)
+
+    def test_swiss(self):
+        entrants = {'a': GreatestThreatAI(), 'b': LowestHealthAI(), 'c': RandomAttackAI(), 'd': DefensiveAI()}
+        tournament = Tournament(entrants, setups[:1], games=40, batch=10, pairing='swiss', rating='glicko', seed=3)
+        tournament.run()
+        self.assertEqual(tournament.rounds, 2)
+        self.assertEqual(len(tournament.results), 4)  # two pairings a round, no rematches
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            Tournament([GreatestThreatAI(), GreatestThreatAI()], setups)
+        with self.assertRaises(ValueError):
+            Tournament([GreatestThreatAI()], [setups[0][:1]])
+        with self.assertRaises(ValueError):
+            Tournament([GreatestThreatAI()], setups, pairing='knockout')
+
+if __name__ == '__main__':
+    unittest.main()
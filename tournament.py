@@ -0,0 +1,192 @@
+# tournament.py
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from math import log, pi, sqrt
+from sweep import run_cell
+import stats
+
+# AI tournaments: entrants play each other through Arena on every team setup,
+# once from each side. Matches are played in batches of battles and the
+# ratings are updated as each batch comes back, in the order the batches
+# were scheduled so the ratings only depend on the seed. A pairing stops
+# getting batches once the interval on its decisive games excludes 50%.
+
+class Elo:
+    def __init__(self, k=32, initial=1500):
+        self.k = k
+        self.initial = initial
+        self.ratings = {}
+
+    def rating(self, name):
+        return self.ratings.get(name, self.initial)
+
+    def expected(self, a, b):
+        return 1 / (1 + 10 ** ((self.rating(b) - self.rating(a)) / 400))
+
+    def update(self, a, b, score, games):
+        # a batch counts as one game, scored by the fraction a won
+        delta = self.k * (score / games - self.expected(a, b))
+        self.ratings[a] = self.rating(a) + delta
+        self.ratings[b] = self.rating(b) - delta
+
+Q = log(10) / 400
+
+class Glicko:
+    def __init__(self, initial=1500, deviation=350, minimum_deviation=30):
+        self.initial = initial
+        self.deviation = deviation
+        self.minimum_deviation = minimum_deviation  # keeps late results from being ignored
+        self.ratings = {}  # name -> (rating, deviation)
+
+    def rating(self, name):
+        return self.ratings.get(name, (self.initial, self.deviation))[0]
+
+    def update(self, a, b, score, games):
+        # Glicko-1 with the batch as one rating period of games against one opponent
+        ra, da = self.ratings.get(a, (self.initial, self.deviation))
+        rb, db = self.ratings.get(b, (self.initial, self.deviation))
+        self.ratings[a] = self.rate(ra, da, rb, db, score, games)
+        self.ratings[b] = self.rate(rb, db, ra, da, games - score, games)
+
+    def rate(self, rating, deviation, opponent, opponent_deviation, score, games):
+        g = 1 / sqrt(1 + 3 * Q * Q * opponent_deviation ** 2 / pi ** 2)
+        expected = 1 / (1 + 10 ** (-g * (rating - opponent) / 400))
+        precision = 1 / deviation ** 2 + Q * Q * games * g * g * expected * (1 - expected)
+        rating += Q / precision * g * (score - games * expected)
+        return rating, max(sqrt(1 / precision), self.minimum_deviation)
+
+RATINGS = {
+    'elo': Elo,
+    'glicko': Glicko,
+}
+
+class Tournament:
+    def __init__(self, entrants, setups, games=1000, batch=50, pairing='round-robin', rounds=None, rating='elo',
+                 seed=None, workers=1, confidence=0.95, interval='wilson', minimum_games=100):
+        if pairing not in ('round-robin', 'swiss'):
+            raise ValueError(f'Unknown pairing: {pairing}')
+        if isinstance(entrants, dict):
+            self.entrants = dict(entrants)
+        else:
+            self.entrants = {type(ai).__name__: ai for ai in entrants}
+            if len(self.entrants) < len(entrants):
+                raise ValueError('Entrants of the same class need names, pass a dict')
+        for setup in setups:
+            if len({role['faction'] for role in setup}) != 2:
+                raise ValueError('Every setup needs exactly two factions')
+        self.setups = setups  # role lists; the ai of each role is replaced by an entrant
+        self.games = games  # cap on battles per pairing
+        self.batch = batch  # battles per setup and side in each pass
+        self.pairing = pairing
+        self.rounds = rounds or max(1, (len(self.entrants) - 1).bit_length())  # swiss rounds
+        self.ratings = RATINGS[rating]()
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.workers = workers
+        self.confidence = confidence
+        self.interval = interval
+        self.minimum_games = minimum_games  # decisive games before a pairing can be settled
+        self.results = {}  # (a, b) -> [wins for a, wins for b, draws]
+
+    def match_roles(self, a, b, setup, side):
+        """The setup's roles with a playing one faction and b the other, swapped on side 1."""
+        factions = sorted({role['faction'] for role in setup})
+        ais = {factions[side]: self.entrants[a], factions[1 - side]: self.entrants[b]}
+        return [dict(role, ai=ais[role['faction']]) for role in setup], factions[side]
+
+    def is_decided(self, pairing):
+        wins, losses, draws = self.results.get(pairing, (0, 0, 0))
+        if wins + losses < self.minimum_games:
+            return False
+        low, high = stats.interval(wins, wins + losses, self.confidence, self.interval)
+        return low > 0.5 or high < 0.5
+
+    def is_settled(self, pairing):
+        # decided, or out of games
+        return sum(self.results.get(pairing, ())) >= self.games or self.is_decided(pairing)
+
+    def run(self):
+        pool = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            if self.pairing == 'round-robin':
+                self.play(pool, list(combinations(self.entrants, 2)), 'round-robin')
+            else:
+                for round in range(self.rounds):
+                    self.play(pool, self.swiss_pairings(), f'round-{round}')
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+        return self.standings()
+
+    def swiss_pairings(self):
+        # neighbours in the standings, avoiding rematches where possible; an odd one out sits the round out
+        order = list(self.entrants)
+        unpaired = [name for name, rating in self.standings()]
+        pairings = []
+        while len(unpaired) > 1:
+            a = unpaired.pop(0)
+            b = next((b for b in unpaired if tuple(sorted((a, b), key=order.index)) not in self.results), unpaired[0])
+            unpaired.remove(b)
+            pairings.append(tuple(sorted((a, b), key=order.index)))  # one key per pairing, in entrant order
+        return pairings
+
+    def jobs(self, pairings, stage):
+        passes = (self.games + self.batch * 2 * len(self.setups) - 1) // (self.batch * 2 * len(self.setups))
+        for n in range(passes):
+            for a, b in pairings:
+                if self.is_settled((a, b)):
+                    continue
+                for i, setup in enumerate(self.setups):
+                    for side in (0, 1):
+                        roles, faction = self.match_roles(a, b, setup, side)
+                        yield (a, b), faction, roles, f'{self.seed}/{stage}/{a}/{b}/setup-{i}/side-{side}/{n}'
+
+    def play(self, pool, pairings, stage):
+        for (a, b), faction, battles, wins in run_jobs(pool, self.jobs(pairings, stage), self.batch, 2 * self.workers):
+            if self.is_settled((a, b)):
+                continue  # scheduled before the pairing settled
+            won = wins.get(faction, 0)
+            lost = sum(wins.values()) - won
+            result = self.results.setdefault((a, b), [0, 0, 0])
+            result[0] += won
+            result[1] += lost
+            result[2] += battles - won - lost
+            self.ratings.update(a, b, won + (battles - won - lost) / 2, battles)
+
+    def standings(self):
+        """(name, rating) from first to last."""
+        return sorted(((name, self.ratings.rating(name)) for name in self.entrants), key=lambda item: -item[1])
+
+    def print_standings(self):
+        print('Standings:')
+        for place, (name, rating) in enumerate(self.standings(), 1):
+            print(f'{place}. {name}: {rating:.0f}')
+        for (a, b), (wins, losses, draws) in self.results.items():
+            decided = '' if self.is_decided((a, b)) else ' (undecided)'
+            print(f'{a} vs {b}: {wins}-{losses}-{draws}{decided}')
+
+def run_jobs(pool, jobs, battles, window):
+    """Each job's (pairing, faction, battles, wins), in job order."""
+    if pool is None:
+        for pairing, faction, roles, seed in jobs:
+            iterations, wins = run_cell(roles, battles, seed, {})
+            yield pairing, faction, iterations, wins
+        return
+
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < window:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                pairing, faction, roles, seed = job
+                pending.append((pairing, faction, pool.submit(run_cell, roles, battles, seed, {})))
+            if not pending:
+                break
+            pairing, faction, future = pending.popleft()
+            yield pairing, faction, *future.result()
+    finally:
+        for pairing, faction, future in pending:
+            future.cancel()